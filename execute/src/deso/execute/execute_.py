@@ -60,6 +60,7 @@ from os import (
   O_RDWR,
   O_CLOEXEC,
   _exit,
+  chdir,
   close as close_,
   devnull,
   dup2,
@@ -157,8 +158,14 @@ class ProcessError(RuntimeError):
     return self._stderr
 
 
-def _exec(*args, env=None):
+def _exec(*args, env=None, cwd=None):
   """Convenience wrapper around the set of exec* functions."""
+  # The working directory is changed here, in the child, right before
+  # the new image is loaded. That way the parent's working directory
+  # (which is process global state) is never touched.
+  if cwd is not None:
+    chdir(cwd)
+
   # We do not use the exec*p* set of execution functions here, although
   # that might be tempting. The reason is that by enforcing users to
   # specify the full path of an executable we basically force them to
@@ -196,15 +203,15 @@ def _waitpid(pid):
       return 1
 
 
-def execute(*args, env=None, stdin=None, stdout=None, stderr=b""):
+def execute(*args, env=None, cwd=None, stdin=None, stdout=None, stderr=b""):
   """Execute a program synchronously."""
   # Note that 'args' is a tuple. We do not want that so explicitly
   # convert it into a list. Then create another list out of this one to
   # effectively have a pipeline.
-  return pipeline([list(args)], env, stdin, stdout, stderr)
+  return pipeline([list(args)], env, stdin, stdout, stderr, cwd=cwd)
 
 
-def _pipeline(commands, env, fd_in, fd_out, fd_err):
+def _pipeline(commands, env, fd_in, fd_out, fd_err, cwd=None):
   """Run a series of commands connected by their stdout/stdin."""
   pids = []
   first = True
@@ -241,7 +248,7 @@ def _pipeline(commands, env, fd_in, fd_out, fd_err):
       # the pipe between the processes in any way.
       dup2(fd_err, stderr_.fileno())
 
-      _exec(*command, env=env)
+      _exec(*command, env=env, cwd=cwd)
       # This statement should never be reached: either exec fails in
       # which case a Python exception should be raised or the program is
       # started in which case this process' image is overwritten anyway.
@@ -290,8 +297,11 @@ def formatCommands(commands):
       determine how to properly format the commands at each level.
     """
     # We have reached a string (or something else "atomic" in our
-    # sense). We can stop here.
+    # sense). We can stop here. Arguments may also be passed in as
+    # bytes, in which case we decode them for display purposes.
     if not isinstance(commands, list):
+      if isinstance(commands, bytes):
+        commands = commands.decode("utf-8", "replace")
       return commands, depth_now
 
     strings = []
@@ -610,7 +620,7 @@ class _PipelineFileDescriptors:
            self._stderr["data"] if self._stderr else b""
 
 
-def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
+def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b"", cwd=None):
   """Execute a pipeline, supplying the given data to stdin and reading from stdout & stderr.
 
     This function executes a pipeline of commands and connects their
@@ -622,6 +632,9 @@ def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
     or be used as the initial buffer content of data to read (stdout and
     stderr) of the last command (which means all actually read data will
     just be appended).
+    If a working directory is provided through the 'cwd' parameter all
+    commands are started in this directory, otherwise they inherit the
+    working directory of the current process.
   """
   with defer() as later:
     with defer() as here:
@@ -630,7 +643,7 @@ def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
 
       # Finally execute our pipeline and pass in the prepared file
       # descriptors to use.
-      pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr())
+      pids = _pipeline(commands, env, fds.stdin(), fds.stdout(), fds.stderr(), cwd)
 
     for _ in fds.poll():
       pass
@@ -655,7 +668,7 @@ def pipeline(commands, env=None, stdin=None, stdout=None, stderr=b""):
     return data_err
 
 
-def _spring(commands, env, fds):
+def _spring(commands, env, fds, cwd=None):
   """Execute a series of commands and accumulate their output to a single destination.
 
     Due to the nature of springs control flow here is a bit tricky. We
@@ -723,7 +736,7 @@ def _spring(commands, env, fds):
         close_(fd_in_new)
         close_(fd_out_new)
 
-      _exec(*command, env=env)
+      _exec(*command, env=env, cwd=cwd)
       _exit(-1)
     else:
       # After we started the first command from the spring we need to
@@ -733,7 +746,7 @@ def _spring(commands, env, fds):
       # in the form of a pipeline.
       if first:
         if pipe_cmds:
-          pids += _pipeline(pipe_cmds, env, fd_in_new, fd_out, fd_err)
+          pids += _pipeline(pipe_cmds, env, fd_in_new, fd_out, fd_err, cwd)
 
         first = False
 
@@ -772,7 +785,7 @@ def _spring(commands, env, fds):
   return pids, poller, status, failed
 
 
-def spring(commands, env=None, stdout=None, stderr=b""):
+def spring(commands, env=None, stdout=None, stderr=b"", cwd=None):
   """Execute a series of commands and accumulate their output to a single destination."""
   with defer() as later:
     with defer() as here:
@@ -787,7 +800,7 @@ def spring(commands, env=None, stdout=None, stderr=b""):
 
       # Finally execute our spring and pass in the prepared file
       # descriptors to use.
-      pids, poller, status, failed = _spring(commands, env, fds)
+      pids, poller, status, failed = _spring(commands, env, fds, cwd)
 
     # We started all processes and will wait for them to finish. From
     # now on we can allow any invocation of poll to block.
@@ -32,10 +32,12 @@ from deso.execute.execute_ import (
 )
 from os import (
   environ,
+  getcwd,
   remove,
 )
 from os.path import (
   isfile,
+  realpath,
 )
 from re import (
   escape,
@@ -58,6 +60,7 @@ from sys import (
 from tempfile import (
   mktemp,
   NamedTemporaryFile,
+  TemporaryDirectory,
   TemporaryFile,
 )
 from textwrap import (
@@ -78,19 +81,19 @@ _TR = findCommand("tr")
 _DD = findCommand("dd")
 
 
-def execute(*args, env=None, stdin=None, stdout=None, stderr=None):
+def execute(*args, env=None, cwd=None, stdin=None, stdout=None, stderr=None):
   """Run a program with reading from stderr disabled by default."""
-  return execute_(*args, env=env, stdin=stdin, stdout=stdout, stderr=stderr)
+  return execute_(*args, env=env, cwd=cwd, stdin=stdin, stdout=stdout, stderr=stderr)
 
 
-def pipeline(commands, env=None, stdin=None, stdout=None, stderr=None):
+def pipeline(commands, env=None, stdin=None, stdout=None, stderr=None, cwd=None):
   """Run a pipeline with reading from stderr disabled by default."""
-  return pipeline_(commands, env=env, stdin=stdin, stdout=stdout, stderr=stderr)
+  return pipeline_(commands, env=env, stdin=stdin, stdout=stdout, stderr=stderr, cwd=cwd)
 
 
-def spring(commands, env=None, stdout=None, stderr=None):
+def spring(commands, env=None, stdout=None, stderr=None, cwd=None):
   """Run a spring with reading from stderr disabled by default."""
-  return spring_(commands, env=env, stdout=stdout, stderr=stderr)
+  return spring_(commands, env=env, stdout=stdout, stderr=stderr, cwd=cwd)
 
 
 class TestExecute(TestCase):
@@ -367,6 +370,29 @@ class TestExecute(TestCase):
       del environ["FOOBAR"]
 
 
+  def testExecuteWithWorkingDirectory(self):
+    """Verify that we can run commands in a different working directory."""
+    def doTest(cwd, use_spring):
+      """Run a python script printing the current working directory."""
+      cmd = [executable, "-c", "from os import getcwd; print(getcwd())"]
+      if use_spring:
+        out = spring([[cmd], [_CAT]], cwd=cwd, stdout=b"")
+      else:
+        out = pipeline([cmd, [_CAT]], cwd=cwd, stdout=b"")
+
+      return out[:-1].decode("utf-8")
+
+    cwd = getcwd()
+    for use_spring in (False, True):
+      with TemporaryDirectory() as directory:
+        self.assertEqual(doTest(directory, use_spring), realpath(directory))
+        # Our own working directory must not have been changed.
+        self.assertEqual(getcwd(), cwd)
+
+      # Without a working directory the current one is inherited.
+      self.assertEqual(doTest(None, use_spring), cwd)
+
+
   def testPipelineThrowsForFirstFailure(self):
     """Verify that if some commands fail in a pipeline, the error of the first is reported."""
     for cmd in [_FALSE, _TRUE]:
@@ -446,6 +472,11 @@ class TestExecute(TestCase):
                "/bin/tr a a"
     self.assertEqual(formatCommands(commands), expected)
 
+    # Case 7) A command with arguments passed in as bytes.
+    command = [_ECHO, b"test", "test2"]
+    expected = "{echo} test test2".format(echo=_ECHO)
+    self.assertEqual(formatCommands(command), expected)
+
 
   def testPipelineSingleProgram(self):
     """Verify that a pipeline can run a single program."""
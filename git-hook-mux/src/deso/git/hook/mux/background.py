@@ -0,0 +1,170 @@
+# background.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Running of hooks continuing in the background once over budget."""
+
+from deso.execute import (
+  execute,
+  formatCommands,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  writeAll,
+)
+from json import (
+  loads,
+)
+from os import (
+  close,
+  listdir,
+  makedirs,
+  set_inheritable,
+  unlink,
+)
+from os.path import (
+  join,
+)
+from sys import (
+  executable,
+  stdout,
+  stderr,
+)
+from tempfile import (
+  mkstemp,
+)
+from threading import (
+  Thread,
+)
+from time import (
+  time,
+)
+
+
+# A wrapper running a hook detached from the invoking git command,
+# recording its output and, once it finished, the result.
+BACKGROUND_WRAPPER = """\
+from deso.execute import execute, ProcessError
+from json import dumps
+from os import rename, set_inheritable, setsid
+from sys import argv
+from time import monotonic
+
+setsid()
+result, slot, hook, command = argv[1], argv[2], argv[3], argv[4:]
+# We hold on to the hook slot until the hook finished, but the hook
+# itself does not need to know about it.
+if slot:
+  set_inheritable(int(slot), False)
+start = monotonic()
+with open(result[:-len(".json")] + ".log", "ab") as log:
+  try:
+    execute(*command, stdin=0, stdout=log.fileno(), stderr=log.fileno())
+    status = 0
+  except ProcessError as e:
+    status = e.status
+
+with open(result + ".tmp", "w") as f:
+  f.write(dumps({"hook": hook, "status": status, "duration": monotonic() - start}))
+rename(result + ".tmp", result)
+exit(status)
+"""
+
+
+def retrieveBackgroundDirectory():
+  """Retrieve the directory containing the output and results of hooks run in the background."""
+  directory = join(retrieveDataDirectory(), "background")
+  makedirs(directory, exist_ok=True)
+  return directory
+
+
+def runInBackground(hook, cmd, deadline, cwd=None, env=None, input_=None, slot=None,
+                    output=None):
+  """Run a hook, continuing it in the background should it not finish by the given deadline.
+
+    The result is True if the hook finished in time, in which case its
+    output is written to the given file descriptor (or stdout) and a
+    failure reported by means of a ProcessError, and False otherwise. A hook slot, if given, is
+    inherited by the background process, which holds it until the hook
+    finished.
+  """
+  fd, log = mkstemp(prefix="hook-", suffix=".log", dir=retrieveBackgroundDirectory())
+  close(fd)
+  result = log[:-len(".log")] + ".json"
+  if slot is not None:
+    set_inheritable(slot, True)
+  slot_ = str(slot) if slot is not None else ""
+  wrapper = [executable, "-c", BACKGROUND_WRAPPER, result, slot_, hook] + cmd
+  errors = []
+
+  def run():
+    """Run the wrapper, completely detached from our stdout and stderr."""
+    try:
+      execute(*wrapper, env=env, cwd=cwd, stdin=input_, stdout=None, stderr=None)
+    except ProcessError as e:
+      errors.append(e)
+
+  # Should the hook not finish in time we just stop waiting for it. The
+  # thread does not keep us from exiting and the wrapper continues on
+  # its own.
+  thread = Thread(target=run, daemon=True)
+  thread.start()
+  thread.join(max(deadline - time(), 0))
+  if thread.is_alive():
+    return False
+
+  with open(log, "rb") as f:
+    data = f.read()
+
+  unlink(log)
+  unlink(result)
+  stdout.flush()
+  stderr.flush()
+  writeAll(stdout.fileno() if output is None else output, data)
+
+  if errors:
+    raise ProcessError(errors[0].status, formatCommands(cmd))
+  return True
+
+
+def reportBackground():
+  """Report the results of all hooks that finished in the background since the last invocation."""
+  directory = retrieveBackgroundDirectory()
+  for name in sorted(listdir(directory)):
+    if not name.endswith(".json"):
+      continue
+
+    path = join(directory, name)
+    with open(path) as f:
+      result = loads(f.read())
+
+    log = path[:-len(".json")] + ".log"
+    print("Hook finished in the background with status %d after %.1fs: %s"
+          % (result["status"], result["duration"], result["hook"]), file=stderr)
+    # Output of successful hooks is of no interest anymore.
+    if result["status"] != 0:
+      with open(log, "rb") as f:
+        stderr.flush()
+        stderr.buffer.write(f.read())
+        stderr.buffer.flush()
+
+    unlink(log)
+    unlink(path)
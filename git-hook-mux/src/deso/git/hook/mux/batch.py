@@ -0,0 +1,153 @@
+# batch.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The command running hooks in many repositories."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  ProcessError,
+)
+from deso.git.hook.mux.cache import (
+  createToolCaches,
+)
+from deso.git.hook.mux.config import (
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  retrieveConfig,
+  retrieveHookList,
+)
+from deso.git.hook.mux.hooks import (
+  retrieveLocalEnvironment,
+  runHooks,
+)
+from deso.git.hook.mux.stats import (
+  createStatistics,
+)
+from os import (
+  cpu_count,
+)
+from os.path import (
+  abspath,
+)
+from sys import (
+  executable,
+  stdin,
+  stdout,
+  stderr,
+)
+from tempfile import (
+  TemporaryFile,
+)
+from time import (
+  monotonic,
+)
+
+
+def runRepository(repository, hook_type, section, this_prog, env):
+  """Run the hooks configured for a repository, returning the error and captured output."""
+  config = retrieveConfig(cwd=repository)
+  hooks = retrieveHookList(config, section, hook_type)
+  statistics = createStatistics(config, hook_type, section, cwd=repository)
+  caches = createToolCaches(config, section, hook_type, hooks, cwd=repository)
+
+  with TemporaryFile() as f:
+    try:
+      runHooks(hooks, [], this_prog, statistics, cwd=repository, env=env,
+               output=f.fileno(), caches=caches)
+      error = None
+    except ProcessError as e:
+      error = e
+
+    if caches is not None:
+      caches.evict()
+    f.seek(0)
+    return error, f.read()
+
+
+def batch(argv):
+  """Run the hooks of a certain type in a set of repositories."""
+  parser = ArgumentParser(prog="%s batch" % PROGRAM)
+  parser.add_argument(
+    "repositories", action="store", default=[], nargs="*",
+    help="The repositories to run the hooks in. If none are given, they "
+         "are read from stdin, one per line.",
+  )
+  parser.add_argument(
+    "-s", "--section", action="store", default=GIT_HOOK_SECTION,
+    dest="section",
+    help="The name of the git-config(1) section to use (defaults to "
+         "'%s')." % GIT_HOOK_SECTION,
+  )
+  parser.add_argument(
+    "-t", "--hook-type", action="store", required=True, dest="hook_type",
+    help="The type of hook to invoke (e.g., 'pre-commit').",
+  )
+  parser.add_argument(
+    "-j", "--jobs", action="store", type=int, default=cpu_count() or 1,
+    dest="jobs",
+    help="The maximum number of repositories to process in parallel "
+         "(defaults to the number of available cores).",
+  )
+  namespace = parser.parse_args(argv[2:])
+  repositories = namespace.repositories
+  if not repositories:
+    repositories = [line.strip() for line in stdin if line.strip()]
+
+  repositories = list(map(abspath, repositories))
+  this_prog = [executable, abspath(argv[0]), "--hook-type=%s" % namespace.hook_type]
+  env = retrieveLocalEnvironment()
+
+  def run(repository):
+    """Run the hooks in a single repository and measure the time it took."""
+    start = monotonic()
+    error, output = runRepository(repository, namespace.hook_type,
+                                  namespace.section, this_prog, env)
+    return error, output, monotonic() - start
+
+  from concurrent.futures import (
+    ThreadPoolExecutor,
+  )
+
+  # All repositories are processed in this very process. That way we
+  # only pay for the start up and for resolving commands once, and
+  # only nested invocations of ourselves require a new process.
+  with ThreadPoolExecutor(max_workers=max(namespace.jobs, 1)) as pool:
+    results = list(pool.map(run, repositories))
+
+  failed = 0
+  for repository, (error, output, _) in zip(repositories, results):
+    if output or error is not None:
+      print("Repository: %s" % repository)
+      stdout.flush()
+      stdout.buffer.write(output)
+      stdout.buffer.flush()
+
+    if error is not None:
+      print("%s: %s" % (repository, error), file=stderr)
+      failed += 1
+
+  print("Summary:")
+  for repository, (error, _, duration) in zip(repositories, results):
+    status = error.status if error is not None else 0
+    print("  %s  status: %d, duration: %.3fs" % (repository, status, duration))
+
+  print("%d repositories, %d failed" % (len(repositories), failed))
+  return 1 if failed > 0 else 0
@@ -0,0 +1,185 @@
+# blobs.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A service computing the blob IDs of files on behalf of nested invocations."""
+
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  BLOBS_VARIABLE,
+  GIT,
+  PROGRAM,
+)
+from deso.git.hook.mux.files import (
+  retrieveIndex,
+  splitNul,
+  writeAll,
+)
+from os import (
+  O_CLOEXEC,
+  close,
+  environ,
+  pipe2,
+)
+from os.path import (
+  isfile,
+  join,
+)
+from select import (
+  POLLIN,
+  poll,
+)
+from shutil import (
+  rmtree,
+)
+from socket import (
+  AF_UNIX,
+  SOCK_STREAM,
+  socket,
+)
+from tempfile import (
+  mkdtemp,
+)
+from threading import (
+  Event,
+  Lock,
+  Thread,
+)
+
+
+def retrieveBlobIds(files, cwd=None):
+  """Determine the object IDs of the worktree contents of the given files."""
+  index = {path: object_ for _, object_, stage, path in retrieveIndex(cwd=cwd)
+           if stage == "0"}
+  # For files without unstaged changes the object ID is recorded in the
+  # index and we do not have to read and hash them ourselves.
+  cmd = [GIT, "diff", "--name-only", "--relative", "-z"]
+  modified = set(splitNul(execute(*cmd, cwd=cwd, stdout=b"", stderr=None)))
+  ids = {}
+  hash_ = []
+
+  for file_ in files:
+    if file_ in index and file_ not in modified:
+      ids[file_] = index[file_]
+    elif isfile(join(cwd or "", file_)):
+      hash_ += [file_]
+
+  if hash_:
+    data = "".join("%s\n" % file_ for file_ in hash_).encode("utf-8")
+    cmd = [GIT, "hash-object", "--stdin-paths"]
+    out = execute(*cmd, cwd=cwd, stdin=data, stdout=b"", stderr=None)
+    ids.update(zip(hash_, out.decode("utf-8").split()))
+
+  return ids
+
+
+class BlobService:
+  """A service providing the contents of objects to hooks, backed by a single git cat-file process.
+
+    Hooks connect to a Unix domain socket and speak the protocol of
+    'git cat-file --batch' over it: each request is a line naming an
+    object (e.g., ':path' for a staged file or an object ID), answered
+    by a header line and, unless the object is missing, its contents.
+  """
+  def __init__(self, path, cwd=None, env=None):
+    """Start the service, listening on a socket at the given path."""
+    in_r, self._in = pipe2(O_CLOEXEC)
+    out, out_w = pipe2(O_CLOEXEC)
+    self._out = open(out, "rb")
+    # The cat-file process can only work on one request at a time.
+    self._lock = Lock()
+    self._stop = Event()
+
+    def run():
+      """Run git cat-file, connected to our pipes."""
+      try:
+        cmd = [GIT, "cat-file", "--batch"]
+        execute(*cmd, env=env, cwd=cwd, stdin=in_r, stdout=out_w, stderr=None)
+      except ProcessError:
+        pass
+      finally:
+        close(in_r)
+        close(out_w)
+
+    self._process = Thread(target=run, daemon=True)
+    self._process.start()
+
+    self._server = socket(AF_UNIX, SOCK_STREAM)
+    self._server.bind(path)
+    self._server.listen()
+    self._thread = Thread(target=self._serve, daemon=True)
+    self._thread.start()
+
+
+  def _serve(self):
+    """Accept connections until we are stopped."""
+    poller = poll()
+    poller.register(self._server.fileno(), POLLIN)
+
+    while not self._stop.is_set():
+      if poller.poll(100):
+        connection, _ = self._server.accept()
+        Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+
+  def _handle(self, connection):
+    """Answer all requests arriving on a connection."""
+    with connection, connection.makefile("rb") as f:
+      for request in f:
+        request = request.rstrip(b"\n") + b"\n"
+        with self._lock:
+          writeAll(self._in, request)
+          header = self._out.readline()
+          response = header
+          # Existing objects are reported as '<oid> <type> <size>' and
+          # followed by their contents and a newline.
+          fields = header.split()
+          if len(fields) == 3 and fields[2].isdigit():
+            response += self._out.read(int(fields[2]) + 1)
+
+        try:
+          connection.sendall(response)
+        except BrokenPipeError:
+          break
+
+
+  def close(self):
+    """Stop the service and the git cat-file process."""
+    self._stop.set()
+    self._thread.join()
+    self._server.close()
+    close(self._in)
+    self._process.join()
+    self._out.close()
+
+
+def setupBlobService(later, cwd=None, env=None):
+  """Start the blob service for the current run and set up the environment for hooks to find it."""
+  directory = mkdtemp(prefix="%s-" % PROGRAM)
+  later.defer(rmtree, directory, ignore_errors=True)
+
+  path = join(directory, "blobs")
+  service = BlobService(path, cwd=cwd, env=env)
+  later.defer(service.close)
+
+  env = dict(environ if env is None else env)
+  env[BLOBS_VARIABLE] = path
+  return env
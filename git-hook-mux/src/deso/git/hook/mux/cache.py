@@ -0,0 +1,288 @@
+# cache.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Caching of hook results and of the caches of the tools run by hooks."""
+
+from deso.git.hook.mux.blobs import (
+  retrieveBlobIds,
+)
+from deso.git.hook.mux.config import (
+  CACHE_DIR_VARIABLE,
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  configBool,
+  configInt,
+  configValues,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  filterFiles,
+)
+from fcntl import (
+  LOCK_EX,
+  flock,
+)
+from hashlib import (
+  sha1,
+)
+from json import (
+  dumps,
+  loads,
+)
+from os import (
+  O_APPEND,
+  O_CLOEXEC,
+  O_CREAT,
+  O_WRONLY,
+  close,
+  environ,
+  listdir,
+  lstat,
+  makedirs,
+  open as open_,
+  rename,
+  unlink,
+  walk,
+  write,
+)
+from os.path import (
+  basename,
+  expanduser,
+  isdir,
+  join,
+  realpath,
+)
+from shlex import (
+  split as shsplit,
+)
+from shutil import (
+  rmtree,
+)
+from time import (
+  time,
+)
+
+
+class ResultCache:
+  """A cache of the files for which hooks succeeded, keyed by the files' contents.
+
+    For each hook we remember the object IDs of the file contents it
+    succeeded on. A hook then only has to run on files with contents it
+    has not seen before. Note that this scheme assumes that hooks check
+    each file in isolation and based on its content only.
+  """
+  def __init__(self, directory, cwd=None):
+    """Initialize the cache, storing its data in the given directory."""
+    self._directory = directory
+    self._cwd = cwd
+    self._ids = {}
+
+
+  def _path(self, hook):
+    """Retrieve the path to the file containing the object IDs a hook succeeded on."""
+    return join(self._directory, sha1(hook.encode("utf-8")).hexdigest())
+
+
+  def _retrieveIds(self, files):
+    """Retrieve the object IDs for the given files."""
+    missing = [file_ for file_ in files if file_ not in self._ids]
+    if missing:
+      self._ids.update(retrieveBlobIds(missing, cwd=self._cwd))
+
+    return self._ids
+
+
+  def filter(self, hook, files):
+    """Filter out all files with contents the given hook succeeded on already."""
+    ids = self._retrieveIds(files)
+    try:
+      with open(self._path(hook), "r") as f:
+        validated = set(f.read().split())
+    except FileNotFoundError:
+      validated = set()
+
+    return filterFiles(files, lambda file_: ids.get(file_) not in validated)
+
+
+  def validate(self, hook, files):
+    """Remember that the given hook succeeded on the given files."""
+    ids = self._retrieveIds(files)
+    data = "".join("%s\n" % ids[file_] for file_ in files if file_ in ids)
+
+    fd = open_(self._path(hook), O_WRONLY | O_APPEND | O_CREAT | O_CLOEXEC, 0o644)
+    try:
+      flock(fd, LOCK_EX)
+      write(fd, data.encode("utf-8"))
+    finally:
+      close(fd)
+
+
+def createResultCache(config, section, cwd=None):
+  """Create a ResultCache object if caching is enabled for the given section."""
+  if not configBool(config, section, "cache"):
+    return None
+
+  directory = join(retrieveDataDirectory(cwd=cwd), "cache")
+  makedirs(directory, exist_ok=True)
+  return ResultCache(directory, cwd=cwd)
+
+
+def measureDirectory(path):
+  """Measure the accumulated size of all files below a directory."""
+  size = 0
+  for directory, _, names in walk(path):
+    for name in names:
+      try:
+        size += lstat(join(directory, name)).st_size
+      except FileNotFoundError:
+        pass
+
+  return size
+
+
+class ToolCaches:
+  """Persistent cache directories for the tools run by hooks, bounded in total size.
+
+    Every hook gets a directory of its own, stable across runs, which it
+    finds in the environment. The directory is cleared whenever the
+    hook's command changes. Once the directories of all repositories
+    below the root exceed the size budget, the least recently used ones
+    are removed. Directories are only measured when checking the
+    budget, and only if they were used since they were last measured.
+  """
+  def __init__(self, root, repository, max_size, section, hook_type, hooks):
+    """Initialize the caches for the given hooks of a repository."""
+    self._root = root
+    self._directory = join(root, sha1(repository.encode("utf-8")).hexdigest())
+    self._max_size = max_size
+    self._names = {}
+    counts = {}
+
+    # Hooks are identified by their position among the section's hooks
+    # running the same tool, so that a hook keeps its cache when its
+    # arguments change, albeit cleared.
+    for hook in hooks:
+      if "<self>" in hook or hook in self._names:
+        continue
+
+      args = shsplit(hook)
+      tool = basename(args[0]) if args else ""
+      count = counts.get(tool, 0)
+      counts[tool] = count + 1
+      self._names[hook] = "%s.%s.%s.%d" % (section, hook_type, tool, count)
+
+
+  def _paths(self, hook):
+    """Retrieve the paths to the directory and the metadata of a hook's cache."""
+    path = join(self._directory, self._names[hook])
+    return path, path + ".json"
+
+
+  def environment(self, hook, env=None):
+    """Prepare the cache directory of a hook and retrieve the environment for running it."""
+    if hook not in self._names:
+      return env
+
+    path, meta = self._paths(hook)
+    try:
+      with open(meta) as f:
+        command = loads(f.read())["command"]
+    except FileNotFoundError:
+      command = None
+
+    # The contents may not be usable by a different command line.
+    if command != hook:
+      rmtree(path, ignore_errors=True)
+    makedirs(path, exist_ok=True)
+
+    env = dict(environ if env is None else env)
+    env[CACHE_DIR_VARIABLE] = path
+    return env
+
+
+  @staticmethod
+  def _write(meta, data):
+    """Atomically write the metadata of a cache directory."""
+    with open(meta + ".tmp", "w") as f:
+      f.write(dumps(data))
+    rename(meta + ".tmp", meta)
+
+
+  def update(self, hook):
+    """Record the time of last use of a hook's cache directory."""
+    if hook not in self._names:
+      return
+
+    # The hook may have changed the directory's contents and with them
+    # its size, which is unknown until the next eviction measures it.
+    _, meta = self._paths(hook)
+    ToolCaches._write(meta, {"command": hook, "size": None, "used": time()})
+
+
+  def evict(self):
+    """Remove the least recently used cache directories until the size budget is met."""
+    fd = open_(join(self._root, "lock"), O_CREAT | O_WRONLY | O_CLOEXEC, 0o644)
+    try:
+      flock(fd, LOCK_EX)
+      caches = []
+      for repository in listdir(self._root):
+        if not isdir(join(self._root, repository)):
+          continue
+
+        for name in listdir(join(self._root, repository)):
+          if name.endswith(".json"):
+            meta = join(self._root, repository, name)
+            with open(meta) as f:
+              data = loads(f.read())
+
+            if data["size"] is None:
+              data["size"] = measureDirectory(meta[:-len(".json")])
+              ToolCaches._write(meta, data)
+            caches += [(data["used"], data["size"], meta)]
+
+      total = sum(size for _, size, _ in caches)
+      for _, size, meta in sorted(caches):
+        if total <= self._max_size:
+          break
+
+        # The metadata goes last, so that a partially removed directory
+        # is still accounted for.
+        rmtree(meta[:-len(".json")], ignore_errors=True)
+        unlink(meta)
+        total -= size
+    finally:
+      close(fd)
+
+
+def createToolCaches(config, section, hook_type, hooks, cwd=None):
+  """Create a ToolCaches object if persistent cache directories are enabled."""
+  if not configBool(config, GIT_HOOK_SECTION, "tool-caches"):
+    return None
+
+  root = configValues(config, GIT_HOOK_SECTION, "tool-cache-root")
+  if root:
+    root = expanduser(root[-1])
+  else:
+    xdg = environ.get("XDG_CACHE_HOME") or expanduser(join("~", ".cache"))
+    root = join(xdg, PROGRAM)
+
+  makedirs(root, exist_ok=True)
+  max_size = configInt(config, GIT_HOOK_SECTION, "tool-cache-size", 1024) * 1024 * 1024
+  repository = realpath(retrieveDataDirectory(cwd=cwd))
+  return ToolCaches(root, repository, max_size, section, hook_type, hooks)
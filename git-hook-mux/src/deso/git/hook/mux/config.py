@@ -0,0 +1,204 @@
+# config.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Constants and access to the git-config(1) based configuration."""
+
+from deso.execute import (
+  execute,
+  findCommand,
+  ProcessError,
+)
+from os import (
+  makedirs,
+)
+from os.path import (
+  abspath,
+  join,
+)
+
+
+GIT = findCommand("git")
+GIT_HOOK_SECTION = "hook-mux"
+PROGRAM = "git-hook-mux"
+# All hook types git knows about, as documented in githooks(5).
+HOOK_TYPES = [
+  "applypatch-msg",
+  "commit-msg",
+  "fsmonitor-watchman",
+  "p4-changelist",
+  "p4-post-changelist",
+  "p4-pre-submit",
+  "p4-prepare-changelist",
+  "post-applypatch",
+  "post-checkout",
+  "post-commit",
+  "post-index-change",
+  "post-merge",
+  "post-receive",
+  "post-rewrite",
+  "post-update",
+  "pre-applypatch",
+  "pre-auto-gc",
+  "pre-commit",
+  "pre-merge-commit",
+  "pre-push",
+  "pre-rebase",
+  "pre-receive",
+  "prepare-commit-msg",
+  "proc-receive",
+  "push-to-checkout",
+  "reference-transaction",
+  "sendemail-validate",
+  "update",
+]
+# The environment variable pointing to the directory to write profiles
+# to. If it is not set, profiling is disabled.
+PROFILE_VARIABLE = "GIT_HOOK_MUX_PROFILE"
+# Hook types git passes data to on stdin. This data is read once and
+# passed on to each hook.
+STDIN_HOOKS = {
+  "post-receive",
+  "post-rewrite",
+  "pre-push",
+  "pre-receive",
+  "reference-transaction",
+}
+# The environment variable pointing to the file with the line ranges
+# changed by the staged changes, if any.
+LINES_VARIABLE = "GIT_HOOK_MUX_LINES"
+# The environment variable containing the point in time (in seconds
+# since the epoch) by which non-blocking hooks have to be done, if any.
+DEADLINE_VARIABLE = "GIT_HOOK_MUX_DEADLINE"
+# The environment variable pointing to the directory to record runs to.
+# If it is not set, recording is disabled.
+RECORD_VARIABLE = "GIT_HOOK_MUX_RECORD"
+# The environment variable pointing to the directory containing a
+# recorded run to replay, if any.
+REPLAY_VARIABLE = "GIT_HOOK_MUX_REPLAY"
+# The environment variable indicating whether to replay runs using stub
+# hooks mimicking the recorded ones ('stub') or the actual ones ('real').
+REPLAY_HOOKS_VARIABLE = "GIT_HOOK_MUX_REPLAY_HOOKS"
+# The environment variable pointing to the directory in which the hooks
+# that succeeded during the current run are recorded, if any.
+LEDGER_VARIABLE = "GIT_HOOK_MUX_LEDGER"
+# The environment variable pointing to the directory containing the
+# per-file locks of the current run, if any.
+LOCKS_VARIABLE = "GIT_HOOK_MUX_LOCKS"
+# The environment variable pointing to the socket of the blob service of
+# the current run, if any.
+BLOBS_VARIABLE = "GIT_HOOK_MUX_BLOBS"
+# The environment variable pointing to the persistent cache directory of
+# the hook being run, if any.
+CACHE_DIR_VARIABLE = "GIT_HOOK_MUX_CACHE_DIR"
+# The environment variable containing the path to the snapshot of staged
+# files hooks are run in, if any.
+SNAPSHOT_VARIABLE = "GIT_HOOK_MUX_SNAPSHOT"
+# The environment variable indicating that hooks are run speculatively,
+# in the background, for the sole purpose of populating the cache.
+SPECULATIVE_VARIABLE = "GIT_HOOK_MUX_SPECULATIVE"
+
+
+def retrieveConfig(cwd=None):
+  """Retrieve the entire git configuration as a dict mapping each key to a list of values."""
+  try:
+    cmd = [GIT, "config", "--null", "--list"]
+    out = execute(*cmd, cwd=cwd, stdout=b"", stderr=None)
+  except ProcessError:
+    return {}
+
+  config = {}
+  # With --null each entry is terminated by a NUL byte and the key is
+  # separated from the value by a newline. Keys without any value (not
+  # even an empty one) do not contain a newline at all.
+  for entry in out.decode("utf-8").split("\0"):
+    if entry:
+      key, newline, value = entry.partition("\n")
+      config.setdefault(key, []).append(value if newline else None)
+
+  return config
+
+
+def configValues(config, section, name):
+  """Retrieve all values of a key in the given section."""
+  # git reports section and key names in lower case but leaves the
+  # case of subsection names untouched.
+  head, dot, tail = section.partition(".")
+  key = "%s%s%s.%s" % (head.lower(), dot, tail, name.lower())
+  return config.get(key, [])
+
+
+def configBool(config, section, name, default=False):
+  """Retrieve a boolean value from the configuration."""
+  values = configValues(config, section, name)
+  if not values:
+    return default
+
+  # A key without a value is considered true.
+  value = values[-1]
+  return value is None or value.lower() in ("true", "yes", "on", "1")
+
+
+def configFloat(config, section, name, default=None):
+  """Retrieve a floating point value from the configuration."""
+  values = configValues(config, section, name)
+  if not values or not values[-1]:
+    return default
+
+  return float(values[-1])
+
+
+def configInt(config, section, name, default=0):
+  """Retrieve an integer value, optionally with a unit suffix, from the configuration."""
+  values = configValues(config, section, name)
+  if not values or not values[-1]:
+    return default
+
+  value = values[-1].strip().lower()
+  units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+  factor = units.get(value[-1:], 1)
+  return int(value[:-1] if factor != 1 else value) * factor
+
+
+def retrieveHookList(config, section, hook_type):
+  """Retrieve the list of configured hooks for the given hook type."""
+  hooks = []
+  for value in configValues(config, section, hook_type):
+    # Split each line reported by git-config into a separate string.
+    # Remove all whitespace only strings.
+    if value is not None:
+      hooks += list(filter(lambda x: x.strip() != "", value.splitlines()))
+
+  return hooks
+
+
+def isVerbose(config, section):
+  """Check if the script should be verbose."""
+  return configBool(config, section, "verbose")
+
+
+def retrieveDataDirectory(cwd=None):
+  """Retrieve the directory in which we store persistent data, creating it if necessary."""
+  # We use the common directory such that all worktrees of a repository
+  # share the data.
+  cmd = [GIT, "rev-parse", "--git-common-dir"]
+  out = execute(*cmd, cwd=cwd, stdout=b"", stderr=None)
+  # The reported directory may be relative to the working directory.
+  directory = abspath(join(cwd or "", out[:-1].decode("utf-8"), "hook-mux"))
+  makedirs(directory, exist_ok=True)
+  return directory
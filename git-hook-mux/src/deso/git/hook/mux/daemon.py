@@ -0,0 +1,167 @@
+# daemon.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Functionality for starting and connecting to daemons serving on Unix domain sockets."""
+
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from fcntl import (
+  LOCK_EX,
+  flock,
+)
+from os import (
+  O_CLOEXEC,
+  O_CREAT,
+  O_WRONLY,
+  close,
+  environ,
+  getpid,
+  getuid,
+  lstat,
+  makedirs,
+  open as open_,
+  rename,
+  unlink,
+)
+from os.path import (
+  join,
+  lexists,
+)
+from socket import (
+  AF_UNIX,
+  SOCK_STREAM,
+  socket,
+)
+from stat import (
+  S_IMODE,
+  S_ISDIR,
+)
+from sys import (
+  executable,
+)
+from tempfile import (
+  gettempdir,
+)
+from threading import (
+  Thread,
+)
+from time import (
+  monotonic,
+  sleep,
+)
+
+
+# A wrapper running one of our daemons, detached from the invoking git
+# command. The daemon's function is looked up by module, which hence
+# has to be importable, just like for the script itself.
+DAEMON_WRAPPER = """\
+from importlib import import_module
+from os import setsid
+from sys import argv
+
+setsid()
+exit(getattr(import_module(argv[1]), argv[2])(argv[3:]))
+"""
+
+
+def retrieveRuntimeDirectory(name):
+  """Retrieve the path of the per-user directory with the given name for keeping sockets."""
+  runtime = environ.get("XDG_RUNTIME_DIR")
+  if runtime:
+    return join(runtime, name)
+  return join(gettempdir(), "%s-%d" % (name, getuid()))
+
+
+def createPrivateDirectory(path):
+  """Create a directory only accessible by the current user, or verify that an existing one is."""
+  makedirs(path, mode=0o700, exist_ok=True)
+  # Anybody could have created the directory before us, in which case
+  # the daemons listening in it could be impersonated.
+  info = lstat(path)
+  if not S_ISDIR(info.st_mode) or info.st_uid != getuid() or S_IMODE(info.st_mode) != 0o700:
+    raise PermissionError("%s is not a directory private to the current user" % path)
+  return path
+
+
+def listenDaemon(base):
+  """Create the listening socket of a daemon, with the given base path."""
+  server = socket(AF_UNIX, SOCK_STREAM)
+  # Clients must only ever see a socket that is accepting connections
+  # already.
+  tmp = "%s.sock.%d" % (base, getpid())
+  server.bind(tmp)
+  server.listen()
+  rename(tmp, base + ".sock")
+  return server
+
+
+def connectDaemon(base):
+  """Connect to the daemon listening on the socket with the given base path."""
+  connection = socket(AF_UNIX, SOCK_STREAM)
+  try:
+    connection.connect(base + ".sock")
+  except OSError:
+    connection.close()
+    raise
+  return connection
+
+
+def startDaemon(base, module, function, args, env=None, timeout=30):
+  """Connect to a daemon, starting it by running the given function of a module first if necessary.
+
+    The result is None if the daemon could not be started.
+  """
+  # Only a single invocation may start the daemon.
+  fd = open_(base + ".lock", O_CREAT | O_WRONLY | O_CLOEXEC, 0o600)
+  try:
+    flock(fd, LOCK_EX)
+    try:
+      return connectDaemon(base)
+    except (ConnectionRefusedError, FileNotFoundError):
+      if lexists(base + ".sock"):
+        unlink(base + ".sock")
+
+    wrapper = [executable, "-c", DAEMON_WRAPPER, module, function, base] + args
+
+    def run():
+      """Run the daemon, completely detached from our stdout and stderr."""
+      try:
+        execute(*wrapper, env=env, stdout=None, stderr=None)
+      except ProcessError:
+        pass
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+
+    start = monotonic()
+    while monotonic() - start < timeout:
+      try:
+        return connectDaemon(base)
+      except (ConnectionRefusedError, FileNotFoundError):
+        pass
+
+      if not thread.is_alive():
+        return None
+      sleep(0.01)
+
+    return None
+  finally:
+    close(fd)
@@ -0,0 +1,414 @@
+# files.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Retrieval and representation of the files hooks are run on."""
+
+from array import (
+  array,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+)
+from itertools import (
+  accumulate,
+  compress,
+  count,
+)
+from operator import (
+  add,
+)
+from os import (
+  O_CLOEXEC,
+  close,
+  pipe2,
+  read,
+  write,
+)
+from os.path import (
+  exists,
+  isfile,
+  join,
+)
+from re import (
+  compile as regex,
+)
+from sys import (
+  stderr,
+)
+from threading import (
+  Thread,
+)
+
+
+# A translation table mapping all whitespace characters to NUL.
+WHITESPACE = bytes.maketrans(b" \t\n\r\x0b\x0c", b"\0" * 6)
+
+
+class FileList:
+  """A compact, immutable list of file paths.
+
+    Instead of keeping one object per path, all paths are stored NUL
+    terminated in a single bytes buffer, along with an array of the
+    offsets at which each path starts (and one past the end of the last
+    one). Slices share the buffer and paths are only decoded when
+    accessed individually.
+  """
+  def __init__(self, data=b"", offsets=None):
+    """Create a file list from a buffer and the offsets of the paths in it."""
+    self._data = data
+    self._offsets = offsets if offsets is not None else array("Q", [0])
+
+
+  @staticmethod
+  def fromNul(data):
+    """Create a file list from NUL terminated paths."""
+    # Splitting the buffer and accumulating the lengths of the parts is
+    # much faster than searching for each terminator in Python.
+    paths = data.split(b"\0")
+    if paths[-1]:
+      data += b"\0"
+    else:
+      paths.pop()
+
+    # Empty paths are dropped.
+    if b"" in paths:
+      paths = [path for path in paths if path]
+      data = b"".join(path + b"\0" for path in paths)
+
+    offsets = array("Q", [0])
+    offsets.extend(map(add, accumulate(map(len, paths)), count(1)))
+    return FileList(data, offsets)
+
+
+  @staticmethod
+  def fromOutput(data):
+    """Create a file list from whitespace separated paths."""
+    return FileList.fromNul(data.translate(WHITESPACE))
+
+
+  @staticmethod
+  def fromPaths(paths):
+    """Create a file list from a sequence of paths."""
+    return FileList.fromNul(b"".join(p.encode("utf-8") + b"\0" for p in paths))
+
+
+  def __len__(self):
+    """Retrieve the number of paths in the list."""
+    return len(self._offsets) - 1
+
+
+  def __getitem__(self, index):
+    """Retrieve a path or, given a slice, a file list sharing our buffer."""
+    if isinstance(index, slice):
+      start, stop, step = index.indices(len(self))
+      assert step == 1, step
+      return FileList(self._data, self._offsets[start:max(start, stop) + 1])
+
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("file list index out of range")
+
+    return self._data[self._offsets[index]:self._offsets[index + 1] - 1].decode("utf-8")
+
+
+  def __iter__(self):
+    """Iterate over all paths in the list."""
+    for start, end in zip(self._offsets, self._offsets[1:]):
+      yield self._data[start:end - 1].decode("utf-8")
+
+
+  def nul(self):
+    """Retrieve all paths, NUL terminated, as a single bytes object."""
+    return self._data[self._offsets[0]:self._offsets[-1]]
+
+
+  def argv(self):
+    """Retrieve the paths in a form suitable for passing them to a process."""
+    return [self._data[start:end - 1] for start, end in zip(self._offsets, self._offsets[1:])]
+
+
+  def filter(self, function):
+    """Create a file list of all paths for which the given function returns True."""
+    # Only the function itself is invoked for every path in Python, the
+    # decoded paths are dropped right away, and only the raw ones kept
+    # end up in the new buffer.
+    paths = self.nul().split(b"\0")
+    paths.pop()
+    kept = compress(paths, map(function, map(bytes.decode, paths)))
+    return FileList.fromNul(b"\0".join(kept) + b"\0")
+
+
+  def unique(self):
+    """Create a file list without duplicate paths, preserving their order."""
+    seen = set()
+    parts = []
+    for start, end in zip(self._offsets, self._offsets[1:]):
+      part = self._data[start:end]
+      if part not in seen:
+        seen.add(part)
+        parts += [part]
+
+    return FileList.fromNul(b"".join(parts))
+
+
+  def split(self, max_files, max_bytes):
+    """Split the list into slices bounded by the number of paths and their accumulated size."""
+    start = 0
+    for end in range(1, len(self) + 1):
+      if end - start >= max_files or self._offsets[end] - self._offsets[start] >= max_bytes:
+        yield self[start:end]
+        start = end
+
+    if start < len(self):
+      yield self[start:]
+
+
+def fileArguments(files):
+  """Convert a list of files into arguments to pass to a hook."""
+  return files.argv() if isinstance(files, FileList) else files
+
+
+def filterFiles(files, function):
+  """Filter a list of files, preserving its representation."""
+  if isinstance(files, FileList):
+    return files.filter(function)
+
+  return [file_ for file_ in files if function(file_)]
+
+
+def splitNul(data):
+  """Split NUL terminated output of a git command into a list of strings."""
+  return [x for x in data.decode("utf-8").split("\0") if x]
+
+
+def unquotePath(path):
+  """Undo the quoting git applies to paths with unusual characters."""
+  if not path.startswith(b'"'):
+    return path.decode("utf-8")
+
+  # Special characters are represented as C-style escape sequences and
+  # non-ASCII bytes of the UTF-8 encoded path in octal.
+  return path[1:-1].decode("unicode_escape").encode("latin-1").decode("utf-8")
+
+
+def writeAll(fd, data):
+  """Write all of the given data to a file descriptor."""
+  while data:
+    data = data[write(fd, data):]
+
+
+def retrieveIndex(cwd=None):
+  """Retrieve all entries of the index as (mode, object, stage, path) tuples."""
+  out = execute(GIT, "ls-files", "--stage", "-z", cwd=cwd, stdout=b"", stderr=None)
+  entries = []
+
+  for entry in splitNul(out):
+    # Each entry has the form '<mode> <object> <stage>\t<path>'.
+    info, _, path = entry.partition("\t")
+    mode, object_, stage = info.split()
+    entries += [(mode, object_, stage, path)]
+
+  return entries
+
+
+def retrieveSubmodules():
+  """Retrieve the paths of all submodules registered in the index."""
+  # Only gitlinks (mode 160000) represent submodules.
+  return [path for mode, _, _, path in retrieveIndex() if mode == "160000"]
+
+
+# Index entries, as listed by git ls-files --stage -z, of submodules and
+# of files with conflicts (which are listed once per stage).
+INDEX_SKIPPED = regex(rb"(?:^|(?<=\0))(?:160000 [0-9a-f]+ [0-3]|[0-7]+ [0-9a-f]+ [1-3])\t[^\0]*\0")
+# The mode, object, and stage preceding the path of an index entry.
+INDEX_INFO = regex(rb"(?:^|(?<=\0))[0-7]+ [0-9a-f]+ 0\t")
+
+
+def retrieveFiles(*pathspecs, cwd=None):
+  """Retrieve the paths of all tracked files, or of those matching the given pathspecs, as a FileList."""
+  # The index of a large repository may contain hundreds of thousands
+  # of files, which we never want to handle one by one in Python.
+  cmd = [GIT, "ls-files", "--stage", "-z", "--"] + list(pathspecs)
+  out = execute(*cmd, cwd=cwd, stdout=b"", stderr=None)
+  return FileList.fromNul(INDEX_INFO.sub(b"", INDEX_SKIPPED.sub(b"", out)))
+
+
+def retrievePushedFiles(refs, remote=None):
+  """Retrieve the files added or modified by the commits being pushed.
+
+    'refs' is the data git passes to a pre-push hook on stdin, i.e.,
+    one line per ref containing the local ref and object ID followed by
+    the remote ref and object ID.
+  """
+  include = []
+  exclude = []
+  new = False
+
+  for line in refs.decode("utf-8").splitlines():
+    if not line.strip():
+      continue
+
+    _, local, _, remote_ = line.split()
+    # A local object ID consisting of zeros denotes a ref being deleted,
+    # a remote one a ref being created.
+    if not local.strip("0"):
+      continue
+
+    include += [local]
+    if remote_.strip("0"):
+      exclude += ["^%s" % remote_]
+    else:
+      new = True
+
+  if not include:
+    return []
+
+  # Instead of inspecting each range on its own we walk the history of
+  # all of them at once. Everything reachable from an object the remote
+  # has is excluded, as is everything already known to be on the remote
+  # in case a ref is created. Remote object IDs unknown locally are
+  # ignored.
+  cmd = [GIT, "log", "--ignore-missing", "--format=", "--name-only", "-z",
+         "--no-renames", "--diff-filter=AM"] + include + exclude
+  if new:
+    cmd += ["--not", "--remotes=%s" % remote if remote else "--remotes"]
+
+  out = execute(*cmd, stdout=b"", stderr=None)
+  # Files may be changed by many commits and may have been removed
+  # again later on. For large pushes the list can get long, so we keep
+  # it in a compact form.
+  return FileList.fromNul(out).unique().filter(exists)
+
+
+def streamFiles(command, max_files, max_bytes):
+  """Run a file command and yield the files it reports in batches, as they become available.
+
+    A batch is handed out as soon as it contains 'max_files' files or
+    the length of their names sums up to 'max_bytes'. The remainder is
+    yielded once the command finished. Because the command is blocked
+    from writing while we process a batch, memory usage stays bounded
+    irrespective of the amount of output produced.
+  """
+  fd_in, fd_out = pipe2(O_CLOEXEC)
+  errors = []
+
+  def run():
+    """Run the file command, writing its output into our pipe."""
+    try:
+      execute(*command, stdout=fd_out, stderr=stderr.fileno())
+    except ProcessError as e:
+      errors.append(e)
+    finally:
+      # Only once we closed the write end of the pipe will the reader
+      # see an end-of-file.
+      close(fd_out)
+
+  thread = Thread(target=run)
+  thread.start()
+
+  with defer() as d:
+    # Closing the read end early causes the file command to fail writing
+    # (and terminate) in case we stop consuming the output prematurely.
+    d.defer(thread.join)
+    d.defer(close, fd_in)
+
+    batch = []
+    size = 0
+    pending = b""
+
+    while True:
+      data = read(fd_in, 64 * 1024)
+      # Similar to the non-streaming case we split on all whitespace.
+      # If the data does not end in whitespace, the last word may be
+      # continued by the next read.
+      words = (pending + data).split()
+      pending = words.pop() if data and words and not data[-1:].isspace() else b""
+
+      for word in words:
+        batch += [word.decode("utf-8")]
+        size += len(word) + 1
+
+        if len(batch) >= max_files or size >= max_bytes:
+          yield batch
+          batch = []
+          size = 0
+
+      if not data:
+        break
+
+    if batch:
+      yield batch
+
+  if errors:
+    raise errors[0]
+
+
+def splitBatches(files, max_files, max_bytes):
+  """Split a list of files into batches bounded by the number of files and their names' lengths."""
+  if isinstance(files, FileList):
+    yield from files.split(max_files, max_bytes)
+    return
+
+  batch = []
+  size = 0
+
+  for file_ in files:
+    batch += [file_]
+    size += len(file_) + 1
+
+    if len(batch) >= max_files or size >= max_bytes:
+      yield batch
+      batch = []
+      size = 0
+
+  if batch:
+    yield batch
+
+
+def retrieveChangedFiles(cwd=None):
+  """Retrieve all files with staged or unstaged changes as well as untracked ones."""
+  commands = [
+    [GIT, "diff", "--name-only", "-z", "--diff-filter=ACMR"],
+    [GIT, "diff", "--cached", "--name-only", "-z", "--diff-filter=ACMR"],
+    [GIT, "ls-files", "--others", "--exclude-standard", "-z"],
+  ]
+  files = set()
+  for command in commands:
+    files |= set(splitNul(execute(*command, cwd=cwd, stdout=b"", stderr=None)))
+
+  return files
+
+
+def filterIgnored(files, cwd=None):
+  """Filter out all files that do not exist or are ignored by git."""
+  files = [file_ for file_ in files if isfile(join(cwd or "", file_))]
+  if not files:
+    return []
+
+  cmd = [GIT, "--literal-pathspecs", "ls-files", "--cached", "--others",
+         "--exclude-standard", "-z", "--"] + files
+  return splitNul(execute(*cmd, cwd=cwd, stdout=b"", stderr=None))
@@ -0,0 +1,258 @@
+# fsmonitor.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A daemon reporting the paths changed in a worktree, and git's fsmonitor hook querying it."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute import (
+  execute,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  configFloat,
+  retrieveConfig,
+)
+from deso.git.hook.mux.daemon import (
+  connectDaemon,
+  createPrivateDirectory,
+  listenDaemon,
+  retrieveRuntimeDirectory,
+  startDaemon,
+)
+from hashlib import (
+  sha1,
+)
+from os import (
+  environ,
+  getpid,
+  makedirs,
+  unlink,
+)
+from os.path import (
+  abspath,
+  isdir,
+  join,
+  realpath,
+  relpath,
+)
+from select import (
+  POLLIN,
+  poll,
+)
+from sys import (
+  stdout,
+  stderr,
+)
+from time import (
+  monotonic,
+  time_ns,
+)
+
+
+def serveFsmonitor(argv):
+  """Watch a worktree and answer queries for the paths changed since a given token."""
+  parser = ArgumentParser()
+  parser.add_argument("base")
+  parser.add_argument("toplevel")
+  parser.add_argument("cookies")
+  parser.add_argument("idle", type=float)
+  namespace = parser.parse_args(argv)
+
+  # Clients merely querying a daemon get by without loading ctypes.
+  from deso.git.hook.mux.inotify import (
+    Inotify,
+  )
+
+  events = Inotify.MODIFY | Inotify.ATTRIB | Inotify.CLOSE_WRITE | Inotify.MOVED_FROM |\
+           Inotify.MOVED_TO | Inotify.CREATE | Inotify.DELETE
+  inotify = Inotify(namespace.toplevel, events, directories=True)
+  # Changes to the git directory are of no interest, except for the
+  # cookies we use for synchronizing with the file system.
+  makedirs(namespace.cookies, exist_ok=True)
+  cookies = relpath(namespace.cookies, namespace.toplevel)
+  inotify.watch(cookies)
+
+  # Tokens handed out identify this very daemon and the number of
+  # batches of changes seen so far. Tokens of a different daemon, or
+  # handed out before we lost events, are answered with the trivial
+  # response that everything changed.
+  identity = "git-hook-mux:%d:%d" % (getpid(), time_ns())
+  sequence = 0
+  reset = 0
+  changes = {}
+
+  def process(timeout, cookie=None):
+    """Process events, returning whether the given cookie was seen."""
+    nonlocal sequence, reset
+
+    paths = inotify.read(timeout)
+    if paths is None:
+      sequence += 1
+      changes.clear()
+      reset = sequence
+      return False
+    if not paths:
+      return False
+
+    sequence += 1
+    seen = False
+    for path in paths:
+      if path.startswith(cookies + "/"):
+        seen = seen or path == cookie
+      else:
+        changes[path] = sequence
+    return seen
+
+  def respond(token):
+    """Create the response to a query with the given token."""
+    identity_, _, since = token.rpartition(":")
+    if identity_ != identity or not since.isdigit() or int(since) < reset:
+      paths = ["/"]
+    else:
+      since = int(since)
+      paths = sorted(path for path, sequence_ in changes.items() if sequence_ > since)
+
+    # The token is always terminated by a NUL, even if no paths follow.
+    token = "%s:%d" % (identity, sequence)
+    return (token + "\0" + "\0".join(paths)).encode("utf-8", "surrogateescape")
+
+  with defer() as d:
+    d.defer(inotify.close)
+    server = listenDaemon(namespace.base)
+    server.settimeout(0)
+    d.defer(server.close)
+    d.defer(unlink, namespace.base + ".sock")
+
+    poller = poll()
+    poller.register(server.fileno(), POLLIN)
+    poller.register(inotify.fileno(), POLLIN)
+    last = monotonic()
+
+    while monotonic() - last < namespace.idle:
+      if not poller.poll(1000):
+        continue
+
+      process(0)
+
+      try:
+        connection, _ = server.accept()
+      except BlockingIOError:
+        continue
+
+      last = monotonic()
+      with connection:
+        connection.settimeout(None)
+        with connection.makefile("rb") as f:
+          token = f.readline().rstrip(b"\n").decode("utf-8", "surrogateescape")
+
+        # All changes made before the query have to be reported. Because
+        # inotify reports events in order, creating a cookie and waiting
+        # for its event guarantees that we have seen those.
+        cookie = join(cookies, "cookie-%d" % sequence)
+        open(join(namespace.toplevel, cookie), "w").close()
+        start = monotonic()
+        while not process(1, cookie):
+          if monotonic() - start >= 5:
+            token = ""
+            break
+
+        unlink(join(namespace.toplevel, cookie))
+        connection.sendall(respond(token))
+
+  return 0
+
+
+# The version of the fsmonitor hook protocol we support, as described in
+# githooks(5).
+FSMONITOR_VERSION = 2
+
+
+def retrieveFsmonitorDirectory():
+  """Retrieve the directory containing the sockets of our fsmonitor daemons."""
+  return createPrivateDirectory(retrieveRuntimeDirectory("%s-fsmonitor" % PROGRAM))
+
+
+def fsmonitor(argv):
+  """Report the paths changed since a given token, as a git fsmonitor hook."""
+  parser = ArgumentParser(prog="%s fsmonitor" % PROGRAM)
+  parser.add_argument(
+    "version", action="store", type=int,
+    help="The version of the fsmonitor hook protocol to speak.",
+  )
+  parser.add_argument(
+    "token", action="store", nargs="?", default="",
+    help="The token of the last update, as reported by an earlier "
+         "invocation.",
+  )
+  namespace = parser.parse_args(argv[2:])
+
+  if namespace.version != FSMONITOR_VERSION:
+    print("Unsupported fsmonitor protocol version: %d" % namespace.version, file=stderr)
+    return 1
+
+  # git runs the hook at the top level of the worktree, so we get by
+  # without asking git in the common case.
+  if isdir(".git") and "GIT_DIR" not in environ:
+    toplevel, git_dir = abspath("."), abspath(".git")
+  else:
+    out = execute(GIT, "rev-parse", "--show-toplevel", "--absolute-git-dir",
+                  stdout=b"", stderr=None)
+    toplevel, git_dir = out.decode("utf-8").splitlines()
+
+  try:
+    directory = retrieveFsmonitorDirectory()
+  except OSError as e:
+    # Without a daemon git has to check everything itself.
+    print("%s" % e, file=stderr)
+    return 1
+
+  key = sha1(realpath(toplevel).encode("utf-8")).hexdigest()
+  base = join(directory, key)
+  cookies = join(git_dir, "hook-mux", "fsmonitor")
+  connection = None
+  try:
+    connection = connectDaemon(base)
+  except (ConnectionRefusedError, FileNotFoundError):
+    config = retrieveConfig()
+    idle = configFloat(config, GIT_HOOK_SECTION, "fsmonitor-idle-timeout", 3600)
+    args = [toplevel, cookies, repr(idle)]
+    connection = startDaemon(base, "deso.git.hook.mux.fsmonitor", "serveFsmonitor", args)
+
+  # Without a daemon git has to check everything itself.
+  if connection is None:
+    return 1
+
+  with connection:
+    connection.sendall(namespace.token.encode("utf-8", "surrogateescape") + b"\n")
+    with connection.makefile("rb") as f:
+      response = f.read()
+
+  if not response:
+    return 1
+
+  stdout.buffer.write(response)
+  stdout.buffer.flush()
+  return 0
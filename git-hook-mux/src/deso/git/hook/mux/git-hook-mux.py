@@ -19,156 +19,102 @@
 
 """This script can be used to enable multiple hooks for git(1)."""
 
-from argparse import (
-  ArgumentParser,
-)
-from deso.execute import (
-  execute,
-  findCommand,
-  ProcessError,
-)
-from os.path import (
-  basename,
-)
-from shlex import (
-  quote,
-  split as shsplit,
-)
-from sys import (
-  argv as sysargv,
-  executable,
-  stdout,
-  stderr,
-)
-
-
-GIT = findCommand("git")
-GIT_HOOK_SECTION = "hook-mux"
-
-
-def retrieveHookList(section, hook_type):
-  """Retrieve the list of configured hooks for the given hook type."""
-  name = "%s.%s" % (section, hook_type)
-  try:
-    out = execute(GIT, "config", "--get-all", name, stdout=b"", stderr=None)
-    value = out.decode("utf-8")
-    # Split each line reported by git-config into a separate string.
-    # Remove all whitespace only strings.
-    return list(filter(lambda x: x.strip() != "", value.splitlines()))
-  except ProcessError:
-    return []
-
-
-def isVerbose(section):
-  """Check if the script should be verbose."""
-  name = "%s.%s" % (section, "verbose")
-  try:
-    out = execute(GIT, "config", "--bool", "--get", name, stdout=b"", stderr=None)
-    return out[:-1] == b"true"
-  except ProcessError:
-    return False
-
 
-def setupArgumentParser():
-  """Create and initialize an argument parser, ready for use."""
-  parser = ArgumentParser(prog="git-hook-mux")
-  parser.add_argument(
-    "files", action="store", default=[], nargs="*",
-    help="A list of files to pass to the invoked hooks in the form of "
-         "positional arguments.",
-  )
-  parser.add_argument(
-    "-c", "--file-cmd", action="store", default=None, dest="file_cmd",
-    help="A command to execute to retrieve or filter a list of files.",
-  )
-  parser.add_argument(
-    "-s", "--section", action="store", default=GIT_HOOK_SECTION,
-    dest="section",
-    help="The name of the git-config(1) section to use (defaults to "
-         "'%s')." % GIT_HOOK_SECTION,
+def noHooksConfigured(argv):
+  """Check cheaply whether we got invoked for a hook type that is definitely not configured.
+
+    To keep the cost for such hook types to a minimum, this check is
+    performed before anything else is imported and without invoking
+    git. Instead, the configuration files git reads are searched for
+    the hook type's name. Whenever we cannot be sure, e.g., because a
+    configuration file includes others, we report False.
+  """
+  from os import (
+    environ,
   )
-  parser.add_argument(
-    "-t", "--hook-type", action="store", default=None, dest="hook_type",
-    help="The type of hook to invoke (e.g., 'pre-commit').",
+  from os.path import (
+    basename,
+    expanduser,
+    isfile,
+    join,
   )
-  return parser
-
-
-def main(argv):
-  """Check the type of hook we got invoked for and invoke the configured user-defined ones."""
-  parser = setupArgumentParser()
-  namespace = parser.parse_args(argv[1:])
-  file_cmd = namespace.file_cmd
-  section = namespace.section
-  files = namespace.files
-  verbose = isVerbose(section)
-  this_prog = [executable, argv[0]]
-
-  # We support two use cases: the hook multiplexer can be copied (or
-  # symlinked) to a git hook in which case the hook type to use is
-  # inferred from the script/symlink name. The script can also be
-  # invoked with the hook type as argument which would override the file
-  # name based hook type determination.
-  if namespace.hook_type is not None:
-    hook_type = namespace.hook_type
-    # The script got invoked with the -t/--hook-type parameter. When
-    # replacing the <self> keyword we need to pass on this parameter.
-    # We treat this argument specially because the information can as
-    # well be conveyed implicitly in case a symlink is used for
-    # invocation. We do not want the client's configuration to differ
-    # between either two cases.
-    this_prog += ["--hook-type=%s" % hook_type]
+
+  # Only invocations by git through a link named after the hook type
+  # are of interest. Any option may change the meaning.
+  hook_type = basename(argv[0])
+  if hook_type.startswith("git-hook-mux") or any(a.startswith("-") for a in argv[1:]):
+    return False
+
+  if "GIT_CONFIG" in environ:
+    return False
+
+  # Configuration provided via the environment is searched as well.
+  texts = [v for k, v in environ.items() if k.startswith("GIT_CONFIG_")]
+
+  # The location of the system wide configuration file is compiled
+  # into git and differs between installations. Unless it is ignored
+  # or given explicitly, we cannot know which file to search.
+  # GIT_CONFIG_NOSYSTEM is a boolean, interpreted the way git does.
+  nosystem = environ.get("GIT_CONFIG_NOSYSTEM", "").strip().lower()
+  if nosystem in ("", "false", "no", "off"):
+    nosystem = False
+  elif nosystem in ("true", "yes", "on"):
+    nosystem = True
+  else:
+    try:
+      nosystem = int(nosystem) != 0
+    except ValueError:
+      return False
+
+  paths = []
+  if not nosystem:
+    if "GIT_CONFIG_SYSTEM" not in environ:
+      return False
+    paths += [environ["GIT_CONFIG_SYSTEM"]]
+
+  if "GIT_CONFIG_GLOBAL" in environ:
+    paths += [environ["GIT_CONFIG_GLOBAL"]]
   else:
-    hook_type = basename(argv[0])
-
-  hooks = retrieveHookList(section, hook_type)
-
-  if verbose:
-    print("Section: %s" % section)
-    print("Hook type: %s" % hook_type)
-    print("Hooks registered:\n%s" % "\n".join(hooks))
-
-  try:
-    if file_cmd is not None:
-      cmd = shsplit(file_cmd) + files
-      out = execute(*cmd, stdout=b"", stderr=stderr.fileno())
-      # Note that because we use a simple str.split here, we can work
-      # with newline separated as well as space separated outputs alike,
-      # which helps a good deal since we do not require helper such as
-      # xargs. However, we will fail if a file name/path contains
-      # spaces.
-      files = out.decode("utf-8").split()
-      # We allow file commands to terminate the recursion prematurely if
-      # they were not able to find any files to work on.
-      if files == []:
-        if verbose:
-          print("File command found no files to work on. Stopping.")
-        return 0
-
-    for hook in hooks:
-      # Replace the special keyword <self> with our own script to
-      # simplify recursive invocation. Two things are important to note
-      # here: first, argv[0] will *always* point to "this" very script,
-      # independent if we used a symlink, a "normal" invocation from a
-      # shell script, or performed an 'exec'. Second, there is no
-      # guarantee that "this" script is executable. It will be if we
-      # used a symlink but it might not if it was called from a shell
-      # script or similar means.
-      # So what we do here is to always invoke the Python interpreter
-      # and pass argv[0] to it (which is a valid approach because "this"
-      # script is a Python script).
-      hook = hook.replace("<self>", " ".join(map(quote, this_prog)))
-      cmd = shsplit(hook) + files
-      execute(*cmd, stdout=stdout.fileno(), stderr=stderr.fileno())
-  except ProcessError as e:
-    # Note that since we redirected stderr directly we will not have the
-    # output here. However, we will still get the command run and the
-    # exit status.
-    print("%s" % e, file=stderr)
-    return e.status
-
-  return 0
+    xdg = environ.get("XDG_CONFIG_HOME") or expanduser(join("~", ".config"))
+    paths += [expanduser(join("~", ".gitconfig")), join(xdg, "git", "config")]
+
+  # Hooks are run from the top level of the working tree, or from
+  # within the git directory of a bare repository, in which case git
+  # sets GIT_DIR. Linked worktrees, where .git is a file, are left to
+  # git to resolve.
+  git_dir = environ.get("GIT_DIR", ".git")
+  if isfile(git_dir) or "GIT_COMMON_DIR" in environ:
+    return False
+  paths += [join(git_dir, "config"), join(git_dir, "config.worktree")]
+
+  for path in paths:
+    try:
+      with open(path, "rb") as f:
+        texts += [f.read().decode("utf-8", "replace")]
+    except FileNotFoundError:
+      pass
+    except OSError:
+      return False
+
+  for text in texts:
+    text = text.lower()
+    if hook_type.lower() in text or "include" in text:
+      return False
+
+  return True
 
 
 if __name__ == "__main__":
-  exit(main(sysargv))
+  from sys import (
+    argv as sysargv,
+  )
+  if noHooksConfigured(sysargv):
+    exit(0)
+
+  # The bulk of our code is only loaded once we know there is work to
+  # do. Being part of a package, it is byte-compiled once and cached,
+  # unlike this very script.
+  from deso.git.hook.mux.main import (
+    run,
+  )
+  exit(run(sysargv))
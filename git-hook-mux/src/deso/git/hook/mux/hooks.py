@@ -0,0 +1,395 @@
+# hooks.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Running of configured hooks."""
+
+from contextlib import (
+  closing,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.background import (
+  runInBackground,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  SPECULATIVE_VARIABLE,
+)
+from deso.git.hook.mux.files import (
+  fileArguments,
+  retrieveSubmodules,
+  splitBatches,
+  writeAll,
+)
+from deso.git.hook.mux.locks import (
+  lockedBatches,
+)
+from deso.git.hook.mux.slots import (
+  acquireSlot,
+)
+from math import (
+  ceil,
+)
+from os import (
+  cpu_count,
+  environ,
+)
+from os.path import (
+  exists,
+  join,
+)
+from shlex import (
+  quote,
+  split as shsplit,
+)
+from sys import (
+  stdout,
+  stderr,
+)
+from tempfile import (
+  TemporaryFile,
+)
+from time import (
+  monotonic,
+)
+
+
+def executeParallel(commands, jobs, env=None):
+  """Execute a list of (command, cwd) pairs with at most 'jobs' of them running at a time.
+
+    The output (stdout and stderr combined) of each command is captured
+    separately, so that it can be reported in a coherent fashion later
+    on. The result is a list of (error, output) tuples in the order of
+    the given commands, with 'error' being a ProcessError for a failed
+    command and None otherwise.
+  """
+  def run(command, cwd):
+    """Run a single command and capture its output."""
+    # We do not use pipes here because the output of a command could
+    # exceed the pipe's buffer. Temporary files are unbounded and allow
+    # us to interleave stdout and stderr properly.
+    with TemporaryFile() as f:
+      try:
+        execute(*command, env=env, cwd=cwd, stdout=f.fileno(), stderr=f.fileno())
+        error = None
+      except ProcessError as e:
+        error = e
+
+      f.seek(0)
+      return error, f.read()
+
+  from concurrent.futures import (
+    ThreadPoolExecutor,
+  )
+
+  with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+    futures = [pool.submit(run, command, cwd) for command, cwd in commands]
+    return [future.result() for future in futures]
+
+
+def reportResults(results, output=None):
+  """Report the output and errors of commands run by executeParallel, returning the first error."""
+  out = stdout.fileno() if output is None else output
+  err = stderr.fileno() if output is None else output
+  error = None
+
+  for e, data in results:
+    stdout.flush()
+    stderr.flush()
+    writeAll(out, data)
+
+    if e is not None:
+      writeAll(err, ("%s\n" % e).encode("utf-8"))
+      error = e if error is None else error
+
+  return error
+
+
+def retrieveLocalEnvironment():
+  """Retrieve the environment with all repository local git variables removed."""
+  # When running as a hook git exports variables such as GIT_DIR or
+  # GIT_INDEX_FILE. They refer to the superproject and must not leak
+  # into commands running in the context of a submodule.
+  out = execute(GIT, "rev-parse", "--local-env-vars", stdout=b"", stderr=None)
+  variables = out.decode("utf-8").split()
+  return {k: v for k, v in environ.items() if k not in variables}
+
+
+def runSubmodules(this_prog, section, jobs, verbose):
+  """Invoke the hooks of the given section in all submodules with staged changes."""
+  env = retrieveLocalEnvironment()
+  submodules = retrieveSubmodules()
+
+  # Submodules that are not checked out cannot have any changes. For
+  # all others we check whether something is staged. This check is run
+  # in parallel as well, as it involves a git invocation per submodule.
+  check = [GIT, "diff", "--cached", "--quiet", "--ignore-submodules"]
+  commands = [(check, path) for path in submodules
+              if exists(join(path, ".git"))]
+  results = executeParallel(commands, jobs, env=env)
+  changed = [cwd for (_, cwd), (error, _) in zip(commands, results)
+             if error is not None and error.status == 1]
+
+  if verbose:
+    print("Submodules with staged changes:\n%s" % "\n".join(changed))
+
+  # We invoke ourselves in each submodule with only the section as
+  # argument. The files we got passed in are relative to the
+  # superproject and as such meaningless to the submodules.
+  command = this_prog + ["--section=%s" % section]
+  commands = [(command, path) for path in changed]
+  results = executeParallel(commands, jobs, env=env)
+  status = 0
+
+  for path, (error, output) in zip(changed, results):
+    if output or error is not None:
+      print("Submodule: %s" % path)
+      stdout.flush()
+      stdout.buffer.write(output)
+      stdout.buffer.flush()
+
+    if error is not None:
+      print("%s: %s" % (path, error), file=stderr)
+      # We report the status of the first failing submodule, in the
+      # order in which they are listed in the index.
+      if status == 0:
+        status = error.status
+
+  return status
+
+
+def resolveHook(hook, this_prog):
+  """Convert a configured hook into a command ready for execution."""
+  # Replace the special keyword <self> with our own script to simplify
+  # recursive invocation. Two things are important to note here: first,
+  # argv[0] will *always* point to "this" very script, independent if
+  # we used a symlink, a "normal" invocation from a shell script, or
+  # performed an 'exec'. Second, there is no guarantee that "this"
+  # script is executable. It will be if we used a symlink but it might
+  # not if it was called from a shell script or similar means.
+  # So what we do here is to always invoke the Python interpreter and
+  # pass argv[0] to it (which is a valid approach because "this" script
+  # is a Python script).
+  command = hook.replace("<self>", " ".join(map(quote, this_prog)))
+  return shsplit(command)
+
+
+def fileCommands(command, files, cwd=None):
+  """Create a (command, cwd) pair per file, with the file replacing the <file> keyword."""
+  # The replacement happens after splitting the hook into arguments, so
+  # that file names need no quoting.
+  return [([arg.replace("<file>", file_) for arg in command], cwd) for file_ in files]
+
+
+def filterCached(hook, files, cache, ledger=None, cwd=None):
+  """Filter the files a hook has to be run on, returning the remaining files and the cache state."""
+  # Results of recursive invocations cannot be cached, only those of
+  # the hooks they eventually run. Neither can those of hooks not
+  # working on files.
+  recursive = "<self>" in hook
+  if SPECULATIVE_VARIABLE in environ and not recursive and (cache is None or not files):
+    # When running speculatively, hooks are only of interest if their
+    # results can be cached.
+    return [], "skip"
+
+  if not files or recursive:
+    return files, None
+
+  if cache is not None:
+    remaining = cache.filter(hook, files)
+    cached = "hit" if not remaining else "miss"
+  else:
+    remaining = files
+    cached = None
+
+  if ledger is not None and remaining:
+    remaining = ledger.filter(hook, remaining, cwd=cwd)
+    if not remaining:
+      cached = "shared"
+
+  return remaining, cached
+
+
+def runHooks(hooks, files, this_prog, statistics=None, cwd=None, env=None,
+             output=None, cache=None, input_=None, slots=None, ledger=None,
+             deadline=None, workers=None, jobs=None, locks=None,
+             mutating=False, caches=None):
+  """Run the given hooks, one after the other, and pass in the given files.
+
+    By default, the output of the hooks is not redirected. If 'output'
+    is a file descriptor, stdout and stderr are redirected to it. If
+    'input_' is not None, it is passed to each hook on stdin. If 'slots'
+    is a SlotPool, each hook has to acquire a slot from it first. If
+    'ledger' is a Ledger, hooks are not run again on files they already
+    succeeded on during the current run. If 'deadline' is given, hooks
+    still running at that point in time are moved to the background.
+    If 'workers' is a WorkerPool, hooks not receiving input are run by
+    long-lived workers, where supported. Hooks containing the <file>
+    keyword are run once per file instead, with up to 'jobs' (by
+    default, the number of cores) of them running in parallel. If
+    'locks' is a FileLocks object, hooks lock the files they are run on
+    first, exclusively if they are 'mutating'. If 'caches' is a
+    ToolCaches object, each hook is provided with a persistent cache
+    directory.
+  """
+  out = stdout.fileno() if output is None else output
+  err = stderr.fileno() if output is None else output
+  env_ = env
+
+  for hook in hooks:
+    remaining, cached = filterCached(hook, files, cache, ledger, cwd)
+    if cached in ("hit", "shared", "skip"):
+      if statistics is not None and cached != "skip":
+        statistics.record(hook, len(files), 0, 0, cached)
+      continue
+
+    env = caches.environment(hook, env_) if caches is not None else env_
+    # Recursive invocations lock the files of the hooks they run
+    # themselves.
+    locks_ = locks if "<self>" not in hook else None
+    with defer() as d, closing(lockedBatches(locks_, remaining, mutating, cwd=cwd)) as batches:
+      if caches is not None:
+        d.defer(caches.update, hook)
+
+      for remaining in batches:
+        cmd = resolveHook(hook, this_prog) + fileArguments(remaining)
+        slot = acquireSlot(hook, slots)
+        start = monotonic()
+        try:
+          if "<file>" in hook and "<self>" not in hook:
+            # All files are checked, even if the hook fails on some.
+            commands = fileCommands(resolveHook(hook, this_prog), remaining, cwd)
+            results = executeParallel(commands, jobs or cpu_count() or 1, env=env)
+            error = reportResults(results, output)
+            if error is not None:
+              raise error
+          elif deadline is not None and "<self>" not in hook:
+            if not runInBackground(hook, cmd, deadline, cwd=cwd, env=env,
+                                   input_=input_, slot=slot, output=out):
+              # The result will be reported by a later invocation. The
+              # slot is held by the hook until it finished and we must
+              # not release it in the meantime. Our own descriptor is
+              # closed once we exit.
+              slot = None
+              continue
+          elif (workers is None or input_ is not None or "<self>" in hook or
+                not workers.run(hook, resolveHook(hook, this_prog), remaining,
+                                cwd=cwd, env=env, output=out)):
+            execute(*cmd, env=env, cwd=cwd, stdin=input_, stdout=out, stderr=err)
+        except ProcessError as e:
+          if statistics is not None:
+            statistics.record(hook, len(remaining), monotonic() - start, e.status, cached)
+          raise
+        finally:
+          if slot is not None:
+            slots.release(slot)
+
+        if statistics is not None:
+          statistics.record(hook, len(remaining), monotonic() - start, 0, cached)
+        if cached is not None:
+          cache.validate(hook, remaining)
+        if ledger is not None and remaining and "<self>" not in hook:
+          ledger.record(hook, remaining, cwd=cwd)
+
+
+def runHooksParallel(hooks, files, this_prog, jobs, **kwargs):
+  """Run the given hooks concurrently, with up to 'jobs' of them running at a time.
+
+    The output of each hook is captured and reported once all of them
+    finished, in the order of the hooks. All further keyword arguments
+    are passed on to runHooks.
+  """
+  def run(hook):
+    """Run a single hook and capture its output."""
+    with TemporaryFile() as f:
+      try:
+        runHooks([hook], files, this_prog, output=f.fileno(), jobs=jobs, **kwargs)
+        error = None
+      except ProcessError as e:
+        error = e
+
+      f.seek(0)
+      return error, f.read()
+
+  from concurrent.futures import (
+    ThreadPoolExecutor,
+  )
+
+  with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+    results = list(pool.map(run, hooks))
+
+  error = reportResults(results)
+  if error is not None:
+    raise error
+
+
+def runHooksSharded(hooks, files, this_prog, jobs, max_files, max_bytes,
+                    statistics=None, cwd=None, env=None, cache=None, slots=None,
+                    ledger=None, caches=None):
+  """Run the given hooks, one after the other, each on shards of the given files in parallel."""
+  env_ = env
+
+  for hook in hooks:
+    remaining, cached = filterCached(hook, files, cache, ledger, cwd)
+    if cached in ("hit", "shared", "skip"):
+      if statistics is not None and cached != "skip":
+        statistics.record(hook, len(files), 0, 0, cached)
+      continue
+
+    # We want to keep all cores busy, even if the files would fit into
+    # less batches.
+    count = min(max_files, max(ceil(len(remaining) / max(jobs, 1)), 1))
+    command = resolveHook(hook, this_prog)
+    if "<file>" in hook:
+      commands = fileCommands(command, remaining, cwd)
+    else:
+      commands = [(command + fileArguments(batch), cwd)
+                  for batch in splitBatches(remaining, count, max_bytes)]
+
+    # All shards of a hook share a single slot as well as its cache
+    # directory.
+    env = caches.environment(hook, env_) if caches is not None else env_
+    slot = acquireSlot(hook, slots)
+    start = monotonic()
+    try:
+      results = executeParallel(commands, jobs, env=env)
+    finally:
+      if slot is not None:
+        slots.release(slot)
+      if caches is not None:
+        caches.update(hook)
+
+    duration = monotonic() - start
+    error = reportResults(results)
+    status = error.status if error is not None else 0
+    if statistics is not None:
+      statistics.record(hook, len(remaining), duration, status, cached)
+
+    if error is not None:
+      raise error
+
+    if cached is not None:
+      cache.validate(hook, remaining)
+    if ledger is not None and remaining and "<self>" not in hook:
+      ledger.record(hook, remaining, cwd=cwd)
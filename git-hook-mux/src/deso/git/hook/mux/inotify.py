@@ -0,0 +1,158 @@
+# inotify.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A minimal wrapper around the Linux inotify API."""
+
+from ctypes import (
+  CDLL,
+  get_errno,
+)
+from ctypes.util import (
+  find_library,
+)
+from os import (
+  close,
+  read,
+  walk,
+)
+from os.path import (
+  join,
+  relpath,
+)
+from select import (
+  POLLIN,
+  poll,
+)
+from struct import (
+  Struct,
+)
+
+
+class Inotify:
+  """A minimal wrapper around the Linux inotify API for watching directory trees."""
+  # The events we are interested in. See inotify(7) for the details.
+  MODIFY = 0x00000002
+  ATTRIB = 0x00000004
+  CLOSE_WRITE = 0x00000008
+  MOVED_FROM = 0x00000040
+  MOVED_TO = 0x00000080
+  CREATE = 0x00000100
+  DELETE = 0x00000200
+  Q_OVERFLOW = 0x00004000
+  IGNORED = 0x00008000
+  ONLYDIR = 0x01000000
+  ISDIR = 0x40000000
+  CLOEXEC = 0o2000000
+
+  _EVENT = Struct("iIII")
+
+  def __init__(self, root, events=CLOSE_WRITE | MOVED_TO, directories=False):
+    """Create an inotify instance and watch all directories below the given root.
+
+      Paths are reported for the given file events. If 'directories' is
+      True, directories moved or deleted are reported as well, with a
+      trailing slash.
+    """
+    self._libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+    self._fd = self._libc.inotify_init1(Inotify.CLOEXEC)
+    if self._fd < 0:
+      raise OSError(get_errno(), "inotify_init1 failed")
+
+    self._root = root
+    self._events = events
+    self._directories = directories
+    self._watches = {}
+    self.watch("")
+
+
+  def fileno(self):
+    """Retrieve the file descriptor of the inotify instance, for polling."""
+    return self._fd
+
+
+  def close(self):
+    """Close the inotify instance."""
+    close(self._fd)
+
+
+  def watch(self, directory):
+    """Watch a directory, relative to the root, and all directories below it.
+
+      The files contained in the watched directories are returned.
+    """
+    files = []
+    mask = self._events | Inotify.MOVED_TO | Inotify.CREATE | Inotify.ONLYDIR
+    if self._directories:
+      mask |= Inotify.MOVED_FROM | Inotify.DELETE
+
+    for path, directories, names in walk(join(self._root, directory)):
+      # Changes inside of the .git directory are of no interest to us.
+      directories[:] = [d for d in directories if d != ".git"]
+      relative = relpath(path, self._root)
+      relative = "" if relative == "." else relative
+
+      wd = self._libc.inotify_add_watch(self._fd, path.encode("utf-8"), mask)
+      if wd >= 0:
+        self._watches[wd] = relative
+        files += [join(relative, name) for name in names]
+
+    return files
+
+
+  def read(self, timeout):
+    """Wait for events and retrieve the paths of the files changed.
+
+      The result is None if events got lost and the paths reported are
+      incomplete.
+    """
+    poller = poll()
+    poller.register(self._fd, POLLIN)
+    if not poller.poll(timeout * 1000):
+      return []
+
+    data = read(self._fd, 64 * 1024)
+    offset = 0
+    paths = []
+    overflow = False
+
+    while offset < len(data):
+      wd, mask, _, length = Inotify._EVENT.unpack_from(data, offset)
+      offset += Inotify._EVENT.size
+      name = data[offset:offset + length].rstrip(b"\0").decode("utf-8")
+      offset += length
+
+      if mask & Inotify.Q_OVERFLOW:
+        overflow = True
+      elif mask & Inotify.IGNORED:
+        self._watches.pop(wd, None)
+      elif wd in self._watches:
+        path = join(self._watches[wd], name)
+        if mask & Inotify.ISDIR:
+          # Newly created directories need to be watched as well and
+          # may contain files already.
+          if mask & (Inotify.CREATE | Inotify.MOVED_TO) and name != ".git":
+            paths += self.watch(path)
+            if self._directories:
+              paths += [path + "/"]
+          elif mask & (Inotify.MOVED_FROM | Inotify.DELETE) and self._directories:
+            paths += [path + "/"]
+        elif mask & self._events:
+          paths += [path]
+
+    return None if overflow else paths
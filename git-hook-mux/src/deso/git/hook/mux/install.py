@@ -0,0 +1,88 @@
+# install.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The command installing us as the hook of a repository."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  GIT_HOOK_SECTION,
+  HOOK_TYPES,
+  PROGRAM,
+  retrieveConfig,
+  retrieveHookList,
+)
+from os import (
+  makedirs,
+  symlink,
+  unlink,
+)
+from os.path import (
+  abspath,
+  islink,
+  join,
+  lexists,
+  realpath,
+)
+from sys import (
+  stderr,
+)
+
+
+def install(argv):
+  """Install links to us for all hook types with configured hooks, removing stale ones."""
+  parser = ArgumentParser(prog="%s install" % PROGRAM)
+  parser.add_argument(
+    "-d", "--directory", action="store", default=None, dest="directory",
+    help="The directory to install the hooks into (defaults to the "
+         "repository's hooks directory, honoring core.hooksPath).",
+  )
+  namespace = parser.parse_args(argv[2:])
+
+  directory = namespace.directory
+  if directory is None:
+    out = execute(GIT, "rev-parse", "--git-path", "hooks", stdout=b"", stderr=None)
+    directory = out[:-1].decode("utf-8")
+
+  directory = abspath(directory)
+  makedirs(directory, exist_ok=True)
+  target = abspath(argv[0])
+  config = retrieveConfig()
+
+  for hook_type in HOOK_TYPES:
+    path = join(directory, hook_type)
+    configured = bool(retrieveHookList(config, GIT_HOOK_SECTION, hook_type))
+    ours = islink(path) and realpath(path) == realpath(target)
+
+    if configured and not lexists(path):
+      symlink(target, path)
+      print("Installed: %s" % hook_type)
+    elif configured and not ours:
+      print("Skipping %s: a different hook is installed" % hook_type, file=stderr)
+    elif not configured and ours:
+      # Hook types without hooks should not cost anything.
+      unlink(path)
+      print("Removed: %s" % hook_type)
+
+  return 0
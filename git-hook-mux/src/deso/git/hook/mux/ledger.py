@@ -0,0 +1,110 @@
+# ledger.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A ledger of the files checked by hooks in nested invocations."""
+
+from deso.git.hook.mux.config import (
+  LEDGER_VARIABLE,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  filterFiles,
+  splitNul,
+)
+from fcntl import (
+  LOCK_EX,
+  flock,
+)
+from hashlib import (
+  sha1,
+)
+from os import (
+  O_APPEND,
+  O_CLOEXEC,
+  O_CREAT,
+  O_WRONLY,
+  close,
+  environ,
+  open as open_,
+  write,
+)
+from os.path import (
+  abspath,
+  join,
+)
+from shutil import (
+  rmtree,
+)
+from tempfile import (
+  mkdtemp,
+)
+
+
+class Ledger:
+  """A record of the files each hook succeeded on during the current run.
+
+    Sections may overlap in the hooks they run as well as in the files
+    they run them on. The ledger is shared by all nested invocations of
+    a run and allows for running each hook only once per file, with the
+    result being reused by every section asking for it.
+  """
+  def __init__(self, directory):
+    """Initialize the ledger, storing its data in the given directory."""
+    self._directory = directory
+
+
+  def _path(self, hook, cwd):
+    """Retrieve the path to the file containing the files a hook succeeded on."""
+    # Hooks of submodules are run in a different directory and refer to
+    # different files.
+    key = "%s\0%s" % (hook, abspath(cwd or "."))
+    return join(self._directory, sha1(key.encode("utf-8")).hexdigest())
+
+
+  def filter(self, hook, files, cwd=None):
+    """Filter out all files the given hook succeeded on already."""
+    try:
+      with open(self._path(hook, cwd), "rb") as f:
+        checked = set(splitNul(f.read()))
+    except FileNotFoundError:
+      return files
+
+    return filterFiles(files, lambda file_: file_ not in checked)
+
+
+  def record(self, hook, files, cwd=None):
+    """Record that the given hook succeeded on the given files."""
+    data = "".join("%s\0" % file_ for file_ in files)
+
+    fd = open_(self._path(hook, cwd), O_WRONLY | O_APPEND | O_CREAT | O_CLOEXEC, 0o644)
+    try:
+      flock(fd, LOCK_EX)
+      write(fd, data.encode("utf-8"))
+    finally:
+      close(fd)
+
+
+def setupLedger(later, env=None):
+  """Create a ledger for the current run and set up the environment for nested invocations to find it."""
+  directory = mkdtemp(prefix="ledger-", dir=retrieveDataDirectory())
+  later.defer(rmtree, directory, ignore_errors=True)
+
+  env = dict(environ if env is None else env)
+  env[LEDGER_VARIABLE] = directory
+  return env
@@ -0,0 +1,107 @@
+# lines.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The ranges of lines changed by the staged changes."""
+
+from deso.execute import (
+  execute,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  LINES_VARIABLE,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  unquotePath,
+)
+from os import (
+  environ,
+  unlink,
+)
+from re import (
+  compile as regex,
+)
+from tempfile import (
+  mkstemp,
+)
+
+
+# The header of a hunk, with the start and (optional) length of the
+# range of lines in the new version.
+HUNK_HEADER = regex(rb"^@@ -[0-9,]+ \+([0-9]+)(?:,([0-9]+))? @@")
+
+
+def retrieveLineRanges():
+  """Retrieve the ranges of lines added or changed by staged changes, per file.
+
+    The result is a dict mapping each file to a list of (first, last)
+    tuples of line numbers in the staged version.
+  """
+  # A single diff without context covers all files.
+  cmd = [GIT, "diff", "--cached", "--unified=0", "--no-color",
+         "--no-ext-diff", "--no-prefix"]
+  out = execute(*cmd, stdout=b"", stderr=None)
+
+  ranges = {}
+  lines = None
+  # Only lines between a file's "diff --git" line and its first hunk
+  # are headers. Within hunks, an added line may very well start with
+  # "++ " and then look just like a header.
+  header = False
+  for line in out.splitlines():
+    if line.startswith(b"diff --git "):
+      header = True
+      lines = None
+    elif header and line.startswith(b"+++ "):
+      # Git terminates paths containing spaces with a tab.
+      path = line[4:].rstrip(b"\t")
+      # Deleted files have no lines left.
+      lines = None if path == b"/dev/null" else ranges.setdefault(unquotePath(path), [])
+    elif line.startswith(b"@@ "):
+      header = False
+      if lines is None:
+        continue
+
+      match = HUNK_HEADER.match(line)
+      start = int(match.group(1))
+      count = int(match.group(2)) if match.group(2) is not None else 1
+      # Hunks only removing lines do not touch any line of the new
+      # version.
+      if count > 0:
+        lines += [(start, start + count - 1)]
+
+  return {path: lines for path, lines in ranges.items() if lines}
+
+
+def setupLineRanges(later, env=None):
+  """Write the changed line ranges to a file and set up the environment for hooks to find it.
+
+    Each line of the file lists the comma separated ranges of a file,
+    e.g., '1-3,10-10', followed by a tab and the file's path.
+  """
+  fd, path = mkstemp(prefix="lines-", dir=retrieveDataDirectory())
+  later.defer(unlink, path)
+
+  with open(fd, "w") as f:
+    for file_, lines in sorted(retrieveLineRanges().items()):
+      f.write("%s\t%s\n" % (",".join("%d-%d" % r for r in lines), file_))
+
+  env = dict(environ if env is None else env)
+  env[LINES_VARIABLE] = path
+  return env
@@ -0,0 +1,281 @@
+# load.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The command generating load by running hooks concurrently."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  GIT_HOOK_SECTION,
+  PROGRAM,
+)
+from deso.git.hook.mux.hooks import (
+  retrieveLocalEnvironment,
+)
+from deso.git.hook.mux.stats import (
+  percentile,
+)
+from os import (
+  chmod,
+  getpid,
+  listdir,
+)
+from os.path import (
+  abspath,
+  basename,
+  dirname,
+  join,
+)
+from shlex import (
+  quote,
+)
+from sys import (
+  executable,
+  stderr,
+)
+from tempfile import (
+  TemporaryDirectory,
+)
+from threading import (
+  Event,
+  Thread,
+)
+from time import (
+  monotonic,
+)
+
+
+# A hook burning the given amount of CPU time and then sleeping for the
+# given number of seconds.
+STUB_HOOK = """\
+from sys import argv
+from time import process_time, sleep
+
+while process_time() < float(argv[1]):
+  pass
+sleep(float(argv[2]))
+"""
+# A git hook invoking us for a certain hook type.
+HOOK_WRAPPER = """\
+#!/bin/sh
+exec {py} {script} --hook-type={hook_type} "$@"
+"""
+
+
+def sampleProcesses(root):
+  """Count the descendants of a process and the file descriptors they have open."""
+  children = {}
+  for entry in listdir("/proc"):
+    if not entry.isdigit():
+      continue
+
+    try:
+      with open(join("/proc", entry, "stat")) as f:
+        data = f.read()
+    except OSError:
+      # The process may have exited in the meantime.
+      continue
+
+    # The command name may contain spaces and parentheses, so we parse
+    # from its end.
+    ppid = int(data.rpartition(")")[2].split()[1])
+    children.setdefault(ppid, []).append(entry)
+
+  processes = 0
+  fds = 0
+  pending = list(children.get(root, []))
+  while pending:
+    pid = pending.pop()
+    processes += 1
+    try:
+      fds += len(listdir(join("/proc", pid, "fd")))
+    except OSError:
+      pass
+    pending += children.get(int(pid), [])
+
+  return processes, fds
+
+
+def setupLoadRepository(path, hook_type, hooks, slots, this_prog, env, bare=False):
+  """Create a repository with the given hooks run through us."""
+  execute(GIT, "init", "--quiet", *(["--bare"] if bare else []), path, env=env, stderr=None)
+  git_dir = path if bare else join(path, ".git")
+
+  hook = join(git_dir, "hooks", hook_type)
+  with open(hook, "w") as f:
+    f.write(HOOK_WRAPPER.format(py=this_prog[0], script=this_prog[1], hook_type=hook_type))
+  chmod(hook, 0o755)
+
+  def config(*args):
+    """Add a value to the repository's configuration."""
+    execute(GIT, "config", "--add", *args, env=env, cwd=path, stderr=None)
+
+  for hook in hooks:
+    config("%s.%s" % (GIT_HOOK_SECTION, hook_type), hook)
+
+  if slots > 0:
+    config("%s.slots" % GIT_HOOK_SECTION, str(slots))
+    config("%s.slot-directory" % GIT_HOOK_SECTION, join(dirname(path), "slots"))
+    config("%s.heavy" % GIT_HOOK_SECTION, "true")
+
+
+def load(argv):
+  """Generate load by running commits or pushes through hooks concurrently."""
+  parser = ArgumentParser(prog="%s load" % PROGRAM)
+  parser.add_argument(
+    "-m", "--mode", action="store", choices=["commit", "push"],
+    default="push", dest="mode",
+    help="Whether to run pre-commit hooks in local repositories or "
+         "pre-receive hooks in a shared bare repository pushed to "
+         "(defaults to 'push').",
+  )
+  parser.add_argument(
+    "-c", "--clients", action="store", type=int, default=8, dest="clients",
+    help="The number of clients operating concurrently (defaults to 8).",
+  )
+  parser.add_argument(
+    "-r", "--runs", action="store", type=int, default=10, dest="runs",
+    help="The number of commits or pushes per client (defaults to 10).",
+  )
+  parser.add_argument(
+    "--hooks", action="store", type=int, default=2, dest="hooks",
+    help="The number of stub hooks to run (defaults to 2).",
+  )
+  parser.add_argument(
+    "--cpu", action="store", type=float, default=0.1, dest="cpu",
+    help="The CPU time in seconds each stub hook consumes (defaults to "
+         "0.1).",
+  )
+  parser.add_argument(
+    "--sleep", action="store", type=float, default=0.1, dest="sleep",
+    help="The time in seconds each stub hook sleeps (defaults to 0.1).",
+  )
+  parser.add_argument(
+    "--slots", action="store", type=int, default=0, dest="slots",
+    help="Limit the number of stub hooks running concurrently to the "
+         "given number of slots (defaults to 0, i.e., no limit).",
+  )
+  parser.add_argument(
+    "--interval", action="store", type=float, default=0.01,
+    dest="interval",
+    help="The interval in seconds at which processes are sampled "
+         "(defaults to 0.01).",
+  )
+  namespace = parser.parse_args(argv[2:])
+
+  this_prog = [executable, abspath(argv[0])]
+  env = retrieveLocalEnvironment()
+  # The repositories we create are not configured, so we have to provide
+  # an identity for commits.
+  for role in ("AUTHOR", "COMMITTER"):
+    env["GIT_%s_NAME" % role] = PROGRAM
+    env["GIT_%s_EMAIL" % role] = "%s@localhost" % PROGRAM
+
+  with TemporaryDirectory() as directory:
+    stub = join(directory, "stub.py")
+    with open(stub, "w") as f:
+      f.write(STUB_HOOK)
+
+    hook = "%s %s %s %s" % (executable, quote(stub), namespace.cpu, namespace.sleep)
+    hooks = [hook] * namespace.hooks
+    clients = [join(directory, "client%d" % i) for i in range(namespace.clients)]
+
+    if namespace.mode == "push":
+      server = join(directory, "server.git")
+      setupLoadRepository(server, "pre-receive", hooks, namespace.slots,
+                          this_prog, env, bare=True)
+      for client in clients:
+        execute(GIT, "clone", "--quiet", server, client, env=env, stderr=None)
+    else:
+      for client in clients:
+        setupLoadRepository(client, "pre-commit", hooks, namespace.slots,
+                            this_prog, env)
+
+    def run(client):
+      """Create commits in a client, and push them, measuring the latency of each."""
+      results = []
+      for i in range(namespace.runs):
+        with open(join(client, "file%d.txt" % i), "w") as f:
+          f.write("%d\n" % i)
+
+        execute(GIT, "add", "file%d.txt" % i, env=env, cwd=client, stderr=None)
+        commit = [GIT, "commit", "--quiet", "--message=%d" % i]
+        push = [GIT, "push", "--quiet", "origin", "HEAD:refs/heads/%s" % basename(client)]
+
+        if namespace.mode == "push":
+          execute(*commit, "--no-verify", env=env, cwd=client, stderr=None)
+
+        start = monotonic()
+        try:
+          execute(*(push if namespace.mode == "push" else commit),
+                  env=env, cwd=client, stderr=None)
+          error = None
+        except ProcessError as e:
+          error = e
+        results += [(monotonic() - start, error)]
+
+      return results
+
+    peak = [0, 0]
+    done = Event()
+
+    def sample():
+      """Sample the processes we spawned until we are done."""
+      while not done.wait(namespace.interval):
+        processes, fds = sampleProcesses(getpid())
+        peak[0] = max(peak[0], processes)
+        peak[1] = max(peak[1], fds)
+
+    from concurrent.futures import (
+      ThreadPoolExecutor,
+    )
+
+    sampler = Thread(target=sample)
+    sampler.start()
+    start = monotonic()
+    try:
+      with ThreadPoolExecutor(max_workers=max(namespace.clients, 1)) as pool:
+        results = [r for rs in pool.map(run, clients) for r in rs]
+    finally:
+      done.set()
+      sampler.join()
+    duration = monotonic() - start
+
+  latencies = sorted(latency for latency, _ in results)
+  failures = [error for _, error in results if error is not None]
+  for error in failures:
+    print("%s" % error, file=stderr)
+
+  print("Mode: %s, clients: %d, runs: %d, hooks: %d"
+        % (namespace.mode, namespace.clients, namespace.runs, namespace.hooks))
+  print("Operations: %d, failures: %d" % (len(results), len(failures)))
+  print("Duration: %.2fs, throughput: %.2f ops/s"
+        % (duration, len(results) / duration if duration > 0 else 0))
+  if latencies:
+    print("Latency p50: %.3fs, p95: %.3fs, p99: %.3fs, max: %.3fs"
+          % (percentile(latencies, 50), percentile(latencies, 95),
+             percentile(latencies, 99), latencies[-1]))
+  print("Peak processes: %d, peak file descriptors: %d" % tuple(peak))
+  return 1 if failures else 0
@@ -0,0 +1,155 @@
+# locks.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Locking of the files hooks of parallel sections work on."""
+
+from deso.git.hook.mux.config import (
+  LOCKS_VARIABLE,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  filterFiles,
+)
+from fcntl import (
+  LOCK_EX,
+  LOCK_NB,
+  LOCK_SH,
+  flock,
+)
+from hashlib import (
+  sha1,
+)
+from os import (
+  O_CLOEXEC,
+  O_CREAT,
+  O_RDONLY,
+  close,
+  environ,
+  open as open_,
+)
+from os.path import (
+  abspath,
+  join,
+)
+from shutil import (
+  rmtree,
+)
+from tempfile import (
+  mkdtemp,
+)
+
+
+class FileLocks:
+  """Per-file locks shared by all nested invocations of a run.
+
+    Hooks that may modify the files they are passed hold exclusive locks
+    on them while running, all others shared ones. Hooks thus never see
+    a file another one is in the middle of modifying, while hooks working
+    on disjoint files still run in parallel.
+  """
+  # The maximum number of locks to hold at a time, bounding the number of
+  # file descriptors we use.
+  MAX_LOCKS = 256
+
+  def __init__(self, directory):
+    """Initialize the locks, with the lock files residing in the given directory."""
+    self._directory = directory
+
+
+  def _tryLock(self, file_, operation, cwd=None):
+    """Open the lock file for the given file and lock it, returning its file descriptor."""
+    # Hooks of submodules are run in a different directory.
+    path = abspath(join(cwd or "", file_))
+    name = sha1(path.encode("utf-8")).hexdigest()
+    fd = open_(join(self._directory, name), O_CREAT | O_RDONLY | O_CLOEXEC, 0o644)
+    try:
+      flock(fd, operation)
+      return fd
+    except BlockingIOError:
+      close(fd)
+      return None
+    except BaseException:
+      close(fd)
+      raise
+
+
+  def acquire(self, files, exclusive, cwd=None):
+    """Lock as many of the given files as are available, waiting for at least one.
+
+      The result is a list of (file, fd) pairs for the files locked.
+    """
+    operation = LOCK_EX if exclusive else LOCK_SH
+    locked = []
+    try:
+      for file_ in files:
+        if len(locked) >= FileLocks.MAX_LOCKS:
+          break
+
+        fd = self._tryLock(file_, operation | LOCK_NB, cwd)
+        if fd is not None:
+          locked += [(file_, fd)]
+
+      if not locked:
+        # We wait for the first file without holding any other lock,
+        # which rules out deadlocks.
+        locked = [(files[0], self._tryLock(files[0], operation, cwd))]
+    except BaseException:
+      self.release(locked)
+      raise
+
+    return locked
+
+
+  def release(self, locked):
+    """Release locks acquired earlier."""
+    for _, fd in locked:
+      close(fd)
+
+
+def setupLocks(later, env=None):
+  """Create the per-file locks for the current run and set up the environment for nested invocations to find them."""
+  directory = mkdtemp(prefix="locks-", dir=retrieveDataDirectory())
+  later.defer(rmtree, directory, ignore_errors=True)
+
+  env = dict(environ if env is None else env)
+  env[LOCKS_VARIABLE] = directory
+  return env
+
+
+def lockedBatches(locks, files, exclusive, cwd=None):
+  """Yield batches of the given files, each one locked until the next one is requested.
+
+    Files locked by others are deferred to later batches, so that we
+    only ever wait if none of the remaining files are available.
+  """
+  if locks is None or len(files) == 0:
+    yield files
+    return
+
+  pending = files
+  while len(pending) > 0:
+    locked = locks.acquire(pending, exclusive, cwd=cwd)
+    batch = [file_ for file_, _ in locked]
+    try:
+      yield batch
+    finally:
+      locks.release(locked)
+
+    done = set(batch)
+    pending = filterFiles(pending, lambda file_: file_ not in done)
@@ -0,0 +1,500 @@
+# main.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The entry point for running hooks and commands."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.background import (
+  reportBackground,
+)
+from deso.git.hook.mux.batch import (
+  batch,
+)
+from deso.git.hook.mux.blobs import (
+  setupBlobService,
+)
+from deso.git.hook.mux.cache import (
+  createResultCache,
+  createToolCaches,
+)
+from deso.git.hook.mux.config import (
+  BLOBS_VARIABLE,
+  DEADLINE_VARIABLE,
+  GIT_HOOK_SECTION,
+  LEDGER_VARIABLE,
+  LINES_VARIABLE,
+  LOCKS_VARIABLE,
+  PROFILE_VARIABLE,
+  PROGRAM,
+  RECORD_VARIABLE,
+  REPLAY_HOOKS_VARIABLE,
+  REPLAY_VARIABLE,
+  SNAPSHOT_VARIABLE,
+  STDIN_HOOKS,
+  configBool,
+  configFloat,
+  isVerbose,
+  retrieveConfig,
+  retrieveHookList,
+)
+from deso.git.hook.mux.files import (
+  fileArguments,
+  FileList,
+  retrieveFiles,
+  retrievePushedFiles,
+  streamFiles,
+)
+from deso.git.hook.mux.fsmonitor import (
+  fsmonitor,
+)
+from deso.git.hook.mux.hooks import (
+  runHooks,
+  runHooksParallel,
+  runHooksSharded,
+  runSubmodules,
+)
+from deso.git.hook.mux.install import (
+  install,
+)
+from deso.git.hook.mux.ledger import (
+  Ledger,
+  setupLedger,
+)
+from deso.git.hook.mux.lines import (
+  setupLineRanges,
+)
+from deso.git.hook.mux.load import (
+  load,
+)
+from deso.git.hook.mux.locks import (
+  FileLocks,
+  setupLocks,
+)
+from deso.git.hook.mux.profiling import (
+  profile,
+  runProfiled,
+)
+from deso.git.hook.mux.record import (
+  Recorder,
+  replay,
+  replayHooks,
+  retrieveRecord,
+)
+from deso.git.hook.mux.restage import (
+  Restager,
+)
+from deso.git.hook.mux.slots import (
+  createSlotPool,
+)
+from deso.git.hook.mux.snapshot import (
+  setupSnapshot,
+)
+from deso.git.hook.mux.state import (
+  createRunState,
+)
+from deso.git.hook.mux.stats import (
+  createStatistics,
+  stats,
+)
+from deso.git.hook.mux.watch import (
+  watch,
+)
+from deso.git.hook.mux.worker import (
+  createWorkerPool,
+)
+from os import (
+  cpu_count,
+  environ,
+)
+from os.path import (
+  abspath,
+  basename,
+)
+from shlex import (
+  split as shsplit,
+)
+from sys import (
+  executable,
+  stdin,
+  stderr,
+)
+from time import (
+  time,
+)
+
+
+# The commands we support in addition to multiplexing hooks.
+COMMANDS = {
+  "batch": batch,
+  "fsmonitor": fsmonitor,
+  "install": install,
+  "load": load,
+  "profile": profile,
+  "replay": replay,
+  "stats": stats,
+  "watch": watch,
+}
+
+
+def setupArgumentParser():
+  """Create and initialize an argument parser, ready for use."""
+  parser = ArgumentParser(prog=PROGRAM)
+  parser.add_argument(
+    "files", action="store", default=[], nargs="*",
+    help="A list of files to pass to the invoked hooks in the form of "
+         "positional arguments.",
+  )
+  parser.add_argument(
+    "-c", "--file-cmd", action="store", default=None, dest="file_cmd",
+    help="A command to execute to retrieve or filter a list of files.",
+  )
+  parser.add_argument(
+    "-s", "--section", action="store", default=GIT_HOOK_SECTION,
+    dest="section",
+    help="The name of the git-config(1) section to use (defaults to "
+         "'%s')." % GIT_HOOK_SECTION,
+  )
+  parser.add_argument(
+    "-t", "--hook-type", action="store", default=None, dest="hook_type",
+    help="The type of hook to invoke (e.g., 'pre-commit').",
+  )
+  parser.add_argument(
+    "-j", "--jobs", action="store", type=int, default=cpu_count() or 1,
+    dest="jobs",
+    help="The maximum number of hooks to run in parallel, where "
+         "supported (defaults to the number of available cores).",
+  )
+  parser.add_argument(
+    "--submodules", action="store_true", default=False,
+    dest="submodules",
+    help="Instead of running the section's hooks in this repository, "
+         "run them in each submodule with staged changes.",
+  )
+  parser.add_argument(
+    "--stream", action="store_true", default=False, dest="stream",
+    help="Run the hooks on batches of files while the file command is "
+         "still producing them, instead of waiting for it to finish.",
+  )
+  parser.add_argument(
+    "--batch-files", action="store", type=int, default=512,
+    dest="batch_files",
+    help="The maximum number of files per batch when streaming "
+         "(defaults to 512).",
+  )
+  parser.add_argument(
+    "--batch-bytes", action="store", type=int, default=128 * 1024,
+    dest="batch_bytes",
+    help="The maximum accumulated length of file names per batch when "
+         "streaming (defaults to 128 KiB).",
+  )
+  parser.add_argument(
+    "--staged", action="store_true", default=False, dest="staged",
+    help="Run the hooks in a snapshot containing the staged versions "
+         "of all staged files instead of in the worktree.",
+  )
+  parser.add_argument(
+    "--all-files", action="store_true", default=False, dest="all_files",
+    help="Pass all tracked files to the hooks, running each hook on "
+         "--jobs shards of them in parallel.",
+  )
+  parser.add_argument(
+    "--pushed-files", action="store_true", default=False,
+    dest="pushed_files",
+    help="Pass the files added or modified by the commits being pushed "
+         "to the hooks, as determined from the refs on stdin (for use "
+         "with pre-push hooks).",
+  )
+  parser.add_argument(
+    "--line-ranges", action="store_true", default=False,
+    dest="line_ranges",
+    help="Provide the ranges of lines changed by the staged changes to "
+         "the hooks, in a file referenced by the %s environment "
+         "variable." % LINES_VARIABLE,
+  )
+  return parser
+
+
+def main(argv):
+  """Check the type of hook we got invoked for and invoke the configured user-defined ones."""
+  # When invoked under our own name (as opposed to through a symlink
+  # named after a hook type) we support a couple of commands.
+  if len(argv) > 1 and argv[1] in COMMANDS and basename(argv[0]).startswith(PROGRAM):
+    return COMMANDS[argv[1]](argv)
+
+  parser = setupArgumentParser()
+  namespace = parser.parse_args(argv[1:])
+  file_cmd = namespace.file_cmd
+  section = namespace.section
+  files = namespace.files
+  # We use an absolute path so that we can invoke ourselves from a
+  # different working directory, e.g., inside of a submodule.
+  this_prog = [executable, abspath(argv[0])]
+
+  # We support two use cases: the hook multiplexer can be copied (or
+  # symlinked) to a git hook in which case the hook type to use is
+  # inferred from the script/symlink name. The script can also be
+  # invoked with the hook type as argument which would override the file
+  # name based hook type determination.
+  if namespace.hook_type is not None:
+    hook_type = namespace.hook_type
+    # The script got invoked with the -t/--hook-type parameter. When
+    # replacing the <self> keyword we need to pass on this parameter.
+    # We treat this argument specially because the information can as
+    # well be conveyed implicitly in case a symlink is used for
+    # invocation. We do not want the client's configuration to differ
+    # between either two cases.
+    this_prog += ["--hook-type=%s" % hook_type]
+  else:
+    hook_type = basename(argv[0])
+
+  # When replaying a recorded run, all inputs depending on the state of
+  # the repository are taken from the record instead.
+  replayed = None
+  if REPLAY_VARIABLE in environ:
+    try:
+      replayed = retrieveRecord(environ[REPLAY_VARIABLE], argv, hook_type)
+    except ValueError as e:
+      print("%s" % e, file=stderr)
+      return 1
+
+    config = replayed["config"]
+  else:
+    config = retrieveConfig()
+
+  verbose = isVerbose(config, section)
+  if namespace.submodules:
+    return runSubmodules(this_prog, section, namespace.jobs, verbose)
+
+  hooks = retrieveHookList(config, section, hook_type)
+  if replayed is None:
+    statistics = createStatistics(config, hook_type, section)
+    cache = createResultCache(config, section)
+  else:
+    statistics = None
+    cache = None
+  slots = createSlotPool(config, section, verbose)
+  workers = createWorkerPool(config, section) if replayed is None else None
+  caches = createToolCaches(config, section, hook_type, hooks) if replayed is None else None
+
+  state = createRunState(config, hook_type, section, statistics) if replayed is None else None
+  if state is not None:
+    statistics = state
+
+  recorder = None
+  if environ.get(RECORD_VARIABLE):
+    recorder = Recorder(environ[RECORD_VARIABLE], argv, hook_type, section, config, statistics)
+    statistics = recorder
+
+  # The latency budget is measured from the start of the top-level
+  # invocation, which also reports on hooks that continued in the
+  # background last time around.
+  deadline = None
+  if DEADLINE_VARIABLE in environ:
+    deadline = float(environ[DEADLINE_VARIABLE])
+  elif replayed is None:
+    budget = configFloat(config, GIT_HOOK_SECTION, "%s-budget" % hook_type)
+    if budget is not None:
+      reportBackground()
+      deadline = time() + budget
+
+  if verbose:
+    print("Section: %s" % section)
+    print("Hook type: %s" % hook_type)
+    print("Hooks registered:\n%s" % "\n".join(hooks))
+
+  try:
+    with defer() as d:
+      cwd = None
+      env = None
+      # A snapshot is shared by all nested invocations. Those are run
+      # inside of it already and inherit the environment.
+      if namespace.staged and SNAPSHOT_VARIABLE not in environ and replayed is None:
+        cwd, env = setupSnapshot(d)
+        if verbose:
+          print("Snapshot: %s" % cwd)
+
+      # Similar to the snapshot, the line ranges are computed once and
+      # shared with all nested invocations.
+      if namespace.line_ranges and LINES_VARIABLE not in environ and replayed is None:
+        env = setupLineRanges(d, env)
+
+      # The same goes for the ledger, which has to be shared by all
+      # nested invocations to be of use.
+      dedupe = configBool(config, GIT_HOOK_SECTION, "dedupe")
+      if dedupe and LEDGER_VARIABLE not in environ and replayed is None:
+        env = setupLedger(d, env)
+
+      directory = (env or environ).get(LEDGER_VARIABLE)
+      ledger = Ledger(directory) if directory is not None else None
+
+      # Hooks of a parallel section, and all hooks run by them, lock the
+      # files they work on, so that hooks modifying files only ever wait
+      # for others working on the same files.
+      parallel = configBool(config, section, "parallel")
+      if parallel and LOCKS_VARIABLE not in environ and replayed is None:
+        env = setupLocks(d, env)
+
+      directory = (env or environ).get(LOCKS_VARIABLE)
+      locks = FileLocks(directory) if directory is not None else None
+
+      # A single git cat-file process serves the contents of objects to
+      # all hooks of the run.
+      blobs = configBool(config, GIT_HOOK_SECTION, "blobs")
+      if blobs and BLOBS_VARIABLE not in environ and replayed is None:
+        env = setupBlobService(d, cwd, env)
+      # Sections restaging files obviously run hooks modifying them.
+      mutating = configBool(config, section, "mutating", configBool(config, section, "restage"))
+
+      if deadline is not None and DEADLINE_VARIABLE not in environ:
+        env = dict(environ if env is None else env)
+        env[DEADLINE_VARIABLE] = repr(deadline)
+
+      # Only hooks of sections not marked as blocking are subject to the
+      # budget. Hooks running in a snapshot cannot outlive it.
+      blocking = configBool(config, section, "blocking", True)
+      snapshot = SNAPSHOT_VARIABLE in (environ if env is None else env)
+      background = deadline if not blocking and not snapshot else None
+
+      # Data git provides on stdin would only ever reach the first hook
+      # reading it otherwise.
+      input_ = stdin.buffer.read() if hook_type in STDIN_HOOKS else None
+
+      if replayed is not None:
+        input_ = replayed["input"]
+        input_ = input_.encode("utf-8", "surrogateescape") if input_ is not None else None
+      elif namespace.all_files:
+        files = retrieveFiles()
+      elif namespace.pushed_files:
+        # The positional arguments are the remote's name and URL.
+        files = retrievePushedFiles(input_ or b"", files[0] if files else None)
+
+      if recorder is not None:
+        recorder.input(input_)
+
+      if replayed is not None:
+        batches = replayed["batches"]
+      elif file_cmd is None:
+        # Hooks get run even if no files were passed in, unless we
+        # were asked to work on all or the pushed files and there are
+        # none.
+        retrieved = namespace.all_files or namespace.pushed_files
+        batches = [files] if files or not retrieved else []
+      elif namespace.stream:
+        cmd = shsplit(file_cmd) + fileArguments(files)
+        batches = streamFiles(cmd, namespace.batch_files, namespace.batch_bytes)
+        # Should a hook fail we stop consuming the file command's output
+        # and have to make sure it gets terminated and waited for.
+        d.defer(batches.close)
+      else:
+        cmd = shsplit(file_cmd) + fileArguments(files)
+        out = execute(*cmd, stdout=b"", stderr=stderr.fileno())
+        # Note that because we split on all whitespace here, we can work
+        # with newline separated as well as space separated outputs
+        # alike, which helps a good deal since we do not require helper
+        # such as xargs. However, we will fail if a file name/path
+        # contains spaces. The output may be huge, so we keep it in a
+        # compact form.
+        files = FileList.fromOutput(out)
+        batches = [files] if files else []
+
+      stubs = replayed is not None and environ.get(REPLAY_HOOKS_VARIABLE) != "real"
+      # Files modified in a snapshot cannot be restaged, as the worktree
+      # would still contain the old contents.
+      restage = configBool(config, section, "restage") and not snapshot and replayed is None
+      count = 0
+      for batch in batches:
+        if stubs:
+          hooks_ = replayHooks(hooks, replayed, count)
+        elif state is not None:
+          batch = state.batch(batch)
+          hooks_ = state.hooks(hooks)
+          if verbose:
+            print("Hooks to run:\n%s" % "\n".join(hooks_))
+        else:
+          hooks_ = hooks
+
+        if recorder is not None:
+          recorder.batch(batch)
+
+        restager = Restager(batch, cwd=cwd) if restage and batch else None
+        if namespace.all_files:
+          runHooksSharded(hooks_, batch, this_prog, namespace.jobs,
+                          namespace.batch_files, namespace.batch_bytes,
+                          statistics, cwd=cwd, env=env, cache=cache,
+                          slots=slots, ledger=ledger, caches=caches)
+        elif parallel:
+          runHooksParallel(hooks_, batch, this_prog, namespace.jobs,
+                           statistics=statistics, cwd=cwd, env=env,
+                           cache=cache, input_=input_, slots=slots,
+                           ledger=ledger, deadline=background,
+                           workers=workers, locks=locks, mutating=mutating,
+                           caches=caches)
+        else:
+          runHooks(hooks_, batch, this_prog, statistics, cwd=cwd, env=env,
+                   cache=cache, input_=input_, slots=slots, ledger=ledger,
+                   deadline=background, workers=workers, jobs=namespace.jobs,
+                   locks=locks, mutating=mutating, caches=caches)
+
+        if restager is not None:
+          restager.restage()
+        count += 1
+
+    # We allow file commands to terminate the recursion prematurely if
+    # they were not able to find any files to work on.
+    if count == 0 and verbose:
+      print("File command found no files to work on. Stopping.")
+    status = 0
+  except ProcessError as e:
+    # Note that since we redirected stderr directly we will not have the
+    # output here. However, we will still get the command run and the
+    # exit status.
+    print("%s" % e, file=stderr)
+    status = e.status
+  except OSError as e:
+    # Most notably, we may time out waiting for a slot or fail to
+    # access the shared slot directory.
+    print("%s" % e, file=stderr)
+    status = 1
+
+  # Hooks may have grown their caches, pushing us over the budget.
+  if caches is not None:
+    caches.evict()
+  if state is not None:
+    state.save(status)
+  if recorder is not None:
+    recorder.save(status)
+  return status
+
+
+def run(argv):
+  """Run the program, under the profiler if so requested."""
+  # Note that the profiling setting is inherited by all nested
+  # invocations by virtue of being part of the environment.
+  if environ.get(PROFILE_VARIABLE):
+    return runProfiled(main, environ[PROFILE_VARIABLE], argv)
+  return main(argv)
@@ -0,0 +1,97 @@
+# profiling.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Profiling of our own invocations, and the command reporting the results."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.git.hook.mux.config import (
+  PROGRAM,
+)
+from os import (
+  getpid,
+  listdir,
+  makedirs,
+)
+from os.path import (
+  join,
+)
+from sys import (
+  stdout,
+  stderr,
+)
+
+
+def profile(argv):
+  """Merge the profiles of all invocations written to a directory into a single report."""
+  parser = ArgumentParser(prog="%s profile" % PROGRAM)
+  parser.add_argument(
+    "directory", action="store",
+    help="The directory the profiles have been written to.",
+  )
+  parser.add_argument(
+    "-s", "--sort", action="store", default="cumulative", dest="sort",
+    help="The key to sort the report by (defaults to 'cumulative').",
+  )
+  parser.add_argument(
+    "-l", "--limit", action="store", type=int, default=30, dest="limit",
+    help="The maximum number of functions to report (defaults to 30).",
+  )
+  parser.add_argument(
+    "-o", "--output", action="store", default=None, dest="output",
+    help="A file to write the merged profile to.",
+  )
+  namespace = parser.parse_args(argv[2:])
+  paths = sorted(join(namespace.directory, name)
+                 for name in listdir(namespace.directory)
+                 if name.startswith(PROGRAM) and name.endswith(".prof"))
+  if not paths:
+    print("No profiles found in %s" % namespace.directory, file=stderr)
+    return 1
+
+  from pstats import (
+    Stats,
+  )
+
+  print("Merged %d profiles from %s" % (len(paths), namespace.directory))
+  stats_ = Stats(*paths, stream=stdout)
+  if namespace.output is not None:
+    stats_.dump_stats(namespace.output)
+
+  stats_.sort_stats(namespace.sort).print_stats(namespace.limit)
+  return 0
+
+
+def runProfiled(function, directory, *args):
+  """Run a function under the profiler and write the profile into the given directory."""
+  # Profiling is the exception, so we only pay for loading the profiler
+  # when it is actually used.
+  from cProfile import (
+    Profile,
+  )
+
+  profiler = Profile()
+  try:
+    return profiler.runcall(function, *args)
+  finally:
+    # Nested invocations of ourselves write profiles into the same
+    # directory, so we include the process ID in the name.
+    makedirs(directory, exist_ok=True)
+    profiler.dump_stats(join(directory, "%s.%d.prof" % (PROGRAM, getpid())))
@@ -0,0 +1,224 @@
+# record.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Recording of hook invocations and their replay."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  REPLAY_HOOKS_VARIABLE,
+  REPLAY_VARIABLE,
+)
+from json import (
+  dumps,
+  loads,
+)
+from os import (
+  environ,
+  getpid,
+  getppid,
+  listdir,
+  makedirs,
+)
+from os.path import (
+  abspath,
+  join,
+)
+from sys import (
+  executable,
+  stdout,
+  stderr,
+)
+from time import (
+  monotonic,
+  time,
+)
+
+
+def stripHookType(args):
+  """Remove all arguments specifying the hook type from an argument list."""
+  result = []
+  skip = False
+  for arg in args:
+    if skip:
+      skip = False
+    elif arg in ("-t", "--hook-type"):
+      skip = True
+    elif not (arg.startswith("--hook-type=") or (arg.startswith("-t") and arg != "-t")):
+      result += [arg]
+
+  return result
+
+
+class Recorder:
+  """A recorder capturing everything required to replay an invocation.
+
+    Much like profiles, each invocation, including nested ones, writes
+    its record to a separate file in the given directory. Records refer
+    to each other through the IDs of the processes involved.
+  """
+  def __init__(self, directory, argv, hook_type, section, config, statistics=None):
+    """Initialize the recorder for an invocation with the given arguments."""
+    self._directory = directory
+    self._statistics = statistics
+    self._start = monotonic()
+    # Only the parts of the configuration this invocation uses are of
+    # interest, as nested invocations record their own.
+    head, dot, tail = section.partition(".")
+    sections = ("%s%s%s" % (head.lower(), dot, tail), GIT_HOOK_SECTION)
+    self._record = {
+      "pid": getpid(),
+      "ppid": getppid(),
+      "start": time(),
+      "hook_type": hook_type,
+      "argv": stripHookType(argv[1:]),
+      "config": {k: v for k, v in config.items() if k.rpartition(".")[0] in sections},
+      "input": None,
+      "batches": [],
+      "hooks": [],
+    }
+
+
+  def input(self, data):
+    """Record the data passed in on stdin."""
+    if data is not None:
+      self._record["input"] = data.decode("utf-8", "surrogateescape")
+
+
+  def batch(self, files):
+    """Record a batch of files the hooks are run on."""
+    self._record["batches"] += [list(files)]
+
+
+  def record(self, hook, files, duration, status, cache=None):
+    """Record the run of a hook, passing it on to the statistics, if any."""
+    self._record["hooks"] += [{
+      "hook": hook,
+      "files": files,
+      "duration": round(duration, 6),
+      "status": status,
+    }]
+    if self._statistics is not None:
+      self._statistics.record(hook, files, duration, status, cache)
+
+
+  def save(self, status):
+    """Write the record of the invocation, which exited with the given status."""
+    self._record["status"] = status
+    self._record["duration"] = round(monotonic() - self._start, 6)
+
+    makedirs(self._directory, exist_ok=True)
+    path = join(self._directory, "%s.%d.json" % (PROGRAM, getpid()))
+    with open(path, "w") as f:
+      f.write(dumps(self._record, sort_keys=True))
+
+
+def loadRecords(directory):
+  """Load all records written to the given directory."""
+  records = []
+  for name in sorted(listdir(directory)):
+    if name.startswith(PROGRAM) and name.endswith(".json"):
+      with open(join(directory, name)) as f:
+        records += [loads(f.read())]
+
+  return records
+
+
+def retrieveRecord(directory, argv, hook_type):
+  """Find the record of the invocation with the given arguments."""
+  args = stripHookType(argv[1:])
+  for record in loadRecords(directory):
+    if record["hook_type"] == hook_type and record["argv"] == args:
+      return record
+
+  raise ValueError("No record of an invocation with arguments: %s" % " ".join(args))
+
+
+def replayHooks(hooks, record, index):
+  """Replace the given hooks by stubs behaving like the recorded ones for the batch with the given index."""
+  stubs = []
+  for hook in hooks:
+    # Recursive invocations get replayed on their own.
+    if "<self>" in hook:
+      stubs += [hook]
+      continue
+
+    runs = [r for r in record["hooks"] if r["hook"] == hook]
+    run = runs[min(index, len(runs) - 1)] if runs else {"duration": 0, "status": 0}
+    stub = "%s -c 'from time import sleep; sleep(%f); exit(%d)'"
+    stubs += [stub % (executable, run["duration"], run["status"])]
+
+  return stubs
+
+
+def replay(argv):
+  """Replay recorded runs, reporting how long they took compared to the recording."""
+  parser = ArgumentParser(prog="%s replay" % PROGRAM)
+  parser.add_argument(
+    "directory", action="store",
+    help="The directory the runs have been recorded to.",
+  )
+  parser.add_argument(
+    "--hooks", action="store", choices=["stub", "real"], default="stub",
+    dest="hooks",
+    help="Whether to replace hooks with stubs sleeping for the recorded "
+         "time and exiting with the recorded status or to run the actual "
+         "hooks (defaults to 'stub').",
+  )
+  namespace = parser.parse_args(argv[2:])
+
+  directory = abspath(namespace.directory)
+  records = loadRecords(directory)
+  pids = {record["pid"] for record in records}
+  # The runs we have to replay are those that were not started by a
+  # recorded invocation.
+  roots = sorted((r for r in records if r["ppid"] not in pids), key=lambda r: r["start"])
+  if not roots:
+    print("No records found in %s" % directory, file=stderr)
+    return 1
+
+  env = dict(environ)
+  env[REPLAY_VARIABLE] = directory
+  env[REPLAY_HOOKS_VARIABLE] = namespace.hooks
+  failed = 0
+
+  for record in roots:
+    cmd = [executable, abspath(argv[0]), "--hook-type=%s" % record["hook_type"]] + record["argv"]
+    start = monotonic()
+    try:
+      execute(*cmd, env=env, stdout=stdout.fileno(), stderr=stderr.fileno())
+      status = 0
+    except ProcessError as e:
+      status = e.status
+
+    if status != record["status"]:
+      failed += 1
+
+    print("%s %s" % (record["hook_type"], " ".join(record["argv"])))
+    print("  status: %d (recorded: %d), duration: %.3fs (recorded: %.3fs)"
+          % (status, record["status"], monotonic() - start, record["duration"]))
+
+  return 1 if failed > 0 else 0
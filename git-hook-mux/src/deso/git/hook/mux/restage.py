@@ -0,0 +1,98 @@
+# restage.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Restaging of files modified by hooks."""
+
+from deso.execute import (
+  execute,
+)
+from deso.git.hook.mux.blobs import (
+  retrieveBlobIds,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+)
+from deso.git.hook.mux.files import (
+  retrieveIndex,
+)
+from os import (
+  stat,
+)
+from os.path import (
+  join,
+)
+from sys import (
+  stderr,
+)
+
+
+class Restager:
+  """Detects files modified by hooks, e.g., formatters, and stages their new contents.
+
+    Only files without unstaged changes are restaged, as we would stage
+    unrelated changes otherwise.
+  """
+  def __init__(self, files, cwd=None):
+    """Remember the state of the given files before running any hooks."""
+    self._cwd = cwd
+    self._stats = {file_: self._stat(file_) for file_ in files}
+    index = {path: object_ for _, object_, stage, path in retrieveIndex(cwd=cwd)
+             if stage == "0"}
+    self._ids = retrieveBlobIds(self._stats.keys(), cwd=cwd)
+    self._clean = {file_ for file_, id_ in self._ids.items() if index.get(file_) == id_}
+
+
+  def _stat(self, file_):
+    """Retrieve the stat data of a file we consider for detecting changes."""
+    try:
+      s = stat(join(self._cwd or "", file_))
+      return s.st_ino, s.st_size, s.st_mtime_ns, s.st_ctime_ns
+    except FileNotFoundError:
+      return None
+
+
+  def restage(self):
+    """Stage the new contents of all files that changed, returning them."""
+    # Only files with changed stat data can have changed content, and
+    # only those we have to hash again.
+    changed = [file_ for file_, stat_ in self._stats.items()
+               if file_ in self._ids and self._stat(file_) not in (stat_, None)]
+    if not changed:
+      return []
+
+    data = "".join("%s\n" % file_ for file_ in changed).encode("utf-8")
+    cmd = [GIT, "hash-object", "--stdin-paths"]
+    out = execute(*cmd, cwd=self._cwd, stdin=data, stdout=b"", stderr=None)
+    ids = dict(zip(changed, out.decode("utf-8").split()))
+    modified = [file_ for file_ in changed if ids[file_] != self._ids[file_]]
+    restaged = [file_ for file_ in modified if file_ in self._clean]
+
+    for file_ in modified:
+      if file_ not in self._clean:
+        print("Not restaging %s: it has unstaged changes" % file_, file=stderr)
+
+    if restaged:
+      data = "".join("%s\0" % file_ for file_ in restaged).encode("utf-8")
+      cmd = [GIT, "update-index", "-z", "--stdin"]
+      execute(*cmd, cwd=self._cwd, stdin=data, stdout=None, stderr=b"")
+
+      for file_ in restaged:
+        print("Restaged: %s" % file_)
+
+    return restaged
@@ -0,0 +1,212 @@
+# slots.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""A host-wide pool of slots for running heavy hooks."""
+
+from deso.git.hook.mux.config import (
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  configBool,
+  configInt,
+  configValues,
+)
+from fcntl import (
+  LOCK_EX,
+  LOCK_NB,
+  flock,
+)
+from os import (
+  O_CLOEXEC,
+  O_CREAT,
+  O_EXCL,
+  O_RDONLY,
+  chmod,
+  close,
+  fchmod,
+  getpid,
+  listdir,
+  makedirs,
+  mkdir,
+  open as open_,
+  rename,
+  unlink,
+)
+from os.path import (
+  dirname,
+  join,
+)
+from tempfile import (
+  gettempdir,
+  mkstemp,
+)
+from time import (
+  monotonic,
+  sleep,
+  time_ns,
+)
+
+
+class SlotPool:
+  """A host-wide pool of slots limiting the number of heavy hooks running concurrently.
+
+    Each slot is represented by a file in a shared directory and held
+    by means of an exclusive lock on it, which is released automatically
+    should the holder die. Processes waiting for a slot enqueue
+    themselves, in the form of locked files as well, and are admitted in
+    the order they arrived.
+  """
+  def __init__(self, directory, slots, timeout, verbose=False):
+    """Create a pool of the given number of slots in a directory."""
+    self._directory = directory
+    self._queue = join(directory, "queue")
+    self._slots = slots
+    self._timeout = timeout
+    self._verbose = verbose
+
+
+  def _setup(self):
+    """Create the shared directories, if they do not exist yet."""
+    makedirs(dirname(self._directory), exist_ok=True)
+    # The pool is shared among all users of the host. Much like /tmp,
+    # everybody may create files in it but only remove their own ones,
+    # irrespective of the umask of whoever got here first.
+    for directory in (self._directory, self._queue):
+      try:
+        mkdir(directory)
+        chmod(directory, 0o1777)
+      except FileExistsError:
+        pass
+
+
+  def _isAhead(self, name):
+    """Check whether a process that enqueued itself before us is still waiting."""
+    for entry in sorted(listdir(self._queue)):
+      if entry >= name:
+        return False
+
+      try:
+        fd = open_(join(self._queue, entry), O_RDONLY | O_CLOEXEC)
+      except FileNotFoundError:
+        continue
+
+      try:
+        try:
+          flock(fd, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+          return True
+
+        # The owner of the entry died without cleaning up after itself.
+        # Only the owner may remove the entry, though.
+        try:
+          unlink(join(self._queue, entry))
+        except (FileNotFoundError, PermissionError):
+          pass
+      finally:
+        close(fd)
+
+    return False
+
+
+  def _tryAcquire(self):
+    """Try to acquire any of the slots without waiting."""
+    for i in range(self._slots):
+      path = join(self._directory, "slot%d" % i)
+      # Locks do not require write access, so others can use slot files
+      # we created and vice versa.
+      try:
+        fd = open_(path, O_RDONLY | O_CLOEXEC)
+      except FileNotFoundError:
+        try:
+          fd = open_(path, O_CREAT | O_EXCL | O_RDONLY | O_CLOEXEC, 0o444)
+          fchmod(fd, 0o444)
+        except FileExistsError:
+          fd = open_(path, O_RDONLY | O_CLOEXEC)
+
+      try:
+        flock(fd, LOCK_EX | LOCK_NB)
+        return fd
+      except BlockingIOError:
+        close(fd)
+
+    return None
+
+
+  def acquire(self):
+    """Wait for a slot and return the file descriptor representing it.
+
+      A TimeoutError is raised if no slot could be acquired in time, an
+      OSError if the shared directory is not usable.
+    """
+    start = monotonic()
+    self._setup()
+    # We create and lock our queue entry under a temporary name first,
+    # so that nobody mistakes it for a stale one.
+    fd, path = mkstemp(prefix="tmp-", dir=self._directory)
+    fchmod(fd, 0o644)
+    flock(fd, LOCK_EX)
+    name = "%020d-%d" % (time_ns(), getpid())
+    rename(path, join(self._queue, name))
+
+    try:
+      while True:
+        if not self._isAhead(name):
+          slot = self._tryAcquire()
+          if slot is not None:
+            break
+
+        if self._timeout > 0 and monotonic() - start >= self._timeout:
+          raise TimeoutError("Timed out waiting for a hook slot after %ds" % self._timeout)
+
+        sleep(0.05)
+    finally:
+      unlink(join(self._queue, name))
+      close(fd)
+
+    if self._verbose:
+      print("Waited %.2fs for a hook slot" % (monotonic() - start))
+    return slot
+
+
+  def release(self, slot):
+    """Release a slot acquired earlier."""
+    close(slot)
+
+
+def createSlotPool(config, section, verbose=False):
+  """Create a SlotPool object if the given section's hooks are heavy and the number of slots is limited."""
+  # Much like statistics, the slots are a property of the host and are
+  # always configured in the default section.
+  slots = configInt(config, GIT_HOOK_SECTION, "slots")
+  if slots <= 0 or not configBool(config, section, "heavy"):
+    return None
+
+  directory = configValues(config, GIT_HOOK_SECTION, "slot-directory")
+  directory = directory[-1] if directory else join(gettempdir(), PROGRAM)
+  timeout = configInt(config, GIT_HOOK_SECTION, "slot-timeout")
+  return SlotPool(directory, slots, timeout, verbose)
+
+
+def acquireSlot(hook, slots):
+  """Acquire a slot for running the given hook, if required."""
+  # Recursive invocations acquire slots for the hooks they run
+  # themselves. Holding one here could exhaust the pool.
+  if slots is None or "<self>" in hook:
+    return None
+
+  return slots.acquire()
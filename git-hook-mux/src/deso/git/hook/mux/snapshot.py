@@ -0,0 +1,108 @@
+# snapshot.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Snapshots of the staged versions of files for hooks to run in."""
+
+from deso.execute import (
+  execute,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  SNAPSHOT_VARIABLE,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  retrieveFiles,
+  splitNul,
+)
+from os import (
+  environ,
+)
+from os.path import (
+  abspath,
+  dirname,
+  join,
+)
+from re import (
+  compile as regex,
+)
+from shutil import (
+  rmtree,
+)
+from tempfile import (
+  mkdtemp,
+)
+
+
+# Characters with a special meaning in glob pathspecs.
+GLOB_SPECIAL = regex(r"([*?[\\])")
+
+
+def createSnapshot(directory):
+  """Materialize the staged versions of the staged files in a new directory below the given one.
+
+    Along with the staged files, the tracked files residing in any of
+    their directories, up to the top level, are part of the snapshot,
+    because tools look for their configuration or for sibling modules
+    there. All files are checked out from the index, so that hooks
+    cannot modify the worktree through the snapshot and the worktree's
+    files are left untouched.
+  """
+  out = execute(GIT, "rev-parse", "--show-toplevel", stdout=b"", stderr=None)
+  toplevel = out[:-1].decode("utf-8")
+  snapshot = mkdtemp(prefix="snapshot.", dir=directory)
+
+  cmd = [GIT, "diff", "--cached", "--name-only", "-z", "--diff-filter=ACMR"]
+  staged = splitNul(execute(*cmd, cwd=toplevel, stdout=b"", stderr=None))
+  if not staged:
+    return snapshot
+
+  directories = {""}
+  for path in staged:
+    path = dirname(path)
+    while path not in directories:
+      directories.add(path)
+      path = dirname(path)
+
+  # A '*' in a glob pathspec does not match a slash, i.e., each pathspec
+  # covers the files directly inside a directory only.
+  pathspecs = [":(glob)%s" % join(GLOB_SPECIAL.sub(r"\\\1", d), "*") for d in sorted(directories)]
+  files = retrieveFiles(*pathspecs, cwd=toplevel)
+  cmd = [GIT, "checkout-index", "-z", "--stdin", "--prefix=%s/" % snapshot]
+  execute(*cmd, cwd=toplevel, stdin=files.nul(), stderr=None)
+  return snapshot
+
+
+def setupSnapshot(later):
+  """Set up a snapshot of the staged files and the environment for hooks to run in it."""
+  out = execute(GIT, "rev-parse", "--absolute-git-dir", stdout=b"", stderr=None)
+  git_dir = out[:-1].decode("utf-8")
+  snapshot = createSnapshot(retrieveDataDirectory())
+  later.defer(rmtree, snapshot, ignore_errors=True)
+
+  env = dict(environ)
+  env[SNAPSHOT_VARIABLE] = snapshot
+  # The snapshot is not a git repository. By pointing git to our
+  # repository explicitly hooks can still invoke git commands and git
+  # treats the snapshot as the worktree.
+  env["GIT_DIR"] = git_dir
+  if "GIT_INDEX_FILE" in env:
+    env["GIT_INDEX_FILE"] = abspath(env["GIT_INDEX_FILE"])
+
+  return snapshot, env
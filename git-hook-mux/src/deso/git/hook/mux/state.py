@@ -0,0 +1,156 @@
+# state.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The state of the last run of a hook type, for resuming it."""
+
+from deso.git.hook.mux.blobs import (
+  retrieveBlobIds,
+)
+from deso.git.hook.mux.config import (
+  configBool,
+  retrieveDataDirectory,
+)
+from deso.git.hook.mux.files import (
+  FileList,
+)
+from hashlib import (
+  sha1,
+)
+from json import (
+  dumps,
+  loads,
+)
+from os import (
+  makedirs,
+  rename,
+  unlink,
+)
+from os.path import (
+  exists,
+  join,
+)
+
+
+class RunState:
+  """The outcome of the last run of a section's hooks, allowing the next run to resume a failed one.
+
+    After a failed run, the hooks that failed are run first next time,
+    on the files they failed on first, so that feedback arrives quickly.
+    Hooks that passed on files with the same contents are skipped. Much
+    like the Recorder, the state learns about hook runs by standing in
+    for the statistics.
+  """
+  def __init__(self, path, statistics=None):
+    """Initialize the state, loading the one of the last run from the given file."""
+    self._path = path
+    self._statistics = statistics
+    try:
+      with open(path) as f:
+        self._last = loads(f.read())
+    except FileNotFoundError:
+      self._last = {"failed": [], "files": [], "passed": {}}
+
+    self._failed = []
+    self._files = []
+    self._passed = {}
+    self._batch = []
+    self._ids = None
+
+
+  def _key(self, hook):
+    """Compute a key identifying a hook and the contents of the files of the current batch."""
+    if not self._batch:
+      return None
+
+    if self._ids is None:
+      self._ids = retrieveBlobIds(self._batch)
+
+    data = "\0".join([hook] + ["%s %s" % (file_, self._ids.get(file_)) for file_ in sorted(self._batch)])
+    return sha1(data.encode("utf-8")).hexdigest()
+
+
+  def batch(self, files):
+    """Set the batch of files the hooks are about to be run on, reordered to start with those that failed."""
+    failed = set(self._last["files"])
+    first = [file_ for file_ in files if file_ in failed]
+    if first:
+      files = first + [file_ for file_ in files if file_ not in failed]
+      files = FileList.fromPaths(files)
+
+    self._batch = files
+    self._ids = None
+    return files
+
+
+  def hooks(self, hooks):
+    """Reorder the given hooks to start with those that failed, omitting those that passed already."""
+    failed = [hook for hook in hooks if hook in self._last["failed"]]
+    passed = self._last["passed"]
+    # Recursive invocations are never skipped: the hooks and the
+    # configuration of their sections are not part of the key and they
+    # resume their own failed runs anyway.
+    hooks = failed + [hook for hook in hooks if hook not in failed and
+                      ("<self>" in hook or hook not in passed or
+                       passed[hook] != self._key(hook))]
+    return hooks
+
+
+  def record(self, hook, files, duration, status, cache=None):
+    """Record the run of a hook, passing it on to the statistics, if any."""
+    if status == 0:
+      key = self._key(hook) if "<self>" not in hook else None
+      if key is not None:
+        self._passed[hook] = key
+    else:
+      self._failed += [hook]
+      self._files += [file_ for file_ in self._batch if file_ not in self._files]
+
+    if self._statistics is not None:
+      self._statistics.record(hook, files, duration, status, cache)
+
+
+  def save(self, status):
+    """Save the state of the run, which exited with the given status."""
+    # Once a run succeeded there is nothing left to resume.
+    if status == 0:
+      if exists(self._path):
+        unlink(self._path)
+      return
+
+    passed = dict(self._last["passed"])
+    passed.update(self._passed)
+    state = {
+      "failed": self._failed,
+      "files": self._files,
+      "passed": {k: v for k, v in passed.items() if k not in self._failed},
+    }
+    with open(self._path + ".tmp", "w") as f:
+      f.write(dumps(state))
+    rename(self._path + ".tmp", self._path)
+
+
+def createRunState(config, hook_type, section, statistics=None):
+  """Create a RunState object if failed hooks are to be run first for the given section."""
+  if not configBool(config, section, "failed-first"):
+    return None
+
+  directory = join(retrieveDataDirectory(), "runs")
+  makedirs(directory, exist_ok=True)
+  key = sha1(("%s\0%s" % (hook_type, section)).encode("utf-8")).hexdigest()
+  return RunState(join(directory, key), statistics)
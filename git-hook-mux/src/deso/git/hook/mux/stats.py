@@ -0,0 +1,193 @@
+# stats.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Statistics about the time hooks take, and the command reporting them."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.git.hook.mux.config import (
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  configBool,
+  configInt,
+  retrieveDataDirectory,
+)
+from fcntl import (
+  LOCK_EX,
+  flock,
+)
+from json import (
+  dumps,
+  loads,
+)
+from math import (
+  ceil,
+)
+from os import (
+  O_APPEND,
+  O_CLOEXEC,
+  O_CREAT,
+  O_WRONLY,
+  close,
+  fstat,
+  open as open_,
+  rename,
+  stat,
+  write,
+)
+from os.path import (
+  join,
+)
+from time import (
+  time,
+)
+
+
+class Statistics:
+  """A recorder for statistics about hook runs.
+
+    Each run of a hook is appended as a single JSON object per line to a
+    file. Once the file exceeds a certain size it is rotated, replacing
+    the previously rotated one. That way disk usage is bounded to twice
+    the configured size.
+  """
+  def __init__(self, path, hook_type, section, max_size):
+    """Initialize the statistics recorder."""
+    self._path = path
+    self._hook_type = hook_type
+    self._section = section
+    self._max_size = max_size
+
+
+  def record(self, hook, files, duration, status, cache=None):
+    """Record a single hook run."""
+    record = {
+      "time": time(),
+      "hook_type": self._hook_type,
+      "section": self._section,
+      "hook": hook,
+      "files": files,
+      "duration": round(duration, 6),
+      "status": status,
+      "cache": cache,
+    }
+    line = (dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+    while True:
+      fd = open_(self._path, O_WRONLY | O_APPEND | O_CREAT | O_CLOEXEC, 0o644)
+      try:
+        # Multiple hooks could run concurrently. We lock the file to
+        # prevent interleaved writes and concurrent rotations.
+        flock(fd, LOCK_EX)
+        # The file may have been rotated while we were waiting for the
+        # lock, in which case we have to start over with the new one.
+        try:
+          current = stat(self._path).st_ino == fstat(fd).st_ino
+        except FileNotFoundError:
+          current = False
+
+        if current:
+          write(fd, line)
+          if fstat(fd).st_size >= self._max_size:
+            rename(self._path, self._path + ".1")
+          break
+      finally:
+        close(fd)
+
+
+def statisticsPath(directory):
+  """Retrieve the path to the statistics file in the given data directory."""
+  return join(directory, "stats.jsonl")
+
+
+def createStatistics(config, hook_type, section, cwd=None):
+  """Create a Statistics object if recording of statistics is enabled."""
+  # Statistics are a property of the repository and not of an
+  # individual section. Hence, we always read the default section.
+  if not configBool(config, GIT_HOOK_SECTION, "stats"):
+    return None
+
+  path = statisticsPath(retrieveDataDirectory(cwd=cwd))
+  max_size = configInt(config, GIT_HOOK_SECTION, "stats-size", 1024 * 1024)
+  return Statistics(path, hook_type, section, max_size)
+
+
+def percentile(values, p):
+  """Calculate the p-th percentile of a sorted list of values, using the nearest-rank method."""
+  index = max(ceil(p / 100 * len(values)) - 1, 0)
+  return values[index]
+
+
+def stats(argv):
+  """Report statistics about recorded hook runs."""
+  parser = ArgumentParser(prog="%s stats" % PROGRAM)
+  parser.add_argument(
+    "-t", "--hook-type", action="store", default=None, dest="hook_type",
+    help="Only report statistics for the given hook type.",
+  )
+  namespace = parser.parse_args(argv[2:])
+  path = statisticsPath(retrieveDataDirectory())
+  runs = {}
+
+  # Read the rotated file first to keep the records in chronological
+  # order.
+  for name in (path + ".1", path):
+    try:
+      with open(name, "r") as f:
+        for line in f:
+          try:
+            record = loads(line)
+          except ValueError:
+            # A partially written record. Skip it.
+            continue
+
+          if namespace.hook_type not in (None, record["hook_type"]):
+            continue
+
+          key = (record["hook_type"], record["section"], record["hook"])
+          runs.setdefault(key, []).append(record)
+    except FileNotFoundError:
+      pass
+
+  for (hook_type, section, hook), records in sorted(runs.items()):
+    durations = sorted(r["duration"] for r in records)
+    failures = len([r for r in records if r["status"] != 0])
+    hits = len([r for r in records if r["cache"] == "hit"])
+
+    # We determine a trend by comparing the median duration of the
+    # more recent half of all runs to that of the older half.
+    half = len(records) // 2
+    if half > 0:
+      older = sorted(r["duration"] for r in records[:half])
+      newer = sorted(r["duration"] for r in records[half:])
+      base = percentile(older, 50)
+      trend = (percentile(newer, 50) - base) / base * 100 if base > 0 else 0.0
+      trend = "%+.0f%%" % trend
+    else:
+      trend = "n/a"
+
+    print("%s [%s] %s" % (hook_type, section, hook))
+    print("  runs: %d, failures: %d (%.1f%%), cache hits: %d"
+          % (len(records), failures, failures / len(records) * 100, hits))
+    print("  p50: %.3fs, p95: %.3fs, p99: %.3fs, trend: %s"
+          % (percentile(durations, 50), percentile(durations, 95),
+             percentile(durations, 99), trend))
+
+  return 0
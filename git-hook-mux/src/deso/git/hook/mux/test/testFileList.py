@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Tests for the compact list of file paths."""
+
+from deso.git.hook.mux.files import (
+  FileList,
+)
+from unittest import (
+  main,
+  TestCase,
+)
+
+
+class TestFileList(TestCase):
+  """Tests for the FileList class."""
+  def testEmpty(self):
+    """Verify that empty input results in an empty list."""
+    for files in (FileList(), FileList.fromNul(b""), FileList.fromOutput(b" \n\t"),
+                  FileList.fromPaths([])):
+      self.assertEqual(len(files), 0)
+      self.assertEqual(list(files), [])
+      self.assertEqual(files.nul(), b"")
+      self.assertEqual(files.argv(), [])
+      self.assertEqual(list(files.split(1, 1)), [])
+      self.assertEqual(len(files.filter(lambda _: True)), 0)
+      self.assertEqual(len(files.unique()), 0)
+
+      with self.assertRaises(IndexError):
+        files[0]
+
+
+  def testEmptyPaths(self):
+    """Verify that empty paths are dropped."""
+    files = FileList.fromNul(b"\0file1\0\0file2")
+    self.assertEqual(list(files), ["file1", "file2"])
+    self.assertEqual(files.nul(), b"file1\0file2\0")
+
+    files = FileList.fromOutput(b"  file1\n\nfile2 \n")
+    self.assertEqual(list(files), ["file1", "file2"])
+
+
+  def testAccess(self):
+    """Verify that paths can be accessed individually."""
+    files = FileList.fromPaths(["a", "dir/b", "cä"])
+    self.assertEqual(len(files), 3)
+    self.assertEqual(files[0], "a")
+    self.assertEqual(files[-1], "cä")
+    self.assertEqual(files.argv(), [b"a", b"dir/b", "cä".encode("utf-8")])
+
+    with self.assertRaises(IndexError):
+      files[3]
+    with self.assertRaises(IndexError):
+      files[-4]
+
+
+  def testSlicing(self):
+    """Verify that slices behave like those of a list."""
+    paths = ["file%d" % i for i in range(5)]
+    files = FileList.fromPaths(paths)
+
+    for start in range(-6, 7):
+      for stop in range(-6, 7):
+        slice_ = files[start:stop]
+        self.assertEqual(list(slice_), paths[start:stop])
+        self.assertEqual(len(slice_), len(paths[start:stop]))
+        self.assertEqual(slice_.nul(), b"".join(p.encode("utf-8") + b"\0"
+                                                for p in paths[start:stop]))
+
+    # Slices of slices work on the very same buffer.
+    self.assertEqual(list(files[1:4][1:]), ["file2", "file3"])
+    self.assertEqual(files[1:4][-1], "file3")
+
+
+  def testFilter(self):
+    """Verify that paths can be filtered."""
+    files = FileList.fromPaths(["a.py", "b.c", "c.py"])[1:]
+    self.assertEqual(list(files.filter(lambda path: path.endswith(".py"))), ["c.py"])
+    self.assertEqual(list(files.filter(lambda path: False)), [])
+
+
+  def testUnique(self):
+    """Verify that duplicate paths are removed while preserving the order."""
+    files = FileList.fromPaths(["b", "a", "b", "ab", "a", "c"])
+    self.assertEqual(list(files.unique()), ["b", "a", "ab", "c"])
+    self.assertEqual(list(files[2:].unique()), ["b", "ab", "a", "c"])
+
+
+  def testSplit(self):
+    """Verify that a list is split into slices bounded by the number of paths and their size."""
+    files = FileList.fromPaths(["a", "bb", "ccc", "d", "ee"])
+
+    def split(max_files, max_bytes):
+      """Split the list and convert the slices into lists."""
+      return [list(s) for s in files.split(max_files, max_bytes)]
+
+    self.assertEqual(split(2, 1024), [["a", "bb"], ["ccc", "d"], ["ee"]])
+    self.assertEqual(split(5, 1024), [["a", "bb", "ccc", "d", "ee"]])
+    self.assertEqual(split(1024, 1024), [["a", "bb", "ccc", "d", "ee"]])
+    # Sizes include the terminators and a slice is completed as soon as
+    # it reaches the limit.
+    self.assertEqual(split(1024, 5), [["a", "bb"], ["ccc", "d"], ["ee"]])
+    self.assertEqual(split(1024, 6), [["a", "bb", "ccc"], ["d", "ee"]])
+    # A single path exceeding the limit ends up in a slice of its own.
+    self.assertEqual(split(1024, 3), [["a", "bb"], ["ccc"], ["d", "ee"]])
+    self.assertEqual(split(1, 1), [["a"], ["bb"], ["ccc"], ["d"], ["ee"]])
+    self.assertEqual(split(2, 5), [["a", "bb"], ["ccc", "d"], ["ee"]])
+
+
+if __name__ == "__main__":
+  main()
@@ -23,21 +23,38 @@ from deso.cleanup import (
   defer,
 )
 from deso.execute import (
+  execute,
   findCommand,
   ProcessError,
 )
 from deso.git.repo import (
+  PathMixin,
   PythonMixin,
   Repository,
   write,
 )
+from fcntl import (
+  LOCK_EX,
+  LOCK_NB,
+  flock,
+)
+from json import (
+  loads,
+)
 from os import (
   chmod,
+  listdir,
+  mkdir,
+  readlink,
+  stat,
   symlink,
   unlink,
+  utime,
 )
 from os.path import (
   dirname,
+  exists,
+  islink,
   join,
 )
 from shutil import (
@@ -48,10 +65,19 @@ from sys import (
 )
 from tempfile import (
   NamedTemporaryFile,
+  TemporaryDirectory,
+  TemporaryFile,
 )
 from textwrap import (
   dedent,
 )
+from threading import (
+  Thread,
+)
+from time import (
+  monotonic,
+  sleep,
+)
 from unittest import (
   main,
   TestCase,
@@ -118,6 +144,25 @@ class GitRepository(PythonMixin, Repository):
     self.git("config", "--local", "--add", *args)
 
 
+  def mux(self, *args, **kwargs):
+    """Invoke the hook multiplexer script directly."""
+    env = kwargs.setdefault("env", {})
+    PathMixin.inheritEnv(env)
+    PythonMixin.inheritEnv(env)
+    # By default we are only interested in the output, not in errors.
+    kwargs.setdefault("stderr", None)
+
+    script = self.path(".git", "hooks", "git-hook-mux.py")
+    return execute(executable, script, *args, cwd=self.path(), **kwargs)
+
+
+  def submoduleAdd(self, url, path):
+    """Add a submodule to the repository."""
+    # Newer versions of git refuse to clone from a local path by
+    # default.
+    self.git("-c", "protocol.file.allow=always", "submodule", "add", url, path)
+
+
 class TestGitHookMux(TestCase):
   """Tests for the git-subrepo script."""
   def testPreCommitHookInvocation(self):
@@ -269,5 +314,1097 @@ class TestGitHookMux(TestCase):
     doTest(False)
 
 
+  def testFileCommandOutput(self):
+    """Verify that arbitrarily whitespace separated file command output is handled."""
+    with GitRepository() as repo:
+      for i in range(5):
+        write(repo, "file%d.txt" % i, data="data%d" % i)
+        repo.add("file%d.txt" % i)
+
+      repo.commit()
+
+      # The file command echoes the files it got, separated by all sorts
+      # of whitespace.
+      file_cmd = "%s -c 'from sys import argv; print(\\\" \\\\t \\\".join(argv[1:]), \\\"\\\\n\\\")'"
+      file_cmd = file_cmd % executable
+      hook = "%s -c 'from sys import argv; print(*argv[1:], file=open(\".git/calls\", \"a\")); "\
+             "exit(\"file4.txt\" in argv)'"
+      args = "--all-files --jobs=2 --batch-files=2"
+      repo.configAdd("hook-mux.pre-commit", "<self> %s --section=test1-mux --file-cmd=\"%s\"" % (args, file_cmd))
+      repo.configAdd("test1-mux.pre-commit", hook % executable)
+
+      # The failing invocation is reported properly.
+      with self.assertRaisesRegex(ProcessError, r"file4\.txt"):
+        repo.mux("--hook-type=pre-commit", stderr=b"")
+
+      with open(repo.path(".git", "calls")) as f:
+        calls = sorted(f.read().splitlines())
+
+      self.assertEqual(calls, ["file0.txt file1.txt", "file2.txt file3.txt", "file4.txt"])
+
+
+  def testLatencyBudget(self):
+    """Verify that non-blocking hooks exceeding the budget continue in the background."""
+    with GitRepository() as repo, TemporaryDirectory() as slots:
+      slow = "%s -c 'from time import sleep; sleep(1.5); print(\"slow output\"); exit(3)'"
+      fast = "%s -c 'print(\"fast output\"); exit(4)'"
+      repo.configAdd("hook-mux.pre-commit-budget", "0.5")
+      repo.configAdd("hook-mux.slots", "1")
+      repo.configAdd("hook-mux.slot-directory", slots)
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux")
+      repo.configAdd("test1-mux.blocking", "false")
+      repo.configAdd("test1-mux.heavy", "true")
+      repo.configAdd("test1-mux.pre-commit", slow % executable)
+
+      start = monotonic()
+      repo.commit("--allow-empty")
+      self.assertLess(monotonic() - start, 1.5)
+
+      # The hook keeps its slot while running in the background.
+      with open(join(slots, "slot0")) as f:
+        with self.assertRaises(BlockingIOError):
+          flock(f.fileno(), LOCK_EX | LOCK_NB)
+
+      directory = repo.path(".git", "hook-mux", "background")
+      for _ in range(50):
+        if any(name.endswith(".json") for name in listdir(directory)):
+          break
+        sleep(0.1)
+
+      # Hooks finishing within the budget still gate the commit.
+      repo.git("config", "--local", "--unset-all", "test1-mux.pre-commit")
+      repo.configAdd("test1-mux.pre-commit", fast % executable)
+
+      with self.assertRaises(ProcessError) as context:
+        repo.mux("--hook-type=pre-commit", stderr=b"")
+
+      # The result of the slow hook is reported by the next invocation.
+      self.assertEqual(context.exception.status, 4)
+      regex = r"Hook finished in the background with status 3 after [0-9.]+s: .*\nslow output"
+      self.assertRegex(context.exception.stderr, regex)
+      self.assertEqual(listdir(directory), [])
+
+      # The output of hooks finishing within the budget is reported in
+      # the order of the hooks when they are run concurrently.
+      repo.configAdd("test2-mux.blocking", "false")
+      repo.configAdd("test2-mux.parallel", "true")
+      repo.configAdd("test2-mux.pre-commit", "%s -c 'from time import sleep; sleep(0.2); print(1)'" % executable)
+      repo.configAdd("test2-mux.pre-commit", "%s -c 'print(2)'" % executable)
+
+      out = repo.mux("--hook-type=pre-commit", "--section=test2-mux", "--jobs=2", stdout=b"")
+      self.assertEqual(out, b"1\n2\n")
+
+
+  def testFileCommandStreaming(self):
+    """Verify that the output of a file command can be streamed into hooks in batches."""
+    def doTest(symlink):
+      """Run the test."""
+      with GitRepository(symlink=symlink) as repo:
+        file_cmd = "%s -c 'for i in range(10): print(\\\"file%%d\\\" %% i)'" % executable
+        # The hook logs the number of files it got invoked with.
+        hook = "%s -c 'from sys import argv; print(len(argv) - 1, file=open(\"calls\", \"a\"))'" % executable
+
+        cmd = "<self> --section=test1-mux --stream --batch-files=3 --file-cmd=\"%s\"" % file_cmd
+        repo.configAdd("hook-mux.pre-commit", cmd)
+        repo.configAdd("test1-mux.pre-commit", hook)
+        repo.commit("--allow-empty")
+
+        with open(repo.path("calls")) as f:
+          self.assertEqual(f.read(), "3\n3\n3\n1\n")
+
+    doTest(True)
+    doTest(False)
+
+
+  def testFileCommandStreamingStopsOnFailure(self):
+    """Check that a failing hook stops a streaming file command."""
+    with GitRepository() as repo:
+      # A file command that never stops producing output. It can only
+      # terminate because we stop consuming its output.
+      file_cmd = "%s -c 'while True: print(\\\"file\\\")'" % executable
+      hook = "%s -c 'exit(23)'" % executable
+
+      cmd = "<self> --section=test1-mux --stream --file-cmd=\"%s\"" % file_cmd
+      repo.configAdd("hook-mux.pre-commit", cmd)
+      repo.configAdd("test1-mux.pre-commit", hook)
+
+      with self.assertRaisesRegex(ProcessError, r"Status 23"):
+        repo.commit("--allow-empty")
+
+
+  def testStatistics(self):
+    """Verify that statistics about hook runs are recorded and reported."""
+    with GitRepository() as repo:
+      hook1 = "%s -c 'exit(0)'" % executable
+      hook2 = "%s -c 'exit(3)'" % executable
+
+      repo.configAdd("hook-mux.stats", "true")
+      repo.configAdd("hook-mux.pre-commit", hook1)
+
+      for _ in range(3):
+        repo.commit("--allow-empty")
+
+      repo.configAdd("hook-mux.pre-commit", hook2)
+      with self.assertRaisesRegex(ProcessError, r"Status 3"):
+        repo.commit("--allow-empty")
+
+      out = repo.mux("stats", stdout=b"").decode("utf-8")
+      self.assertIn("pre-commit [hook-mux] %s\n  runs: 4, failures: 0 (0.0%%)" % hook1, out)
+      self.assertIn("pre-commit [hook-mux] %s\n  runs: 1, failures: 1 (100.0%%)" % hook2, out)
+      self.assertRegex(out, r"p50: [0-9.]+s, p95: [0-9.]+s, p99: [0-9.]+s")
+
+      # With a tiny size limit every record causes a rotation, only
+      # leaving the most recent record.
+      repo.configAdd("hook-mux.stats-size", "1")
+      with self.assertRaisesRegex(ProcessError, r"Status 3"):
+        repo.commit("--allow-empty")
+
+      out = repo.mux("stats", stdout=b"").decode("utf-8")
+      self.assertNotIn(hook1, out)
+      self.assertIn("pre-commit [hook-mux] %s\n  runs: 1, failures: 1 (100.0%%)" % hook2, out)
+
+
+  def testProfiling(self):
+    """Verify that profiles are written for each invocation and can be merged."""
+    with TemporaryDirectory() as directory, GitRepository() as repo:
+      hook = "%s -c 'exit(0)'" % executable
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux")
+      repo.configAdd("test1-mux.pre-commit", hook)
+      repo.commit("--allow-empty", env={"GIT_HOOK_MUX_PROFILE": directory})
+
+      # We expect one profile for the top-level and one for the nested
+      # invocation.
+      self.assertEqual(len(listdir(directory)), 2)
+
+      merged = join(directory, "merged")
+      out = repo.mux("profile", "--output=%s" % merged, directory, stdout=b"")
+      out = out.decode("utf-8")
+      self.assertIn("Merged 2 profiles", out)
+      # The main function got invoked twice, once per process.
+      self.assertRegex(out, r"\n +2 .*:[0-9]+\(main\)\n")
+      self.assertTrue(exists(merged))
+
+
+  def testStagedSnapshot(self):
+    """Verify that hooks can be run against the staged versions of files."""
+    def doTest(symlink):
+      """Run the test."""
+      with GitRepository(symlink=symlink) as repo:
+        mkdir(repo.path("dir"))
+        # Unchanged tracked files, such as configuration files, are
+        # part of the snapshot as well.
+        write(repo, "setup.cfg", data="config")
+        repo.add("setup.cfg")
+        repo.commit()
+
+        write(repo, "clean.txt", data="staged")
+        write(repo, "dir", "dirty.txt", data="staged")
+        repo.add("clean.txt", join("dir", "dirty.txt"))
+        # The worktree version differs from the staged one.
+        write(repo, "dir", "dirty.txt", data="unstaged")
+
+        file_cmd = "%s diff --staged --name-only --diff-filter=AM --no-color --no-prefix" % GIT
+        # The hook fails if any of the files it is passed does not
+        # contain the staged content. It modifies them afterwards.
+        hook = "%s -c 'from sys import argv; "\
+               "ok = all(open(f).read() == \"staged\" for f in argv[1:]) and open(\"setup.cfg\").read() == \"config\"; "\
+               "[open(f, \"w\").write(\"hook\") for f in argv[1:]]; exit(not ok)'" % executable
+
+        # The snapshot is created once and used by nested invocations,
+        # including the git invocations of file commands.
+        repo.configAdd("hook-mux.pre-commit", "<self> --staged --section=test1-mux")
+        repo.configAdd("test1-mux.pre-commit", "<self> --section=test2-mux --file-cmd=\"%s\"" % file_cmd)
+        repo.configAdd("test2-mux.pre-commit", hook)
+        repo.commit()
+
+        # The snapshot got removed and the worktree is untouched, even
+        # though the hook modified the files.
+        self.assertEqual(listdir(repo.path(".git", "hook-mux")), [])
+        with open(repo.path("dir", "dirty.txt")) as f:
+          self.assertEqual(f.read(), "unstaged")
+        with open(repo.path("clean.txt")) as f:
+          self.assertEqual(f.read(), "staged")
+
+        # Without the snapshot the hook sees the worktree content.
+        write(repo, "clean.txt", data="changed")
+        repo.add("clean.txt")
+        write(repo, "clean.txt", data="staged")
+        repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux")
+        with self.assertRaisesRegex(ProcessError, r"Status 1"):
+          repo.commit()
+
+    doTest(True)
+    doTest(False)
+
+
+  def testBatch(self):
+    """Verify that hooks can be run in a batch of repositories."""
+    with GitRepository() as repo1, GitRepository() as repo2, GitRepository() as repo3:
+      hook1 = "%s -c 'print(\"hook1 ran\")'" % executable
+      hook2 = "%s -c 'exit(7)'" % executable
+
+      repo1.configAdd("hook-mux.pre-commit", hook1)
+      repo2.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux")
+      repo2.configAdd("test1-mux.pre-commit", hook2)
+
+      paths = [repo1.path(), repo2.path(), repo3.path()]
+      with TemporaryFile() as f:
+        with self.assertRaisesRegex(ProcessError, r"Status 1"):
+          repo1.mux("batch", "--hook-type=pre-commit", "--jobs=2", *paths, stdout=f.fileno())
+
+        f.seek(0)
+        out = f.read().decode("utf-8")
+
+      self.assertIn("Repository: %s\nhook1 ran\n" % repo1.path(), out)
+      self.assertIn("%s  status: 0" % repo1.path(), out)
+      self.assertIn("%s  status: 7" % repo2.path(), out)
+      self.assertIn("%s  status: 0" % repo3.path(), out)
+      self.assertIn("3 repositories, 1 failed", out)
+
+      # Repositories can also be provided via stdin.
+      data = ("%s\n%s\n" % (repo1.path(), repo3.path())).encode("utf-8")
+      out = repo1.mux("batch", "--hook-type=pre-commit", stdin=data, stdout=b"")
+      self.assertIn("2 repositories, 0 failed", out.decode("utf-8"))
+
+
+  def testAllFilesWithCache(self):
+    """Verify that hooks can be run on all files and that results are cached."""
+    with GitRepository() as repo:
+      for i in range(5):
+        write(repo, "file%d.txt" % i, data="data%d" % i)
+        repo.add("file%d.txt" % i)
+
+      repo.commit()
+
+      # The hook logs the number of files it got invoked with and fails
+      # for files containing 'bad'.
+      hook = "%s -c 'from sys import argv; print(len(argv) - 1, file=open(\".git/calls\", \"a\")); " \
+             "exit(any(\"bad\" in open(f).read() for f in argv[1:]))'" % executable
+      repo.configAdd("hook-mux.cache", "true")
+      repo.configAdd("hook-mux.pre-commit", hook)
+
+      def run():
+        """Run the hooks on all files and retrieve the calls made."""
+        try:
+          repo.mux("--hook-type=pre-commit", "--all-files", "--jobs=2")
+        finally:
+          try:
+            with open(repo.path(".git", "calls")) as f:
+              calls = sorted(f.read().split())
+            unlink(repo.path(".git", "calls"))
+          except FileNotFoundError:
+            calls = []
+
+        return calls
+
+      # The files are split into two shards.
+      self.assertEqual(run(), ["2", "3"])
+      # All files are cached now.
+      self.assertEqual(run(), [])
+
+      write(repo, "file1.txt", data="changed")
+      self.assertEqual(run(), ["1"])
+
+      # Failures are not cached.
+      write(repo, "file2.txt", data="bad")
+      for _ in range(2):
+        with self.assertRaisesRegex(ProcessError, r"Status 1"):
+          run()
+
+      # Reverting to content seen before does not require a run.
+      write(repo, "file2.txt", data="data2")
+      self.assertEqual(run(), [])
+
+
+  def testLineRanges(self):
+    """Verify that the ranges of changed lines are provided to hooks."""
+    with GitRepository() as repo:
+      lines = ["line%d" % i for i in range(1, 11)]
+      write(repo, "file1.txt", data="\n".join(lines) + "\n")
+      write(repo, "file2.txt", data="data\n")
+      repo.add("file1.txt", "file2.txt")
+      repo.commit()
+
+      hook = "%s -c 'from os import environ; from shutil import copyfile; "\
+             "copyfile(environ[\"GIT_HOOK_MUX_LINES\"], \".git/lines\")'"
+      repo.configAdd("hook-mux.pre-commit", "<self> --line-ranges --section=test1-mux")
+      repo.configAdd("test1-mux.pre-commit", hook % executable)
+
+      lines[1] = "changed2"
+      lines[6:8] = ["changed7", "changed8", "new"]
+      del lines[0]
+      write(repo, "file1.txt", data="\n".join(lines) + "\n")
+      write(repo, "file 3.txt", data="a\nb\n")
+      # Added lines starting with "++ " or "-- " look like file headers
+      # in the diff.
+      write(repo, "f.txt", data="a\n++ evil\nb\n-- x\n")
+      repo.add("file1.txt", "file 3.txt", "f.txt")
+      repo.git("rm", "file2.txt")
+      repo.commit()
+
+      with open(repo.path(".git", "lines")) as f:
+        expected = "1-4\tf.txt\n1-2\tfile 3.txt\n1-1,6-8\tfile1.txt\n"
+        self.assertEqual(f.read(), expected)
+
+      # The file is removed once the hooks ran.
+      self.assertEqual(listdir(repo.path(".git", "hook-mux")), [])
+
+
+  def testSlots(self):
+    """Verify that the number of heavy hooks running concurrently can be limited."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      log = join(directory, "log")
+      hook = "%s -c 'from time import sleep; f = open(\"%s\", \"a\"); "\
+             "f.write(\"start\\n\"); f.flush(); sleep(0.5); f.write(\"end\\n\")'"
+      repo.configAdd("hook-mux.slots", "1")
+      repo.configAdd("hook-mux.slot-directory", directory)
+      repo.configAdd("hook-mux.slot-timeout", "5")
+      repo.configAdd("hook-mux.heavy", "true")
+      repo.configAdd("hook-mux.pre-commit", hook % (executable, log))
+
+      threads = [Thread(target=repo.mux, args=("--hook-type=pre-commit",)) for _ in range(3)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+      # The hook invocations must not overlap.
+      with open(log) as f:
+        self.assertEqual(f.read(), "start\nend\n" * 3)
+
+      # Other users have to be able to use the pool as well.
+      self.assertEqual(stat(join(directory, "queue")).st_mode & 0o7777, 0o1777)
+      self.assertEqual(stat(join(directory, "slot0")).st_mode & 0o7777, 0o444)
+
+      # A slot held elsewhere makes us wait, until we eventually give up.
+      repo.git("config", "--local", "hook-mux.slot-timeout", "1")
+      with open(join(directory, "slot0")) as f:
+        flock(f.fileno(), LOCK_EX)
+
+        regex = r"Timed out waiting for a hook slot"
+        with self.assertRaisesRegex(ProcessError, regex):
+          repo.mux("--hook-type=pre-commit", stderr=b"")
+
+      repo.configAdd("hook-mux.verbose", "true")
+      out = repo.mux("--hook-type=pre-commit", stdout=b"")
+      self.assertRegex(out.decode("utf-8"), r"Waited [0-9.]+s for a hook slot")
+
+
+  def testWorkers(self):
+    """Verify that hooks supporting the worker protocol are kept running across invocations."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      worker = join(directory, "worker.py")
+      with open(worker, "w") as f:
+        f.write(dedent("""\
+          from json import dumps, loads
+          from os import getpid
+          from os.path import join
+          from sys import stdin
+          from time import sleep
+
+          print(dumps({"protocol": 1}), flush=True)
+          for line in stdin:
+            request = loads(line)
+            with open(join(request["cwd"], "calls"), "a") as f:
+              print(getpid(), *request["files"], file=f)
+
+            if "hang" in request["files"]:
+              sleep(30)
+
+            status = 2 if "bad" in request["files"] else 0
+            status = "invalid" if "weird" in request["files"] else status
+            print(dumps({"status": status, "output": "checked\\n"}), flush=True)
+        """))
+
+      repo.configAdd("hook-mux.worker-directory", join(directory, "workers"))
+      repo.configAdd("hook-mux.worker-idle-timeout", "1")
+      repo.configAdd("hook-mux.worker-response-timeout", "1")
+      repo.configAdd("hook-mux.workers", "true")
+      repo.configAdd("hook-mux.pre-commit", "%s %s" % (executable, worker))
+
+      out = repo.mux("--hook-type=pre-commit", "file1", stdout=b"")
+      self.assertEqual(out, b"checked\n")
+      repo.mux("--hook-type=pre-commit", "file2")
+
+      with self.assertRaises(ProcessError) as context:
+        repo.mux("--hook-type=pre-commit", "bad", stderr=b"")
+      self.assertEqual(context.exception.status, 2)
+
+      # All requests were served by the same worker.
+      with open(repo.path("calls")) as f:
+        calls = [line.split() for line in f]
+      self.assertEqual([files for _, *files in calls], [["file1"], ["file2"], ["bad"]])
+      self.assertEqual(len({pid for pid, *_ in calls}), 1)
+
+      # Once idle for long enough the worker exits and a new one is
+      # started on demand.
+      for _ in range(50):
+        if not any(name.endswith(".sock") for name in listdir(join(directory, "workers"))):
+          break
+        sleep(0.1)
+
+      repo.mux("--hook-type=pre-commit", "file3")
+      with open(repo.path("calls")) as f:
+        pid, *files = f.readlines()[-1].split()
+      self.assertEqual(files, ["file3"])
+      self.assertNotEqual(pid, calls[0][0])
+
+      # Malformed responses make us run the hook on our own.
+      out = repo.mux("--hook-type=pre-commit", "weird", stdout=b"")
+      self.assertEqual(out, b'{"protocol": 1}\n')
+
+      # So does a worker not answering in time, which gets replaced.
+      out = repo.mux("--hook-type=pre-commit", "hang", stdout=b"")
+      self.assertEqual(out, b'{"protocol": 1}\n')
+      repo.mux("--hook-type=pre-commit", "file4")
+      with open(repo.path("calls")) as f:
+        (pid1, *files1), (pid2, *files2) = [line.split() for line in f][-2:]
+      self.assertEqual(files1, ["hang"])
+      self.assertEqual(files2, ["file4"])
+      self.assertNotEqual(pid1, pid2)
+
+      # Workers are not used with a directory accessible by others.
+      chmod(join(directory, "workers"), 0o755)
+      out, err = repo.mux("--hook-type=pre-commit", "file5", stdout=b"", stderr=b"")
+      self.assertEqual(out, b'{"protocol": 1}\n')
+      self.assertIn(b"not a directory private to the current user", err)
+      chmod(join(directory, "workers"), 0o700)
+
+      # Hooks not supporting the protocol are run the conventional way.
+      hook = "%s -c 'from sys import argv; print(*argv[1:])'" % executable
+      repo.git("config", "--local", "hook-mux.pre-commit", hook)
+      out = repo.mux("--hook-type=pre-commit", "file6", stdout=b"")
+      self.assertEqual(out, b"file6\n")
+
+      # After a while we check again whether they support it.
+      marker, = [join(directory, "workers", name)
+                 for name in listdir(join(directory, "workers"))
+                 if name.endswith(".unsupported")]
+      utime(marker, (0, 0))
+      repo.mux("--hook-type=pre-commit", "file7")
+      self.assertGreater(stat(marker).st_mtime, 0)
+
+      for _ in range(50):
+        if not any(name.endswith(".sock") for name in listdir(join(directory, "workers"))):
+          break
+        sleep(0.1)
+
+
+  def testFsmonitor(self):
+    """Verify that the paths changed since a token are reported to git."""
+    with GitRepository() as repo:
+      repo.configAdd("hook-mux.fsmonitor-idle-timeout", "2")
+
+      def query(token):
+        """Query the paths changed since the given token."""
+        out = repo.mux("fsmonitor", "2", token, stdout=b"").decode("utf-8")
+        token, nul, paths = out.partition("\0")
+        self.assertEqual(nul, "\0")
+        return token, paths.split("\0") if paths else []
+
+      # Without a token everything has to be considered changed.
+      token, paths = query("")
+      self.assertEqual(paths, ["/"])
+
+      write(repo, "file1", data="data1")
+      token, paths = query(token)
+      self.assertEqual(paths, ["file1"])
+
+      token, paths = query(token)
+      self.assertEqual(paths, [])
+
+      mkdir(repo.path("dir"))
+      write(repo, "dir", "file2", data="data2")
+      unlink(repo.path("file1"))
+      token, paths = query(token)
+      self.assertEqual(paths, ["dir/", "dir/file2", "file1"])
+
+      with self.assertRaises(ProcessError):
+        repo.mux("fsmonitor", "1", token, stderr=b"")
+
+      # git itself sees all changes when using us as fsmonitor hook.
+      script = repo.path(".git", "hooks", "git-hook-mux.py")
+      repo.git("config", "core.fsmonitor", "%s %s fsmonitor" % (executable, script))
+      repo.add(join("dir", "file2"))
+      repo.commit()
+
+      write(repo, "file3", data="data3")
+      out, _ = repo.git("status", "--porcelain", stdout=b"")
+      self.assertEqual(out, b"?? file3\n")
+
+      # Entries unchanged according to the fsmonitor are marked as such.
+      out, _ = repo.git("ls-files", "-f", stdout=b"")
+      self.assertEqual(out, b"h dir/file2\n")
+
+      write(repo, "dir", "file2", data="changed")
+      out, _ = repo.git("status", "--porcelain", stdout=b"")
+      self.assertEqual(out, b" M dir/file2\n?? file3\n")
+
+
+  def testFsmonitorForeignDirectory(self):
+    """Verify that no fsmonitor daemon is used with a socket directory accessible by others."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      mkdir(join(directory, "git-hook-mux-fsmonitor"))
+      chmod(join(directory, "git-hook-mux-fsmonitor"), 0o755)
+
+      with self.assertRaises(ProcessError) as context:
+        repo.mux("fsmonitor", "2", "", env={"XDG_RUNTIME_DIR": directory}, stderr=b"")
+      self.assertIn("not a directory private to the current user", context.exception.stderr)
+      self.assertEqual(listdir(join(directory, "git-hook-mux-fsmonitor")), [])
+
+
+  def testPerFileHooks(self):
+    """Verify that hooks containing the <file> keyword are run once per file."""
+    with GitRepository() as repo:
+      hook = "%s -c 'from sys import argv; print(*argv[1:]); exit(argv[2] == \"bad\")' -- <file>"
+      repo.configAdd("hook-mux.pre-commit", hook % executable)
+
+      out = repo.mux("--hook-type=pre-commit", "--jobs=2", "file1", "file2", stdout=b"")
+      self.assertEqual(out, b"-- file1\n-- file2\n")
+
+      # A failure does not keep the hook from checking the other files.
+      with TemporaryFile() as f:
+        with self.assertRaises(ProcessError) as context:
+          repo.mux("--hook-type=pre-commit", "file1", "bad", "file2", stdout=f.fileno(), stderr=b"")
+
+        f.seek(0)
+        self.assertEqual(f.read(), b"-- file1\n-- bad\n-- file2\n")
+
+      self.assertEqual(context.exception.status, 1)
+      self.assertRegex(context.exception.stderr, r"Status 1.*-- bad")
+
+
+  def testRestage(self):
+    """Verify that files modified by hooks are restaged."""
+    with GitRepository() as repo:
+      file_cmd = "%s diff --staged --name-only --diff-filter=AM --no-color --no-prefix" % GIT
+      hook = "%s -c 'from pathlib import Path; from sys import argv; "\
+             "[Path(p).write_text(Path(p).read_text().upper()) for p in argv[1:]]'"
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux --file-cmd=\"%s\"" % file_cmd)
+      repo.configAdd("test1-mux.restage", "true")
+      repo.configAdd("test1-mux.pre-commit", hook % executable)
+
+      write(repo, "file1", data="data1")
+      write(repo, "file2", data="DATA2")
+      repo.add("file1", "file2")
+      repo.commit()
+
+      out, _ = repo.git("show", "HEAD:file1", "HEAD:file2", stdout=b"")
+      self.assertEqual(out, b"DATA1DATA2")
+      out, _ = repo.git("status", "--porcelain", stdout=b"")
+      self.assertEqual(out, b"")
+
+      # Files with unstaged changes are left alone.
+      write(repo, "file1", data="data3")
+      repo.add("file1")
+      write(repo, "file1", data="data4")
+
+      out, err = repo.mux("--hook-type=pre-commit", stdout=b"", stderr=b"")
+      self.assertEqual(err, b"Not restaging file1: it has unstaged changes\n")
+      out, _ = repo.git("diff", "--cached", stdout=b"")
+      self.assertIn(b"+data3", out)
+
+
+  def testParallelMutatingHooks(self):
+    """Verify that hooks modifying files run in parallel on disjoint files only."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      hook = join(directory, "hook.py")
+      with open(hook, "w") as f:
+        f.write(dedent("""\
+          from sys import argv
+          from time import sleep
+
+          name, files = argv[1], argv[2:]
+          with open("log", "a") as log:
+            print("start", name, *files, file=log, flush=True)
+            sleep(0.5)
+            for file_ in files:
+              with open(file_, "a") as f:
+                f.write(name)
+            print("end", name, *files, file=log, flush=True)
+        """))
+
+      echo = findCommand("echo")
+      repo.configAdd("hook-mux.parallel", "true")
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux --file-cmd=\"%s a b\"" % echo)
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test2-mux --file-cmd=\"%s b c\"" % echo)
+      repo.configAdd("test1-mux.mutating", "true")
+      repo.configAdd("test1-mux.pre-commit", "%s %s 1" % (executable, hook))
+      repo.configAdd("test2-mux.mutating", "true")
+      repo.configAdd("test2-mux.pre-commit", "%s %s 2" % (executable, hook))
+      repo.mux("--hook-type=pre-commit", "--jobs=2")
+
+      for file_, expected in (("a", {"1"}), ("b", {"12", "21"}), ("c", {"2"})):
+        with open(repo.path(file_)) as f:
+          self.assertIn(f.read(), expected)
+
+      with open(repo.path("log")) as f:
+        log = [line.split() for line in f]
+
+      # Both hooks started right away, on disjoint files.
+      self.assertEqual(log[0][0], "start")
+      self.assertEqual(log[1][0], "start")
+      self.assertFalse(set(log[0][2:]) & set(log[1][2:]))
+
+      # Whoever did not get "b" initially worked on it afterwards, but not
+      # concurrently with the other hook.
+      running = set()
+      for event, name, *files in log:
+        if event == "start":
+          self.assertFalse(running & set(files))
+          running |= set(files)
+        else:
+          running -= set(files)
+
+
+  def testBlobService(self):
+    """Verify that hooks can retrieve the contents of objects from the blob service."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      hook = join(directory, "hook.py")
+      with open(hook, "w") as f:
+        f.write(dedent("""\
+          from os import environ
+          from socket import AF_UNIX, SOCK_STREAM, socket
+          from sys import argv, stdout
+
+          with socket(AF_UNIX, SOCK_STREAM) as s, s.makefile("rb") as f:
+            s.connect(environ["GIT_HOOK_MUX_BLOBS"])
+            for name in argv[1:]:
+              s.sendall(name.encode() + b"\\n")
+              header = f.readline()
+              stdout.buffer.write(header.split(maxsplit=1)[1])
+              if not header.endswith(b" missing\\n"):
+                stdout.buffer.write(f.read(int(header.split()[2]) + 1))
+        """))
+
+      write(repo, "file1", data="committed")
+      repo.add("file1")
+      repo.commit()
+
+      write(repo, "file1", data="staged")
+      repo.add("file1")
+      write(repo, "file1", data="unstaged")
+
+      repo.configAdd("hook-mux.blobs", "true")
+      repo.configAdd("hook-mux.pre-commit", "%s %s" % (executable, hook))
+      out = repo.mux("--hook-type=pre-commit", ":file1", "HEAD:file1", ":file2", stdout=b"")
+      self.assertEqual(out, b"blob 6\nstaged\nblob 9\ncommitted\nmissing\n")
+
+
+  def testToolCaches(self):
+    """Verify that hooks are provided with persistent cache directories of bounded size."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      hook = join(directory, "hook.py")
+      with open(hook, "w") as f:
+        f.write(dedent("""\
+          from os import environ, listdir
+          from os.path import join
+          from sys import argv
+
+          directory = environ["GIT_HOOK_MUX_CACHE_DIR"]
+          runs = len(listdir(directory))
+          print(directory, runs)
+          with open(join(directory, "run%d" % runs), "wb") as f:
+            f.write(b"x" * int(argv[1]) * 1024)
+        """))
+
+      root = join(directory, "caches")
+      repo.configAdd("hook-mux.tool-caches", "true")
+      repo.configAdd("hook-mux.tool-cache-root", root)
+      repo.configAdd("hook-mux.tool-cache-size", "1")
+      repo.configAdd("hook-mux.pre-commit", "%s %s 400" % (executable, hook))
+
+      def run(*args):
+        """Run the hooks and retrieve the cache directories and the number of previous runs."""
+        out = repo.mux("--hook-type=pre-commit", *args, stdout=b"").decode("utf-8")
+        return [(path, int(runs)) for path, runs in map(str.split, out.splitlines())]
+
+      [(path, runs)] = run()
+      self.assertTrue(path.startswith(root))
+      self.assertEqual(runs, 0)
+
+      [(path, runs)] = run()
+      self.assertEqual(runs, 1)
+
+      # A changed command line starts out with an empty cache.
+      repo.git("config", "--local", "hook-mux.pre-commit", "%s %s 500" % (executable, hook))
+      self.assertEqual(run(), [(path, 0)])
+
+      # Exceeding the budget evicts the least recently used cache.
+      repo.configAdd("hook-mux.pre-commit", "%s %s 600" % (executable, hook))
+      [(path1, runs1), (path2, runs2)] = run()
+      self.assertEqual((path1, runs1), (path, 1))
+      self.assertEqual(runs2, 0)
+      self.assertFalse(exists(path1))
+      self.assertTrue(exists(path2))
+
+      # Hooks run on all files or by the batch command use the very same
+      # directories.
+      write(repo, "file.txt", data="data")
+      repo.add("file.txt")
+      repo.commit("--no-verify")
+      self.assertEqual([path for path, _ in run("--all-files")], [path1, path2])
+
+      out = repo.mux("batch", "--hook-type=pre-commit", repo.path(), stdout=b"")
+      self.assertIn(path2.encode("utf-8"), out)
+
+
+  def testFailedFirst(self):
+    """Verify that failed hooks are run first and passed ones skipped on unchanged files."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      hook = join(directory, "hook.py")
+      with open(hook, "w") as f:
+        f.write(dedent("""\
+          from sys import argv
+
+          name, files = argv[1], argv[2:]
+          with open("log", "a") as f:
+            f.write(name + " ")
+          exit(name == "2" and any(open(p).read() == "bad" for p in files) or name == "5")
+        """))
+
+      repo.configAdd("hook-mux.failed-first", "true")
+      for name in ("1", "2", "3"):
+        repo.configAdd("hook-mux.pre-commit", "%s %s %s" % (executable, hook, name))
+
+      def run(expected):
+        """Run the hooks and check the order in which they ran."""
+        if exists(repo.path("log")):
+          unlink(repo.path("log"))
+
+        try:
+          repo.mux("--hook-type=pre-commit", "file1", "file2")
+          status = 0
+        except ProcessError as e:
+          status = e.status
+
+        with open(repo.path("log")) as f:
+          self.assertEqual(f.read(), expected)
+        return status
+
+      write(repo, "file1", data="good")
+      write(repo, "file2", data="bad")
+      self.assertEqual(run("1 2 "), 1)
+      # Nothing changed, so hook 1 is known to pass.
+      self.assertEqual(run("2 "), 1)
+
+      write(repo, "file2", data="fixed")
+      self.assertEqual(run("2 1 3 "), 0)
+      # After a successful run the configured order is used again.
+      self.assertEqual(run("1 2 3 "), 0)
+
+      # Recursive invocations are never skipped, because the hooks of
+      # their sections may have changed in the meantime.
+      repo.git("config", "--local", "--unset-all", "hook-mux.pre-commit")
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux")
+      repo.configAdd("hook-mux.pre-commit", "%s %s 2" % (executable, hook))
+      repo.configAdd("test1-mux.pre-commit", "%s %s 4" % (executable, hook))
+      write(repo, "file2", data="bad")
+      self.assertEqual(run("4 2 "), 1)
+
+      repo.configAdd("test1-mux.pre-commit", "%s %s 5" % (executable, hook))
+      write(repo, "file2", data="fixed")
+      self.assertEqual(run("2 4 5 "), 1)
+
+
+  def testLoad(self):
+    """Verify that load can be generated by committing and pushing concurrently."""
+    with GitRepository() as repo:
+      for mode in ("commit", "push"):
+        args = ["--mode=%s" % mode, "--clients=2", "--runs=2", "--cpu=0", "--sleep=0"]
+        out = repo.mux("load", *args, stdout=b"").decode("utf-8")
+
+        self.assertIn("Mode: %s, clients: 2, runs: 2, hooks: 2\n" % mode, out)
+        self.assertIn("Operations: 4, failures: 0\n", out)
+        self.assertRegex(out, r"Latency p50: [0-9.]+s, p95: [0-9.]+s")
+        self.assertRegex(out, r"Peak processes: [1-9][0-9]*, peak file descriptors: [1-9][0-9]*")
+
+
+  def testInstall(self):
+    """Verify that hooks are installed for exactly the configured hook types."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      script = repo.path(".git", "hooks", "git-hook-mux.py")
+      with open(join(directory, "pre-push"), "w") as f:
+        f.write("#!/bin/sh\n")
+
+      repo.configAdd("hook-mux.pre-commit", "/bin/true")
+      repo.configAdd("hook-mux.post-commit", "/bin/true")
+      repo.configAdd("hook-mux.pre-push", "/bin/true")
+      repo.configAdd("hook-mux-files.pre-rebase", "/bin/true")
+
+      _, err = repo.mux("install", "--directory=%s" % directory, stdout=b"", stderr=b"")
+      self.assertEqual(sorted(listdir(directory)), ["post-commit", "pre-commit", "pre-push"])
+      self.assertEqual(readlink(join(directory, "pre-commit")), script)
+      # Hooks we did not install are left alone.
+      self.assertFalse(islink(join(directory, "pre-push")))
+      self.assertIn(b"Skipping pre-push", err)
+
+      repo.git("config", "--local", "--unset", "hook-mux.post-commit")
+      out = repo.mux("install", "--directory=%s" % directory, stdout=b"")
+      self.assertEqual(out, b"Removed: post-commit\n")
+      self.assertEqual(sorted(listdir(directory)), ["pre-commit", "pre-push"])
+
+
+  def testFastPath(self):
+    """Verify that we exit early for hook types without configured hooks."""
+    with GitRepository() as repo, TemporaryDirectory() as directory:
+      env = {"GIT_HOOK_MUX_PROFILE": directory}
+      PathMixin.inheritEnv(env)
+      PythonMixin.inheritEnv(env)
+      hook = repo.path(".git", "hooks", "pre-commit")
+
+      # Nothing is configured, so we do not even get to profiling.
+      env["GIT_CONFIG_NOSYSTEM"] = "1"
+      execute(hook, env=env, cwd=repo.path())
+      self.assertEqual(listdir(directory), [])
+
+      # Without knowing where the system wide configuration resides we
+      # have to ask git.
+      del env["GIT_CONFIG_NOSYSTEM"]
+      execute(hook, env=env, cwd=repo.path())
+      self.assertEqual(len(listdir(directory)), 1)
+
+      # git reads the system wide configuration unless told otherwise.
+      env["GIT_CONFIG_NOSYSTEM"] = "false"
+      execute(hook, env=env, cwd=repo.path())
+      self.assertEqual(len(listdir(directory)), 2)
+
+      # A system wide configuration given explicitly is searched.
+      with TemporaryDirectory() as system:
+        env["GIT_CONFIG_SYSTEM"] = join(system, "gitconfig")
+        execute(hook, env=env, cwd=repo.path())
+        self.assertEqual(len(listdir(directory)), 2)
+
+        with open(env["GIT_CONFIG_SYSTEM"], "w") as f:
+          f.write("[hook-mux]\n  pre-commit = /bin/false\n")
+        with self.assertRaises(ProcessError):
+          execute(hook, env=env, cwd=repo.path())
+        self.assertEqual(len(listdir(directory)), 3)
+
+      del env["GIT_CONFIG_SYSTEM"]
+      env["GIT_CONFIG_NOSYSTEM"] = "yes"
+      repo.configAdd("hook-mux.pre-commit", "/bin/true")
+      execute(hook, env=env, cwd=repo.path())
+      self.assertEqual(len(listdir(directory)), 4)
+
+
+  def testDedupe(self):
+    """Verify that hooks are run only once per file across sections."""
+    def doTest(dedupe, expected):
+      """Run the same hook in two sections with overlapping files."""
+      with GitRepository() as repo:
+        hook = "%s -c 'from sys import argv; print(*argv[1:], file=open(\".git/calls\", \"a\"))'"
+        hook = hook % executable
+        other = "%s -c 'from sys import argv; assert len(argv) == 3'" % executable
+
+        repo.configAdd("hook-mux.dedupe", str(dedupe).lower())
+        repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux file1.txt file2.txt")
+        repo.configAdd("hook-mux.pre-commit", "<self> --section=test2-mux file2.txt file3.txt")
+        repo.configAdd("test1-mux.pre-commit", hook)
+        repo.configAdd("test2-mux.pre-commit", hook)
+        # Other hooks still get all of their files.
+        repo.configAdd("test2-mux.pre-commit", other)
+        repo.commit("--allow-empty")
+
+        with open(repo.path(".git", "calls")) as f:
+          self.assertEqual(f.read().splitlines(), expected)
+
+        # The ledger only lives for the duration of the run.
+        if dedupe:
+          self.assertEqual(listdir(repo.path(".git", "hook-mux")), [])
+
+    doTest(False, ["file1.txt file2.txt", "file2.txt file3.txt"])
+    doTest(True, ["file1.txt file2.txt", "file3.txt"])
+
+
+  def testRecordReplay(self):
+    """Verify that runs can be recorded and replayed elsewhere."""
+    with TemporaryDirectory() as directory, TemporaryDirectory() as elsewhere,\
+         GitRepository() as repo:
+      file_cmd = "%s diff --staged --name-only --no-color --no-prefix" % GIT
+      hook = "%s -c 'from sys import argv; from time import sleep; sleep(0.2); "\
+             "print(*argv[1:], file=open(\"calls\", \"a\"))'"
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux --file-cmd=\"%s\"" % file_cmd)
+      repo.configAdd("test1-mux.pre-commit", hook % executable)
+
+      write(repo, "file1.txt", data="data1")
+      repo.add("file1.txt")
+      repo.commit(env={"GIT_HOOK_MUX_RECORD": directory})
+
+      records = [join(directory, name) for name in listdir(directory)]
+      self.assertEqual(len(records), 2)
+
+      nested = None
+      for record in records:
+        with open(record) as f:
+          record = loads(f.read())
+          if "--section=test1-mux" in record["argv"]:
+            nested = record
+
+      self.assertEqual(nested["batches"], [["file1.txt"]])
+      self.assertEqual(len(nested["hooks"]), 1)
+      self.assertGreaterEqual(nested["hooks"][0]["duration"], 0.2)
+
+      # Replaying works without the repository and by default does not
+      # run the actual hooks.
+      env = {}
+      PathMixin.inheritEnv(env)
+      PythonMixin.inheritEnv(env)
+      script = repo.path(".git", "hooks", "git-hook-mux.py")
+      replay = [executable, script, "replay", directory]
+
+      out = execute(*replay, env=env, cwd=elsewhere, stdout=b"", stderr=None)
+      self.assertRegex(out.decode("utf-8"), r"status: 0 \(recorded: 0\), duration: [0-9.]+s")
+      self.assertFalse(exists(join(elsewhere, "calls")))
+
+      execute(*replay, "--hooks=real", env=env, cwd=elsewhere, stderr=None)
+      with open(join(elsewhere, "calls")) as f:
+        self.assertEqual(f.read(), "file1.txt\n")
+
+
+  def testPushedFiles(self):
+    """Verify that the files changed by the commits being pushed are passed to hooks."""
+    with GitRepository() as repo, TemporaryDirectory() as remote:
+      execute(GIT, "init", "--bare", remote)
+      repo.git("remote", "add", "origin", remote)
+
+      script = repo.path(".git", "hooks", "git-hook-mux.py")
+      symlink(script, repo.path(".git", "hooks", "pre-push"))
+
+      # The hook logs the number of refs it got on stdin as well as the
+      # files it got invoked with.
+      hook = "%s -c 'from sys import argv, stdin; "\
+             "print(len(stdin.readlines()), *sorted(argv[1:]), file=open(\".git/calls\", \"a\"))'"
+      repo.configAdd("hook-mux.pre-push", "<self> --section=push-mux --pushed-files")
+      repo.configAdd("push-mux.pre-push", hook % executable)
+
+      def calls():
+        """Retrieve and reset the invocations of the hook."""
+        try:
+          with open(repo.path(".git", "calls")) as f:
+            return f.read().splitlines()
+        finally:
+          unlink(repo.path(".git", "calls"))
+
+      write(repo, "file1.txt", data="data1")
+      repo.add("file1.txt")
+      repo.commit()
+
+      # The branch does not yet exist on the remote, so its entire
+      # history is checked.
+      repo.git("push", "origin", "master:master", "master:other")
+      self.assertEqual(calls(), ["2 file1.txt"])
+
+      write(repo, "file2.txt", data="data2")
+      write(repo, "file3.txt", data="data3")
+      repo.add("file2.txt", "file3.txt")
+      repo.commit()
+
+      write(repo, "file2.txt", data="data4")
+      write(repo, "file4.txt", data="data4")
+      repo.add("file2.txt", "file4.txt")
+      repo.commit()
+
+      # Files removed again are not of interest.
+      repo.git("rm", "file4.txt")
+      repo.commit()
+
+      repo.git("push", "origin", "master:master")
+      self.assertEqual(calls(), ["1 file2.txt file3.txt"])
+
+      # A branch pointing to commits already on the remote has no new
+      # files. Neither does deleting a branch.
+      repo.git("push", "origin", "master:another", ":other")
+      self.assertFalse(exists(repo.path(".git", "calls")))
+
+
+  def testSpeculativeValidation(self):
+    """Verify that files can be checked speculatively to populate the cache."""
+    with GitRepository() as repo:
+      file_cmd = "%s diff --staged --name-only --diff-filter=AM --no-color --no-prefix" % GIT
+      hook = "%s -c 'from sys import argv; print(*argv[1:], file=open(\".git/calls\", \"a\"))'" % executable
+
+      repo.configAdd("hook-mux.pre-commit", "<self> --section=test1-mux --file-cmd=\"%s\"" % file_cmd)
+      repo.configAdd("test1-mux.cache", "true")
+      repo.configAdd("test1-mux.pre-commit", hook)
+      # Hooks whose results cannot be cached are not run speculatively.
+      repo.configAdd("test1-mux.pre-commit", "<self> --section=test2-mux")
+      repo.configAdd("test2-mux.pre-commit", "%s -c 'exit(1)'" % executable)
+
+      def calls():
+        """Retrieve and reset the files the hook got invoked with."""
+        if not exists(repo.path(".git", "calls")):
+          return []
+        try:
+          with open(repo.path(".git", "calls")) as f:
+            return f.read().split()
+        finally:
+          unlink(repo.path(".git", "calls"))
+
+      write(repo, "file1.txt", data="data1")
+      repo.mux("watch", "--section=test1-mux", "--once")
+      self.assertEqual(calls(), ["file1.txt"])
+
+      # The file changed so the hook would have to run again.
+      write(repo, "file1.txt", data="data2")
+
+      def watch():
+        """Watch the repository for a limited time."""
+        repo.mux("watch", "--section=test1-mux", "--idle=0.2", "--timeout=3")
+
+      thread = Thread(target=watch)
+      thread.start()
+      sleep(1)
+      write(repo, "file2.txt", data="data3")
+      thread.join()
+
+      # Pending changes are checked on startup, later ones as they occur.
+      self.assertEqual(calls(), ["file1.txt", "file2.txt"])
+
+      # The results for both files are reused, only test2-mux is run and
+      # it fails.
+      repo.add("file1.txt", "file2.txt")
+      with self.assertRaisesRegex(ProcessError, r"Status 1"):
+        repo.commit()
+
+      self.assertEqual(calls(), [])
+
+
+  def testSubmodules(self):
+    """Verify that hooks are run in all submodules with staged changes."""
+    with Repository(GIT) as sub, GitRepository() as repo:
+      write(sub, "file.txt", data="data")
+      sub.add("file.txt")
+      sub.commit()
+
+      for name in ("sub1", "sub2", "sub3"):
+        repo.submoduleAdd(sub.path(), name)
+
+      repo.commit()
+      repo.configAdd("hook-mux.pre-commit", "<self> --submodules --jobs=2 --section=sub-mux")
+
+      # Each submodule's hook creates a marker file so that we can check
+      # where it was run.
+      marker = "%s -c 'open(\"marker\", \"w\")'" % executable
+      hooks = {
+        "sub1": "%s -c 'exit(42)'" % executable,
+        "sub2": marker,
+        "sub3": marker,
+      }
+      for name, hook in hooks.items():
+        repo.git("-C", name, "config", "--local", "--add", "sub-mux.pre-commit", hook)
+
+      # Only sub1 and sub3 have staged changes, sub2 stays untouched.
+      for name in ("sub1", "sub3"):
+        write(repo, name, "new.txt", data="new")
+        repo.git("-C", name, "add", "new.txt")
+
+      with self.assertRaisesRegex(ProcessError, r"sub1: \[Status 42\]"):
+        repo.commit("--allow-empty")
+
+      self.assertFalse(exists(repo.path("sub2", "marker")))
+      self.assertTrue(exists(repo.path("sub3", "marker")))
+
+
 if __name__ == "__main__":
   main()
@@ -0,0 +1,166 @@
+# watch.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""The command checking files in the background as they change."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.cleanup import (
+  defer,
+)
+from deso.execute import (
+  execute,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  GIT,
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  SPECULATIVE_VARIABLE,
+)
+from deso.git.hook.mux.files import (
+  filterIgnored,
+  retrieveChangedFiles,
+)
+from os import (
+  environ,
+  nice,
+)
+from os.path import (
+  abspath,
+  exists,
+  join,
+)
+from sys import (
+  executable,
+  stdout,
+)
+from time import (
+  monotonic,
+)
+
+
+def watch(argv):
+  """Watch the worktree and run file hooks on changed files in the background."""
+  parser = ArgumentParser(prog="%s watch" % PROGRAM)
+  parser.add_argument(
+    "-s", "--section", action="store", default=GIT_HOOK_SECTION,
+    dest="section",
+    help="The name of the git-config(1) section to pass changed files "
+         "to (defaults to '%s')." % GIT_HOOK_SECTION,
+  )
+  parser.add_argument(
+    "-t", "--hook-type", action="store", default="pre-commit",
+    dest="hook_type",
+    help="The type of hook to run (defaults to 'pre-commit').",
+  )
+  parser.add_argument(
+    "-i", "--idle", action="store", type=float, default=2.0, dest="idle",
+    help="The number of seconds without changes after which the "
+         "repository is considered idle (defaults to 2).",
+  )
+  parser.add_argument(
+    "-n", "--nice", action="store", type=int, default=10, dest="nice",
+    help="The niceness increment to run with (defaults to 10).",
+  )
+  parser.add_argument(
+    "--timeout", action="store", type=float, default=0, dest="timeout",
+    help="Stop watching after the given number of seconds (defaults to "
+         "0, meaning to never stop).",
+  )
+  parser.add_argument(
+    "--once", action="store_true", default=False, dest="once",
+    help="Only check the currently changed files and exit.",
+  )
+  parser.add_argument(
+    "-v", "--verbose", action="store_true", default=False, dest="verbose",
+    help="Report the files checked and the outcome.",
+  )
+  namespace = parser.parse_args(argv[2:])
+
+  out = execute(GIT, "rev-parse", "--show-toplevel", "--absolute-git-dir",
+                stdout=b"", stderr=None)
+  toplevel, git_dir = out.decode("utf-8").splitlines()
+  lock = join(git_dir, "index.lock")
+
+  this_prog = [executable, abspath(argv[0]), "--hook-type=%s" % namespace.hook_type,
+               "--section=%s" % namespace.section]
+  env = dict(environ)
+  env[SPECULATIVE_VARIABLE] = "1"
+  output = stdout.fileno() if namespace.verbose else None
+
+  # The checks are pure speculation and must not slow down anything
+  # the user does.
+  nice(namespace.nice)
+
+  def check(files):
+    """Check the given files speculatively."""
+    files = filterIgnored(sorted(files), cwd=toplevel)
+    if not files:
+      return
+
+    if namespace.verbose:
+      print("Checking: %s" % " ".join(files))
+      stdout.flush()
+
+    try:
+      execute(*this_prog, *files, env=env, cwd=toplevel, stdout=output, stderr=output)
+    except ProcessError as e:
+      # Failures are not cached and will be reported once the hooks run
+      # for real.
+      if namespace.verbose:
+        print("%s" % e)
+
+  pending = retrieveChangedFiles(cwd=toplevel)
+  if namespace.once:
+    check(pending)
+    return 0
+
+  from deso.git.hook.mux.inotify import (
+    Inotify,
+  )
+
+  inotify = Inotify(toplevel)
+  start = monotonic()
+  last = start
+
+  with defer() as d:
+    d.defer(inotify.close)
+
+    while namespace.timeout <= 0 or monotonic() - start < namespace.timeout:
+      now = monotonic()
+      # We only run the hooks if nothing changed for a while and no git
+      # command is modifying the index.
+      if pending and now - last >= namespace.idle and not exists(lock):
+        check(pending)
+        pending = set()
+        continue
+
+      timeout = namespace.idle if pending else 1.0
+      paths = inotify.read(timeout)
+      if paths is None:
+        # We lost events and have to fall back to asking git.
+        pending |= retrieveChangedFiles(cwd=toplevel)
+        last = monotonic()
+      elif paths:
+        pending |= set(paths)
+        last = monotonic()
+
+  return 0
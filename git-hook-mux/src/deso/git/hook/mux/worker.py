@@ -0,0 +1,401 @@
+# worker.py
+
+#/***************************************************************************
+# *   Copyright (C) 2015-2017 Daniel Mueller (deso@posteo.net)              *
+# *                                                                         *
+# *   This program is free software: you can redistribute it and/or modify  *
+# *   it under the terms of the GNU General Public License as published by  *
+# *   the Free Software Foundation, either version 3 of the License, or     *
+# *   (at your option) any later version.                                   *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU General Public License for more details.                          *
+# *                                                                         *
+# *   You should have received a copy of the GNU General Public License     *
+# *   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+# ***************************************************************************/
+
+"""Long-lived hook processes serving requests on behalf of many invocations."""
+
+from argparse import (
+  ArgumentParser,
+)
+from deso.execute import (
+  execute,
+  formatCommands,
+  ProcessError,
+)
+from deso.git.hook.mux.config import (
+  GIT_HOOK_SECTION,
+  PROGRAM,
+  configBool,
+  configFloat,
+  configInt,
+  configValues,
+)
+from deso.git.hook.mux.daemon import (
+  createPrivateDirectory,
+  listenDaemon,
+  retrieveRuntimeDirectory,
+  startDaemon,
+)
+from deso.git.hook.mux.files import (
+  fileArguments,
+  writeAll,
+)
+from hashlib import (
+  sha1,
+)
+from json import (
+  dumps,
+  loads,
+)
+from os import (
+  O_CLOEXEC,
+  close,
+  environ,
+  getpid,
+  kill,
+  listdir,
+  pipe2,
+  read,
+  stat,
+  unlink,
+  write,
+)
+from os.path import (
+  abspath,
+  join,
+  realpath,
+)
+from select import (
+  POLLIN,
+  poll,
+)
+from signal import (
+  SIGTERM,
+)
+from socket import (
+  timeout as SocketTimeout,
+)
+from sys import (
+  stdout,
+  stderr,
+)
+from threading import (
+  Thread,
+)
+from time import (
+  monotonic,
+  time,
+)
+
+
+# The environment variable containing the version of the worker protocol
+# a hook is expected to speak, if it is run as a worker.
+WORKER_VARIABLE = "GIT_HOOK_MUX_WORKER"
+# The version of the worker protocol we speak.
+WORKER_PROTOCOL = 1
+# The number of seconds a client has for sending its request, once
+# connected to a worker.
+WORKER_REQUEST_TIMEOUT = 10
+
+
+def retrieveDescendants(pid=None):
+  """Retrieve the IDs of all processes descending from the one with the given ID (or ourselves)."""
+  pid = getpid() if pid is None else pid
+  children = []
+  try:
+    for task in listdir("/proc/%d/task" % pid):
+      with open("/proc/%d/task/%s/children" % (pid, task)) as f:
+        children += [int(child) for child in f.read().split()]
+  except FileNotFoundError:
+    # The process exited in the meantime.
+    return []
+
+  return children + [d for child in children for d in retrieveDescendants(child)]
+
+
+def retrieveMemoryUsage(pids):
+  """Retrieve the resident set size, in bytes, of the processes with the given IDs."""
+  usage = 0
+  for pid in pids:
+    try:
+      with open("/proc/%d/status" % pid) as f:
+        for line in f:
+          if line.startswith("VmRSS:"):
+            usage += int(line.split()[1]) * 1024
+    except FileNotFoundError:
+      pass
+
+  return usage
+
+
+class Worker:
+  """A long-lived hook process speaking the worker protocol on its stdin and stdout."""
+  def __init__(self, command, env=None):
+    """Start a worker by running the given command."""
+    in_r, self._in = pipe2(O_CLOEXEC)
+    self._out, out_w = pipe2(O_CLOEXEC)
+    self._pending = b""
+
+    def run():
+      """Run the worker, connected to our pipes."""
+      try:
+        execute(*command, env=env, stdin=in_r, stdout=out_w, stderr=None)
+      except ProcessError:
+        pass
+      finally:
+        # Only once we closed the write end of the pipe will we see an
+        # end-of-file should the worker exit.
+        close(in_r)
+        close(out_w)
+
+    self._thread = Thread(target=run, daemon=True)
+    self._thread.start()
+
+
+  def _readLine(self, timeout=None):
+    """Read a line from the worker, returning None on end-of-file or timeout."""
+    deadline = None if timeout is None else monotonic() + timeout
+    while b"\n" not in self._pending:
+      p = poll()
+      p.register(self._out, POLLIN)
+      remaining = None if deadline is None else max(deadline - monotonic(), 0) * 1000
+      if not p.poll(remaining):
+        return None
+
+      data = read(self._out, 64 * 1024)
+      if not data:
+        return None
+      self._pending += data
+
+    line, self._pending = self._pending.split(b"\n", 1)
+    return line + b"\n"
+
+
+  def handshake(self, timeout):
+    """Check whether the worker announces support for our protocol version in time."""
+    try:
+      return loads(self._readLine(timeout))["protocol"] == WORKER_PROTOCOL
+    except (KeyError, TypeError, ValueError):
+      return False
+
+
+  def request(self, data, timeout=None):
+    """Pass a request to the worker and return its response, or None if it exited or timed out."""
+    try:
+      while data:
+        data = data[write(self._in, data):]
+    except BrokenPipeError:
+      return None
+
+    return self._readLine(timeout)
+
+
+  def memoryUsage(self):
+    """Retrieve the memory used by the worker and all processes it started."""
+    return retrieveMemoryUsage(retrieveDescendants())
+
+
+  def stop(self):
+    """Stop the worker, terminating it if it does not exit on its own."""
+    # Workers are supposed to exit once they see an end-of-file.
+    close(self._in)
+    self._thread.join(1)
+    if self._thread.is_alive():
+      for pid in retrieveDescendants():
+        try:
+          kill(pid, SIGTERM)
+        except ProcessLookupError:
+          pass
+      self._thread.join()
+    close(self._out)
+
+
+def serveWorker(argv):
+  """Start a worker and serve requests for it on a socket until it was idle for too long."""
+  parser = ArgumentParser()
+  parser.add_argument("base")
+  parser.add_argument("idle", type=float)
+  parser.add_argument("memory", type=int)
+  parser.add_argument("startup", type=float)
+  parser.add_argument("response", type=float)
+  parser.add_argument("command", nargs="+")
+  namespace = parser.parse_args(argv)
+
+  env = dict(environ)
+  env[WORKER_VARIABLE] = str(WORKER_PROTOCOL)
+  worker = Worker(namespace.command, env)
+  path = namespace.base + ".sock"
+  bound = False
+
+  try:
+    if not worker.handshake(namespace.startup):
+      # Remember that the hook has to be run the conventional way.
+      open(namespace.base + ".unsupported", "w").close()
+      return 1
+
+    with listenDaemon(namespace.base) as server:
+      bound = True
+      server.settimeout(namespace.idle)
+
+      while True:
+        try:
+          connection, _ = server.accept()
+        except SocketTimeout:
+          break
+
+        with connection:
+          # A client stalling (or dying without us noticing) must not
+          # block the worker for everybody else.
+          connection.settimeout(WORKER_REQUEST_TIMEOUT)
+          try:
+            with connection.makefile("rb") as f:
+              request = f.readline()
+          except SocketTimeout:
+            continue
+
+          # A worker not answering in time is considered hung. Stopping
+          # it lets the next client start a fresh one.
+          response = worker.request(request, namespace.response)
+          if response is None:
+            break
+
+          try:
+            connection.sendall(response)
+          except OSError:
+            # The client gave up on us and runs the hook on its own.
+            pass
+
+        if namespace.memory > 0 and worker.memoryUsage() > namespace.memory:
+          break
+
+      # Clients connecting from now on start a new worker. Those that
+      # already connected will see the connection being closed and
+      # fall back to running the hook on their own.
+      unlink(path)
+      bound = False
+  finally:
+    if bound:
+      unlink(path)
+    worker.stop()
+
+  return 0
+
+
+# The number of seconds we run a hook the conventional way after it
+# failed to start up as a worker, before trying again.
+WORKER_UNSUPPORTED_EXPIRY = 3600
+
+
+class WorkerPool:
+  """A pool of long-lived hook workers, kept alive across invocations.
+
+    A worker is started on first use of a hook and serves requests from
+    all invocations running the same hook in the same repository, until
+    it was idle for the given time or exceeded the given amount of
+    memory.
+  """
+  def __init__(self, directory, idle, memory, startup, response):
+    """Create a pool of workers communicating through sockets in the given directory."""
+    self._directory = directory
+    self._idle = idle
+    self._memory = memory
+    self._startup = startup
+    self._response = response
+
+
+  def _acquire(self, hook, command, env):
+    """Connect to the worker for a hook, starting it if necessary."""
+    try:
+      directory = createPrivateDirectory(self._directory)
+    except OSError as e:
+      print("Not using workers: %s" % e, file=stderr)
+      return None
+
+    key = sha1(dumps([realpath("."), hook]).encode("utf-8")).hexdigest()
+    base = join(directory, key)
+    try:
+      # A failed startup may have been a fluke (a loaded system, say),
+      # so we only stick to the conventional way for a while.
+      if time() - stat(base + ".unsupported").st_mtime < WORKER_UNSUPPORTED_EXPIRY:
+        return None
+      unlink(base + ".unsupported")
+    except FileNotFoundError:
+      pass
+
+    # The server reports back by creating either the socket or a marker
+    # signaling that the hook does not support the protocol.
+    args = [
+      repr(self._idle), str(self._memory), repr(self._startup), repr(self._response), "--",
+    ] + command
+    return startDaemon(base, "deso.git.hook.mux.worker", "serveWorker", args, env,
+                       self._startup + 5)
+
+
+  def run(self, hook, command, files, cwd=None, env=None, output=None):
+    """Run a hook by means of a worker.
+
+      The result is False if the hook does not support the worker
+      protocol or the worker became unavailable, in which case the hook
+      has to be run the conventional way. Otherwise the output is
+      written to the given file descriptor and a failure reported by
+      means of a ProcessError.
+    """
+    connection = self._acquire(hook, command, env)
+    if connection is None:
+      return False
+
+    request = {
+      "cwd": abspath(cwd or "."),
+      "env": dict(environ if env is None else env),
+      "files": list(files),
+    }
+    with connection:
+      # A hung worker must not block us forever. We give it a bit more
+      # time than it has itself, so that it gets the chance to clean up.
+      connection.settimeout(self._response + 5)
+      try:
+        connection.sendall(dumps(request).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as f:
+          response = f.readline()
+      except OSError:
+        return False
+
+    try:
+      response = loads(response)
+    except ValueError:
+      return False
+
+    # A worker dying mid-request or speaking some other protocol leaves
+    # us with an unusable response.
+    if (not isinstance(response, dict) or
+        not isinstance(response.get("status"), int) or
+        not isinstance(response.get("output"), str)):
+      return False
+
+    stdout.flush()
+    stderr.flush()
+    writeAll(output, response["output"].encode("utf-8", "surrogateescape"))
+
+    if response["status"] != 0:
+      raise ProcessError(response["status"], formatCommands(command + fileArguments(files)))
+    return True
+
+
+def createWorkerPool(config, section):
+  """Create a WorkerPool object if the given section's hooks are meant to be run as workers."""
+  if not configBool(config, section, "workers"):
+    return None
+
+  # The pool's properties are configured in the default section.
+  directory = configValues(config, GIT_HOOK_SECTION, "worker-directory")
+  directory = directory[-1] if directory else retrieveRuntimeDirectory("%s-workers" % PROGRAM)
+  idle = configFloat(config, GIT_HOOK_SECTION, "worker-idle-timeout", 600)
+  memory = configInt(config, GIT_HOOK_SECTION, "worker-memory") * 1024 * 1024
+  startup = configFloat(config, GIT_HOOK_SECTION, "worker-startup-timeout", 30)
+  response = configFloat(config, GIT_HOOK_SECTION, "worker-response-timeout", 600)
+  return WorkerPool(directory, idle, memory, startup, response)